@@ -0,0 +1,107 @@
+"""
+Per-invocation latency with and without the shared client cache.
+
+Simulates the warm path of a handler: get an EventBridge client and send one
+event. "before" creates the client inside the handler, as the handlers used
+to; "after" gets it from ``uploader_runtime.clients``. The calls go to a
+local keep-alive HTTP endpoint, so connection reuse shows up in the numbers
+(TLS setup against the real endpoint makes the difference larger).
+
+    python -m benchmarks.bench_clients --invocations 500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "lambda", "layer", "python")
+)
+
+from uploader_runtime import clients  # noqa: E402
+
+RESPONSE = json.dumps({"FailedEntryCount": 0, "Entries": [{"EventId": "1"}]}).encode()
+
+
+class EventsEndpoint(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+ENTRY = {"DetailType": "API Status", "Source": "bench", "Detail": "{}"}
+
+
+def before():
+    event_client = boto3.client("events")
+    event_client.put_events(Entries=[ENTRY])
+
+
+def after():
+    event_client = clients.client("events")
+    event_client.put_events(Entries=[ENTRY])
+
+
+def measure(handler, invocations):
+
+    handler()  # first call pays for imports and model loading either way
+    timings = []
+    for _ in range(invocations):
+        start = time.perf_counter()
+        handler()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def report(name, timings):
+
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(
+        f"{name:8} mean {statistics.mean(timings):7.2f} ms"
+        f"  p50 {statistics.median(timings):7.2f} ms  p95 {p95:7.2f} ms"
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--invocations", type=int, default=200)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EventsEndpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["AWS_ENDPOINT_URL_EVENTBRIDGE"] = (
+        f"http://127.0.0.1:{server.server_port}"
+    )
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+
+    report("before", measure(before, args.invocations))
+    report("after", measure(after, args.invocations))
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Cold-start import time and first-invocation latency of every handler.
+
+Each handler under lambda/ is imported in a fresh interpreter with
+``-X importtime`` and invoked twice with a sample event. AWS calls go to a
+local stub endpoint, so the first invocation shows the cost of creating
+clients and loading service models rather than network time. Results are
+checked against the budgets in cold_start_budget.json (import_ms,
+first_invocation_ms, cold_start_ms, warm_invocation_ms; a default and
+per-handler overrides) and the exit status is non-zero if any handler is
+over.
+
+    python -m benchmarks.bench_cold_start
+    python -m benchmarks.bench_cold_start --lazy --runs 5
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+lambda_root = os.path.join(project_root, "lambda")
+layer_root = os.path.join(lambda_root, "layer", "python")
+default_budget = os.path.join(os.path.dirname(__file__), "cold_start_budget.json")
+
+FUNCTION_ARN = "arn:aws:lambda:us-east-1:123456789012:function:bench"
+
+DETAIL = {
+    "Bucket": "inbound",
+    "Key": "processed/reject-1.txt",
+    "LastModified": "2022-10-24T18:19:30+00:00",
+    "eTag": '"b1946ac92492d2347c6235b4d2611184"',
+    "Size": 6,
+    "status": ["ready_for_api"],
+}
+
+STATUS_EVENT = {"detail-type": "API Status", "source": FUNCTION_ARN, "detail": DETAIL}
+
+RECORDS_EVENT = {
+    "Records": [
+        {
+            "messageId": "1",
+            "receiptHandle": "handle",
+            "body": json.dumps({"detail": DETAIL}),
+        }
+    ]
+}
+
+SAMPLE_EVENTS = {
+    "api_rejected": STATUS_EVENT,
+    "api_succeeded": STATUS_EVENT,
+    # a "reject" object, so nothing is copied
+    "call_api": STATUS_EVENT,
+    "coalesce": RECORDS_EVENT,
+    "delete_message": {
+        **STATUS_EVENT,
+        "detail": {
+            **DETAIL,
+            "message": {"queue_url": "QUEUE_URL", "receipt_handle": "handle"},
+        },
+    },
+    "delete_object": STATUS_EVENT,
+    "handle_retries": RECORDS_EVENT,
+    "new_object_received": {
+        "detail-type": "Object Created",
+        "source": "aws.s3",
+        "time": "2022-10-24T18:19:30Z",
+        "detail": {
+            "bucket": {"name": "inbound"},
+            "object": {
+                "key": "processed/a.csv",
+                "etag": "b1946ac92492d2347c6235b4d2611184",
+                "size": 6,
+            },
+        },
+    },
+    "send_to_retry_queue": STATUS_EVENT,
+    "test_api": {"path": "/submit", "body": "hello"},
+}
+
+# canned responses for JSON protocol operations, by X-Amz-Target
+RESPONSES = {
+    "AWSEvents.PutEvents": {"FailedEntryCount": 0, "Entries": [{"EventId": "1"}]},
+    "DynamoDB_20120810.BatchGetItem": {"Responses": {}},
+}
+
+# runs in the fresh interpreter. the handler's own output is hidden so that
+# the last line is the measurement.
+PROBE = """
+import contextlib, importlib, io, json, sys, time
+
+class Context:
+    invoked_function_arn = {arn!r}
+    function_name = "bench"
+    aws_request_id = "1"
+
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+event = json.loads({event!r})
+sys.stderr.write("--- handler imports ---\\n")
+sys.stderr.flush()
+
+start = time.perf_counter()
+module = importlib.import_module({module!r})
+imported = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    module.lambda_handler(event, Context())
+    first = time.perf_counter()
+    module.lambda_handler(event, Context())
+    warm = time.perf_counter()
+
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "first_invocation_ms": (first - imported) * 1000,
+    "warm_invocation_ms": (warm - first) * 1000,
+}}))
+"""
+
+
+class StubEndpoint(BaseHTTPRequestHandler):
+    """Answers every AWS call with a minimal successful response."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def respond(self, status, body=b"", content_type="application/xml"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+
+        request = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        target = self.headers.get("X-Amz-Target")
+        if not target:
+            # S3
+            self.respond(200)
+            return
+
+        response = RESPONSES.get(target, {})
+        if target == "AmazonSQS.SendMessage":
+            # botocore checks the MD5 of the message body
+            body = json.loads(request)["MessageBody"]
+            response = {
+                "MessageId": "1",
+                "MD5OfMessageBody": hashlib.md5(body.encode()).hexdigest(),
+            }
+        self.respond(200, json.dumps(response).encode(), "application/x-amz-json-1.0")
+
+    def do_GET(self):
+        self.respond(200)
+
+    def do_DELETE(self):
+        self.respond(204)
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.respond(200)
+
+    do_HEAD = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def handler_names():
+
+    return sorted(
+        name
+        for name in os.listdir(lambda_root)
+        if os.path.isfile(os.path.join(lambda_root, name, f"{name}.py"))
+    )
+
+
+def parse_importtime(stderr, top=5):
+    """Slowest top-level imports made by the handler module, as
+    ``(module, cumulative_ms)``."""
+
+    lines = stderr.split("--- handler imports ---\n", 1)[-1].splitlines()
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            # nested imports are indented
+            imports.append((name.strip(), int(cumulative) / 1000))
+
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def measure(name, environment):
+
+    event = json.dumps(SAMPLE_EVENTS.get(name, {}))
+    event = event.replace("QUEUE_URL", environment["QUEUE_URL"])
+    probe = PROBE.format(arn=FUNCTION_ARN, event=event, module=name)
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        env={
+            **environment,
+            "PYTHONPATH": os.pathsep.join(
+                [os.path.join(lambda_root, name), layer_root]
+            ),
+        },
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    if result.returncode:
+        raise RuntimeError(f"{name} failed:\n{result.stderr[-2000:]}")
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["imports"] = parse_importtime(result.stderr)
+
+    return timings
+
+
+def over_budget(name, timings, budget):
+
+    limits = {**budget.get("default", {}), **budget.get("handlers", {}).get(name, {})}
+
+    return [
+        f"{name} {metric} {timings[metric]:.0f} ms, budget {limit} ms"
+        for metric, limit in sorted(limits.items())
+        if timings.get(metric, 0) > limit
+    ]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters each")
+    parser.add_argument(
+        "--lazy", action="store_true", help="run the handlers with LAZY_IMPORTS"
+    )
+    parser.add_argument("--budget", default=default_budget)
+    parser.add_argument("handlers", nargs="*", help="default: all of them")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubEndpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    environment = {
+        "PATH": os.environ.get("PATH", ""),
+        "AWS_ENDPOINT_URL": endpoint,
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "OUTBOUND_BUCKET": "outbound",
+        "QUEUE_URL": f"{endpoint}/123456789012/retry",
+        "LATEST_VERSION_TABLE": "versions",
+        "LAZY_IMPORTS": str(args.lazy).lower(),
+    }
+
+    with open(args.budget) as fp:
+        budget = json.load(fp)
+
+    print(
+        f"{'handler':<22}{'import ms':>10}{'first ms':>10}{'cold ms':>9}"
+        f"{'warm ms':>9}  slowest imports"
+    )
+    problems = []
+    for name in args.handlers or handler_names():
+        runs = [measure(name, environment) for _ in range(args.runs)]
+        timings = {
+            metric: statistics.median(run[metric] for run in runs)
+            for metric in ("import_ms", "first_invocation_ms", "warm_invocation_ms")
+        }
+        # with lazy imports the cost moves from one to the other
+        timings["cold_start_ms"] = timings["import_ms"] + timings["first_invocation_ms"]
+        slowest = ", ".join(
+            f"{module} {ms:.0f}" for module, ms in runs[-1]["imports"][:3]
+        )
+        print(
+            f"{name:<22}{timings['import_ms']:>10.1f}"
+            f"{timings['first_invocation_ms']:>10.1f}"
+            f"{timings['cold_start_ms']:>9.1f}"
+            f"{timings['warm_invocation_ms']:>9.1f}  {slowest}"
+        )
+        problems.extend(over_budget(name, timings, budget))
+
+    server.shutdown()
+
+    for problem in problems:
+        print(f"OVER BUDGET: {problem}")
+
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Matches per second for the compiled pattern matcher and the naive recursive
+matcher in ``uploader_runtime.patterns``.
+
+Every event is checked against all of the stack's status rules, the way the
+local simulator routes a PutEvents entry.
+
+    python -m benchmarks.bench_patterns --events 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "lambda", "layer", "python")
+)
+
+from uploader_runtime.patterns import compile_pattern, matches  # noqa: E402
+
+CALL_API = "arn:aws:lambda:us-east-1:123456789012:function:CallApi"
+SOURCES = [
+    "arn:aws:lambda:us-east-1:123456789012:function:NewObjectReceived",
+    "arn:aws:lambda:us-east-1:123456789012:function:HandleRetries",
+    CALL_API,
+]
+
+# the same shape as the stack's rules
+PATTERNS = [
+    {
+        "detail-type": ["Object Created"],
+        "source": ["aws.s3"],
+        "resources": ["arn:aws:s3:::inbound"],
+        "detail": {"object": {"key": [{"prefix": "processed/"}]}},
+    },
+    {
+        "detail-type": ["API Status"],
+        "source": SOURCES,
+        "detail": {"Bucket": ["inbound"], "status": ["ready_for_api"]},
+    },
+    {
+        "detail-type": ["API Status"],
+        "source": [CALL_API],
+        "detail": {
+            "Bucket": ["inbound"],
+            "status": ["succeeded", "duplicate"],
+            "message": {"queue_url": [{"exists": True}]},
+        },
+    },
+    {
+        "detail-type": ["API Status"],
+        "source": [CALL_API],
+        "detail": {"Bucket": ["inbound"], "status": ["succeeded"]},
+    },
+    {
+        "detail-type": ["API Status"],
+        "source": [CALL_API],
+        "detail": {
+            "Bucket": ["inbound"],
+            "status": ["failed"],
+            "message": {"queue_url": [{"exists": False}]},
+        },
+    },
+    {"detail": {"object": {"key": [{"suffix": ".csv"}, {"suffix": ".json"}]}}},
+]
+
+
+def make_events(count, seed=0):
+
+    rng = random.Random(seed)
+    events = []
+    for n in range(count):
+        detail = {
+            "Bucket": "inbound",
+            "Key": f"processed/object-{n}.csv",
+            "status": [rng.choice(["ready_for_api", "succeeded", "failed"])],
+            "Size": rng.randint(0, 1 << 30),
+        }
+        if rng.random() < 0.3:
+            detail["message"] = {"queue_url": "q", "receipt_handle": "r"}
+        events.append(
+            {
+                "detail-type": "API Status",
+                "source": rng.choice(SOURCES),
+                "resources": [],
+                "detail": detail,
+            }
+        )
+
+    return events
+
+
+def measure(name, match, events):
+
+    start = time.perf_counter()
+    matched = 0
+    for event in events:
+        for test in match:
+            matched += test(event)
+    elapsed = time.perf_counter() - start
+
+    checks = len(events) * len(match)
+    print(f"{name:9} {checks / elapsed:12,.0f} matches/s  ({matched} matched)")
+
+    return matched
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=50000)
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+
+    naive = [
+        lambda event, pattern=pattern: matches(pattern, event) for pattern in PATTERNS
+    ]
+    compiled = [compile_pattern(pattern) for pattern in PATTERNS]
+
+    expected = measure("naive", naive, events)
+    if measure("compiled", compiled, events) != expected:
+        raise SystemExit("matchers disagree")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+End-to-end throughput and latency of the upload pipeline.
+
+Pushes synthetic objects through the local simulator of UploaderStack:
+new_object_received -> call_api -> delete_object / delete_message, and for
+"fail" objects send_to_retry_queue -> handle_retries -> call_api. Reports
+p50/p95/p99 latency per stage, objects per second and AWS calls per object.
+
+    python -m benchmarks.bench_pipeline --objects 500 --sizes uniform:1k-256k
+    python -m benchmarks.bench_pipeline --fail-rate 0.1 --reject-rate 0.05
+    python -m benchmarks.bench_pipeline -c RetryMode=event_source --concurrency 16
+
+Objects named "fail" are failed by call_api until they are 120 seconds old,
+so they are backdated to become retryable ``--retry-after`` seconds after
+they are written. In schedule mode the retry rule is run once the first
+pass is done.
+
+``--json`` writes the results; ``--baseline`` compares with an earlier
+result and exits non-zero if throughput dropped or a stage's p95 rose by
+more than ``--tolerance``.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import time
+
+from uploader.simulator.simulator import Simulator, format_report, quiet
+from uploader.simulator.template import load_template, synthesize
+
+# call_api fails "fail" objects younger than this
+FAIL_WINDOW_SECONDS = 120
+
+UNITS = {"": 1, "k": 1024, "m": 1024 * 1024}
+
+
+def parse_size(text):
+
+    text = text.strip().lower().rstrip("b")
+    unit = text[-1:] if text[-1:] in UNITS else ""
+    return int(float(text[: len(text) - len(unit)]) * UNITS[unit])
+
+
+def size_distribution(spec, rng):
+    """Function returning object sizes for ``spec``.
+
+    ``fixed:SIZE``, ``uniform:MIN-MAX`` or ``lognormal:MEDIAN[,SIGMA]``;
+    sizes take k and m suffixes.
+    """
+
+    kind, _, args = spec.partition(":")
+    if kind == "fixed":
+        size = parse_size(args)
+        return lambda: size
+    if kind == "uniform":
+        low, high = (parse_size(value) for value in args.split("-"))
+        return lambda: rng.randint(low, high)
+    if kind == "lognormal":
+        median, _, sigma = args.partition(",")
+        mu = math.log(parse_size(median))
+        sigma = float(sigma or 1.0)
+        return lambda: int(rng.lognormvariate(mu, sigma))
+
+    raise ValueError(f"unknown size distribution {spec}")
+
+
+def object_names(count, fail_rate, reject_rate, rng):
+
+    for n in range(count):
+        draw = rng.random()
+        if draw < fail_rate:
+            yield f"processed/fail-{n:06}.dat"
+        elif draw < fail_rate + reject_rate:
+            yield f"processed/reject-{n:06}.dat"
+        else:
+            yield f"processed/object-{n:06}.dat"
+
+
+def run(template, args):
+
+    rng = random.Random(args.seed)
+    next_size = size_distribution(args.sizes, rng)
+    names = list(object_names(args.objects, args.fail_rate, args.reject_rate, rng))
+    total_bytes = 0
+    retryable = None
+    waited = 0
+
+    with Simulator(template, concurrency=args.concurrency, api=args.api) as sim:
+        start = time.perf_counter()
+        with quiet(not args.verbose):
+            for name in names:
+                size = next_size()
+                total_bytes += size
+                age = 0
+                if "fail-" in name:
+                    age = FAIL_WINDOW_SECONDS - args.retry_after
+                    retryable = time.perf_counter() + args.retry_after
+                sim.put_object(name, b"\0" * size, age_seconds=age)
+
+            idle = sim.run_until_idle(timeout=args.timeout)
+
+            if sim.schedules and retryable:
+                # wait until the failed objects can succeed, then run the
+                # retry schedule. event times are whole seconds.
+                waited = max(0, retryable + 1 - time.perf_counter())
+                time.sleep(waited)
+                sim.run_schedules()
+                idle = sim.run_until_idle(timeout=args.timeout) and idle
+
+        # the wait for retries to become possible isn't pipeline time
+        elapsed = time.perf_counter() - start - waited
+        stages = sim.report()
+        calls = sim.calls()
+
+    return {
+        "objects": args.objects,
+        "bytes": total_bytes,
+        "seconds": round(elapsed, 3),
+        "objects_per_second": round(args.objects / elapsed, 1),
+        "aws_calls_per_object": round(sum(calls.values()) / args.objects, 2),
+        "aws_calls": calls,
+        "stages": stages,
+        "idle": idle,
+    }
+
+
+def print_result(result):
+
+    print(format_report(result["stages"]))
+    print()
+    for name, count in sorted(result["aws_calls"].items()):
+        print(f"{name:<40}{count:>8}{count / result['objects']:>8.2f} per object")
+    print()
+    print(
+        f"{result['objects']} objects ({result['bytes']} bytes) in"
+        f" {result['seconds']:.2f}s: {result['objects_per_second']} objects/s,"
+        f" {result['aws_calls_per_object']} AWS calls per object"
+    )
+
+
+def regressions(result, baseline, tolerance):
+    """Differences from ``baseline`` that are worse than ``tolerance``."""
+
+    found = []
+    if result["objects_per_second"] < baseline["objects_per_second"] * (1 - tolerance):
+        found.append(
+            f"throughput {result['objects_per_second']} objects/s,"
+            f" baseline {baseline['objects_per_second']}"
+        )
+    if result["aws_calls_per_object"] > baseline["aws_calls_per_object"] * (
+        1 + tolerance
+    ):
+        found.append(
+            f"{result['aws_calls_per_object']} AWS calls per object,"
+            f" baseline {baseline['aws_calls_per_object']}"
+        )
+    for name, stage in result["stages"].items():
+        before = baseline["stages"].get(name)
+        if before and stage["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            found.append(
+                f"{name} p95 {stage['p95_ms']} ms, baseline {before['p95_ms']} ms"
+            )
+
+    return found
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--objects", type=int, default=200)
+    parser.add_argument(
+        "--sizes",
+        default="lognormal:16k,1.0",
+        help="fixed:SIZE, uniform:MIN-MAX or lognormal:MEDIAN[,SIGMA]",
+    )
+    parser.add_argument("--fail-rate", type=float, default=0.05)
+    parser.add_argument("--reject-rate", type=float, default=0.05)
+    parser.add_argument("--retry-after", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument(
+        "-c", "--context", action="append", default=[], metavar="Name=value"
+    )
+    parser.add_argument("--template", help="synthesized template to use")
+    parser.add_argument(
+        "--api", action="store_true", help="call test_api over HTTP from call_api"
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.template:
+        template = load_template(args.template)
+    else:
+        template = synthesize(dict(item.split("=", 1) for item in args.context))
+
+    result = run(template, args)
+    print_result(result)
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(result, fp, indent=2)
+
+    if not result["idle"]:
+        print("timed out before the pipeline was idle")
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            found = regressions(result, json.load(fp), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        if found:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,2 @@
-import os
-import json
-import boto3
-
-
 def lambda_handler(event, context):
     pass
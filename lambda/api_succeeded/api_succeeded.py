@@ -1,11 +1,9 @@
-import os
-import json
-import boto3
+from uploader_runtime import log
 
 
 def lambda_handler(event, context):
 
-    print(json.dumps(event))
+    log.debug(event)
 
     # sqs = boto3.resource('sqs')
     # s3  = boto3.resource('s3')
@@ -0,0 +1,269 @@
+"""
+Client for the downstream API that objects are submitted to.
+
+The API is called with the object's details as JSON, POSTed to ``API_URL``.
+Connections are pooled and kept alive, so a warm call_api reuses them
+between invocations instead of connecting for every object. urllib3 comes
+with botocore, so the Lambda runtime already has it.
+
+With ``API_SEND_CONTENT`` the object's content is sent instead, streamed
+from S3 into a chunked request a chunk at a time, so memory use doesn't grow
+with the object's size. The details go in an ``X-Object-Detail`` header.
+The content's MD5 is checked against the object's eTag on the way through,
+along with its SHA-256 if S3 has one, and if they don't match the request
+is abandoned before its last chunk, so the API never receives it whole.
+
+The response status decides what happens to the object:
+
+    2xx              succeeded
+    408, 429, 5xx    failed, and retried later
+    other 4xx        rejected
+"""
+
+import gzip
+import json
+import os
+
+import botocore.exceptions
+import urllib3
+
+from uploader_runtime import log
+from checksums import ChecksumMismatch, ObjectDigest, etag_parts
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+REJECTED = "rejected"
+
+# worth retrying: timed out, throttled, or the API's own fault
+RETRYABLE_STATUSES = frozenset([408, 429])
+
+# what the API is told about an object
+FIELDS = ("Bucket", "Key", "VersionId", "eTag", "Size", "LastModified")
+
+# encryption that leaves an object's ETag not an MD5 of its content
+KMS_ENCRYPTION = ("aws:kms", "aws:kms:dsse")
+
+# the object is no longer the one in the event
+GONE_ERRORS = ("PreconditionFailed", "NoSuchKey", "NoSuchVersion")
+
+# a multipart object's parts are looked up one HeadObject call at a time.
+# the ETag of an object with more parts than this isn't checked.
+MAX_PART_LOOKUPS = 100
+
+
+def api_status(status_code):
+    """Pipeline status for an HTTP response status."""
+
+    if 200 <= status_code < 300:
+        return SUCCEEDED
+    if status_code in RETRYABLE_STATUSES or status_code >= 500:
+        return FAILED
+    if 400 <= status_code < 500:
+        return REJECTED
+
+    # e.g. a redirect, which isn't followed
+    return FAILED
+
+
+def object_details(detail):
+    return {name: detail[name] for name in FIELDS if name in detail}
+
+
+def part_sizes(source, etag, s3_client):
+    """Size of each part of the multipart object with ``etag``, or None if it
+    has too many parts to look up."""
+
+    parts = etag_parts(etag)
+    if parts > MAX_PART_LOOKUPS:
+        return None
+
+    return [
+        s3_client.head_object(**source, PartNumber=number)["ContentLength"]
+        for number in range(1, parts + 1)
+    ]
+
+
+def content_chunks(body, digest, chunk_bytes):
+    """Chunks of a StreamingBody, added to ``digest`` as they go by.
+
+    Raises ChecksumMismatch after the last chunk if the content doesn't
+    match, which stops the request before it is complete.
+    """
+
+    for chunk in iter(lambda: body.read(chunk_bytes), b""):
+        digest.update(chunk)
+        yield chunk
+
+    digest.verify()
+
+
+class ApiClient:
+    """Submits objects to the API at ``url``.
+
+    :param str url: endpoint the objects are POSTed to
+    :param float connect_timeout: seconds to wait for a connection
+    :param float read_timeout: seconds to wait for the response
+    :param int max_connections: connections kept open to the API
+    :param int gzip_min_bytes: request bodies at least this big are gzipped
+    :param bool send_content: send the objects' content, not just details
+    :param int chunk_bytes: size of the chunks the content is sent in
+    """
+
+    def __init__(
+        self,
+        url,
+        connect_timeout=None,
+        read_timeout=None,
+        max_connections=None,
+        gzip_min_bytes=None,
+        send_content=None,
+        chunk_bytes=None,
+    ):
+
+        self.url = url
+        self.send_content = (
+            send_content
+            if send_content is not None
+            else os.environ.get("API_SEND_CONTENT", "").lower() == "true"
+        )
+        self.chunk_bytes = int(
+            chunk_bytes or os.environ.get("API_CHUNK_BYTES", str(1024 * 1024))
+        )
+        self.gzip_min_bytes = int(
+            gzip_min_bytes
+            if gzip_min_bytes is not None
+            else os.environ.get("API_GZIP_MIN_BYTES", "1024")
+        )
+        timeout = urllib3.Timeout(
+            connect=float(
+                connect_timeout or os.environ.get("API_CONNECT_TIMEOUT_SECONDS", "3")
+            ),
+            read=float(
+                read_timeout or os.environ.get("API_READ_TIMEOUT_SECONDS", "20")
+            ),
+        )
+        self.pool = urllib3.PoolManager(
+            num_pools=1,
+            maxsize=int(max_connections or os.environ.get("API_MAX_CONNECTIONS", "10")),
+            # wait for a free connection rather than open one that is
+            # thrown away afterwards
+            block=True,
+            timeout=timeout,
+            # failed objects are retried by the pipeline, with backoff
+            retries=False,
+        )
+
+    def request_body(self, detail):
+        """Body and headers for submitting the object in ``detail``."""
+
+        body = json.dumps(object_details(detail), separators=(",", ":")).encode()
+        headers = {"Content-Type": "application/json"}
+        if len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+
+        return body, headers
+
+    def submit(self, detail):
+        """Submit the object in ``detail`` and return its pipeline status."""
+
+        body, headers = self.request_body(detail)
+        try:
+            response = self.pool.request(
+                "POST", self.url, body=body, headers=headers, redirect=False
+            )
+        except urllib3.exceptions.HTTPError as exc:
+            # connect or read timeout, refused or dropped connection
+            log.error("error calling %s for %s - %s", self.url, detail.get("Key"), exc)
+            return FAILED
+
+        return self.response_status(response, detail)
+
+    def upload(self, detail, s3_client):
+        """Stream the content of the object in ``detail`` to the API and
+        return its pipeline status."""
+
+        source = {"Bucket": detail["Bucket"], "Key": detail["Key"]}
+        if detail.get("VersionId"):
+            source["VersionId"] = detail["VersionId"]
+        etag = detail.get("eTag")
+
+        try:
+            s3_object = s3_client.get_object(
+                **source,
+                # the version in the event, even without a version id
+                **({"IfMatch": etag} if etag else {}),
+                ChecksumMode="ENABLED",
+            )
+            if s3_object.get("ServerSideEncryption") in KMS_ENCRYPTION or (
+                s3_object.get("SSECustomerAlgorithm")
+            ):
+                etag = None
+            sizes = None
+            if etag_parts(etag):
+                sizes = part_sizes(source, etag, s3_client)
+                if sizes is None:
+                    log.warning("not checking the ETag of %s - %s", detail["Key"], etag)
+                    etag = None
+        except s3_client.exceptions.ClientError as exc:
+            log.error("error reading %s - %s", detail["Key"], exc)
+            if exc.response["Error"]["Code"] in GONE_ERRORS:
+                # a later event has the object as it is now, if it still is
+                return REJECTED
+            return FAILED
+
+        digest = ObjectDigest(etag, sizes, s3_object.get("ChecksumSHA256"))
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-Object-Detail": json.dumps(
+                object_details(detail), separators=(",", ":")
+            ),
+        }
+        if digest.content_md5:
+            headers["Content-MD5"] = digest.content_md5
+
+        body = s3_object["Body"]
+        try:
+            response = self.pool.urlopen(
+                "POST",
+                self.url,
+                body=content_chunks(body, digest, self.chunk_bytes),
+                headers=headers,
+                chunked=True,
+                redirect=False,
+            )
+        except ChecksumMismatch as exc:
+            log.error("not sending %s - %s", detail["Key"], exc)
+            return FAILED
+        except botocore.exceptions.BotoCoreError as exc:
+            # the S3 stream broke off
+            log.error("error reading %s - %s", detail["Key"], exc)
+            return FAILED
+        except urllib3.exceptions.HTTPError as exc:
+            log.error("error calling %s for %s - %s", self.url, detail["Key"], exc)
+            return FAILED
+        finally:
+            body.close()
+
+        log.sampled(
+            "sent %s bytes of %s, sha256 %s",
+            digest.size,
+            detail["Key"],
+            digest.sha256.hexdigest(),
+        )
+
+        return self.response_status(response, detail)
+
+    def response_status(self, response, detail):
+
+        status = api_status(response.status)
+        if status != SUCCEEDED:
+            log.warning(
+                "%s returned %s for %s - %s",
+                self.url,
+                response.status,
+                detail.get("Key"),
+                response.data[:200],
+            )
+
+        return status
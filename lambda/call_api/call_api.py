@@ -8,31 +8,174 @@ import os.path
 
 
 import re
-import json
+import uuid
 from datetime import datetime, timezone
-import boto3
 
+from uploader_runtime import clients, events, lazy, log, metrics, retries
+from api_client import ApiClient
+from copy_engine import CopyEngine, MAX_CONCURRENCY
 
+# kept for the life of the execution environment, so the in-memory cache of
+# completed objects carries over between invocations
+idempotency_store = None
+
+# only used when the idempotency table is enabled
+idempotency = lazy.load("uploader_runtime.idempotency")
+
+
+def get_idempotency_store():
+
+    global idempotency_store
+
+    table_name = os.environ.get("IDEMPOTENCY_TABLE")
+    if table_name and not idempotency_store:
+        idempotency_store = idempotency.IdempotencyStore(
+            table_name,
+            lease_seconds=int(os.environ.get("IDEMPOTENCY_LEASE_SECONDS", "300")),
+        )
+
+    return idempotency_store
+
+
+# also kept between invocations, with its open connections to the API
+api_client = None
+
+
+def get_api_client():
+
+    global api_client
+
+    url = os.environ.get("API_URL")
+    if url and not api_client:
+        api_client = ApiClient(url)
+
+    return api_client
+
+
+@metrics.instrument("call_api")
 def lambda_handler(event, context):
 
-    """This method is the lambda event handler
+    """Call the API for a ready_for_api object and report the result.
 
-    :param int num1: The first number
-    :param int num2: The second number
+    :param dict event: EventBridge event whose detail has Bucket, Key and
+        LastModified, and a transfer checkpoint when resuming a copy
 
-    :returns: The answer
+    :returns: dict with the status of the invocation
 
-    :rtype: int
+    :rtype: dict
     """
 
-    if "DEBUG" in os.environ:
-        print(json.dumps(event))
+    log.debug(event)
+
+    # a retried object's message stays in flight until delete_message
+    # removes it. don't let it be received again while this runs.
+    message = event["detail"].get("message")
+    if not message:
+        return process(event, context)
+
+    heartbeat = retries.Heartbeat(
+        clients.client("sqs"),
+        message,
+        attempt=event["detail"].get("attempt", 0),
+        size=event["detail"].get("Size"),
+    )
+    with heartbeat:
+        return process(event, context)
+
+
+def process(event, context):
+    """Send the object to the API, or the stand-in for it, and send its
+    status on."""
 
     event_detail = event["detail"]
+    stage_metrics = metrics.current()
+    stage_metrics.stage_latency(event_detail)
+
+    # skip objects that are already done or being worked on. a resumed copy
+    # carries the token of its original claim.
+    store = get_idempotency_store()
+    claim_token = event_detail.get("claim") or uuid.uuid4().hex
+    object_version = (
+        event_detail["Bucket"],
+        event_detail["Key"],
+        event_detail.get("eTag", ""),
+    )
+    if store:
+        with stage_metrics.timer("Claim"):
+            claim = store.claim(*object_version, claim_token)
+        if claim != idempotency.CLAIMED:
+            log.info("duplicate event for %s (%s)", event_detail["Key"], claim)
+            if claim == idempotency.COMPLETED:
+                # handle it the way the first one was. delete_object removes
+                # an object that succeeded, e.g. when the same content was
+                # uploaded again, and delete_message its retry message so it
+                # doesn't come around again. a rejected one is left alone.
+                outcome = store.outcome(*object_version)
+                detail = event_detail.copy()
+                detail["status"] = ["duplicate" if outcome == "succeeded" else outcome]
+                events.send_status(detail, context.invoked_function_arn)
+            return {"status": "duplicate"}
+
+    client = get_api_client()
+    if client:
+        # the API is where the object goes. there is nothing to copy.
+        result = {}
+        if client.send_content:
+            with stage_metrics.timer("Api"):
+                api_status = client.upload(event_detail, clients.client("s3"))
+            if api_status == "succeeded":
+                stage_metrics.put(
+                    "BytesSent", event_detail.get("Size", 0), metrics.BYTES
+                )
+        else:
+            with stage_metrics.timer("Api"):
+                api_status = client.submit(event_detail)
+    else:
+        api_status, result = simulate_api(event_detail, context)
+        if result is None:
+            if store:
+                store.release(*object_version, claim_token)
+            return {"status": "failed"}
+
+    detail = event_detail.copy()
+    detail["status"] = [api_status]
+    detail.pop("transfer", None)
+    detail.pop("claim", None)
+
+    if "checkpoint" in result:
+        # out of time. send the object back to call_api to finish the copy.
+        detail["status"] = ["ready_for_api"]
+        detail["transfer"] = result["checkpoint"]
+        detail["claim"] = claim_token
+
+    elif store:
+        if api_status == "failed":
+            # let the retry have it
+            store.release(*object_version, claim_token)
+        else:
+            store.complete(*object_version, api_status)
+
+    events.send_status(detail, context.invoked_function_arn)
 
-    s3 = boto3.resource("s3")
+    if "checkpoint" in result:
+        return {"status": "in_progress"}
+
+    return {"status": "success"}
+
+
+def simulate_api(event_detail, context):
+    """Stand-in for the API when API_URL isn't set. The object's filename
+    decides the outcome, and accepted objects are copied to OUTBOUND_BUCKET.
+
+    :returns: the status, and the copy's result, or None if it failed
+    """
+
+    stage_metrics = metrics.current()
+
+    # the copy engine shares the S3 connection pool between its threads
+    s3 = clients.resource("s3", max_pool_connections=max(10, MAX_CONCURRENCY))
     s3_client = s3.meta.client
-    event_client = boto3.client("events")
+    copy_engine = CopyEngine(s3_client)
 
     # for testing, copy the object to another s3 bucket
     # begin TESTING cleverness
@@ -44,8 +187,16 @@ def lambda_handler(event, context):
     now = datetime.now(timezone.utc)
     elapsed_seconds = (now - last_modified).total_seconds()
 
+    target = {"Bucket": target_bucket.name, "Key": f"copied/{source_object.key}"}
+
+    # a multipart copy that ran out of time in an earlier invocation
+    transfer = event_detail.get("transfer")
+
     filename = os.path.basename(source_object.key)
-    if re.search("fail", filename, re.I) and elapsed_seconds < 120:
+    if transfer:
+        # the API already accepted the object. finish copying it.
+        api_status = "succeeded"
+    elif re.search("fail", filename, re.I) and elapsed_seconds < 120:
         # after 120 seconds, let the transfer succeed
         api_status = "failed"
     elif re.search("reject", filename, re.I):
@@ -53,58 +204,40 @@ def lambda_handler(event, context):
     else:
         api_status = "succeeded"
 
+    result = {}
     if api_status == "succeeded":
         try:
-            target_object = target_bucket.Object(f"copied/{source_object.key}")
-
-            target_object.copy_from(
-                CopySource={
-                    "Bucket": source_object.bucket_name,
-                    "Key": source_object.key,
-                },
-                TaggingDirective="COPY",
-            )
-
-            # need to add ElapsedSeconds tag
-
-            response = s3_client.get_object_tagging(
-                Bucket=source_object.bucket_name, Key=source_object.key
-            )
-            tag_set = response["TagSet"]
-
-            target_object.copy(
-                {"Bucket": source_object.bucket_name, "Key": source_object.key}
-            )
-
-            tag_set.append({"Key": "ElapsedSeconds", "Value": str(elapsed_seconds)})
-
-            s3_client.put_object_tagging(
-                Bucket=target_object.bucket_name,
-                Key=target_object.key,
-                Tagging={"TagSet": tag_set},
-            )
+            tag_set = []
+            if not transfer:
+                # the copy replaces the tags, so carry the source tags over
+                # and add ElapsedSeconds. a resumed upload already has them.
+                with stage_metrics.timer("GetObjectTagging"):
+                    response = s3_client.get_object_tagging(
+                        Bucket=source_object.bucket_name, Key=source_object.key
+                    )
+                tag_set = response["TagSet"]
+                tag_set.append({"Key": "ElapsedSeconds", "Value": str(elapsed_seconds)})
+
+            with stage_metrics.timer("Copy"):
+                result = copy_engine.copy(
+                    {"Bucket": source_object.bucket_name, "Key": source_object.key},
+                    target,
+                    tag_set,
+                    size=event_detail.get("Size"),
+                    checkpoint=transfer,
+                    time_left=getattr(context, "get_remaining_time_in_millis", None),
+                )
+            stage_metrics.put("BytesCopied", result["bytes"], metrics.BYTES)
+            log.sampled("copied %s bytes (%s)", result["bytes"], result["strategy"])
 
         except s3_client.exceptions.ClientError as exc:
-            print(f"error copying {source_object} to {target_bucket} - {exc}")
-            return {"status": "failed"}
+            log.error("error copying %s to %s - %s", source_object, target_bucket, exc)
+            return api_status, None
 
-    # end TESTING cleverness
+    elif api_status == "rejected":
+        # nothing more will be copied for this object
+        copy_engine.abort_orphans(target)
 
-    detail = event_detail.copy()
-    detail["status"] = [api_status]
-
-    status_event = {
-        "DetailType": "API Status",
-        "Source": context.invoked_function_arn,
-        "Detail": json.dumps(detail),
-    }
-
-    try:
-        print("sending event")
-        print(json.dumps(status_event))
-        response = event_client.put_events(Entries=[status_event])
-
-    except event_client.exceptions.InternalException as exc:
-        print(f"{exc} - " + json.dumps(status_event))
+    # end TESTING cleverness
 
-    return {"status": "success"}
+    return api_status, result
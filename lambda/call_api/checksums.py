@@ -0,0 +1,129 @@
+"""
+Checksums of an object's content, computed as it is streamed.
+
+S3's ETag is the MD5 of the content for objects uploaded in one piece, and
+for multipart uploads the MD5 of the parts' MD5s followed by the number of
+parts, e.g. ``"9b2cf535f27731c974343645a3985328-3"``. Checking a composite
+ETag needs the size of every part: they are often the same size, but S3
+doesn't require it. Objects encrypted with SSE-KMS or SSE-C have ETags
+that aren't MD5s, so only their SHA-256 can be checked, and only when they
+were uploaded with a whole-object SHA-256 checksum.
+"""
+
+import base64
+import hashlib
+import re
+
+# "<md5>" or "<md5>-<parts>"
+ETAG_PATTERN = re.compile(r"^([0-9a-f]{32})(?:-(\d+))?$")
+
+
+class ChecksumMismatch(ValueError):
+    pass
+
+
+def etag_parts(etag):
+    """Number of parts in a multipart ETag, 0 for any other ETag."""
+
+    match = ETAG_PATTERN.match((etag or "").strip('"'))
+
+    return int(match.group(2) or 0) if match else 0
+
+
+class ObjectDigest:
+    """MD5 in ETag form and SHA-256 of the content passed to ``update``.
+
+    :param str etag: ETag to check the MD5 against, or None
+    :param list part_sizes: size of each part, for a multipart ETag
+    :param str sha256: base64 SHA-256 to check against, or None
+    """
+
+    def __init__(self, etag=None, part_sizes=None, sha256=None):
+
+        self.etag = None
+        self.parts = 0
+        match = ETAG_PATTERN.match((etag or "").strip('"'))
+        if match:
+            self.etag = match.group(0)
+            self.parts = int(match.group(2) or 0)
+            if self.parts and len(part_sizes or []) != self.parts:
+                raise ValueError(f"{self.parts} part sizes needed to check ETag {etag}")
+        self.part_sizes = part_sizes
+        # a composite checksum of the parts can't be checked here
+        self.expected_sha256 = sha256 if sha256 and "-" not in sha256 else None
+
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.part_md5s = []
+        self.part_bytes = 0
+        self.sha256 = hashlib.sha256()
+
+    @property
+    def content_md5(self):
+        """Base64 MD5 of the whole content, when the ETag is one."""
+
+        if not self.etag or self.parts:
+            return None
+
+        return base64.b64encode(bytes.fromhex(self.etag)).decode()
+
+    def update(self, data):
+
+        self.size += len(data)
+        self.sha256.update(data)
+        if not self.parts:
+            self.md5.update(data)
+            return
+
+        view = memoryview(data)
+        while view:
+            part = len(self.part_md5s)
+            if part < self.parts:
+                part_size = self.part_sizes[part]
+                count = min(len(view), part_size - self.part_bytes)
+            else:
+                # more content than the parts add up to. it won't match.
+                part_size = None
+                count = len(view)
+            self.md5.update(view[:count])
+            self.part_bytes += count
+            view = view[count:]
+            if self.part_bytes == part_size:
+                self.part_md5s.append(self.md5.digest())
+                self.md5 = hashlib.md5()
+                self.part_bytes = 0
+
+    def hexdigest(self):
+        """MD5 of the content so far, in the form of the ETag."""
+
+        if not self.parts:
+            return self.md5.hexdigest()
+
+        digests = list(self.part_md5s)
+        if self.part_bytes:
+            digests.append(self.md5.digest())
+
+        return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+    def verify(self):
+        """Raise ChecksumMismatch unless the content matches what is expected
+        of it. Returns the number of checksums checked."""
+
+        checked = 0
+        if self.etag:
+            if self.hexdigest() != self.etag:
+                raise ChecksumMismatch(
+                    f"MD5 {self.hexdigest()} of {self.size} bytes, expected {self.etag}"
+                )
+            checked += 1
+
+        if self.expected_sha256:
+            sha256 = base64.b64encode(self.sha256.digest()).decode()
+            if sha256 != self.expected_sha256:
+                raise ChecksumMismatch(
+                    f"SHA-256 {sha256} of {self.size} bytes,"
+                    f" expected {self.expected_sha256}"
+                )
+            checked += 1
+
+        return checked
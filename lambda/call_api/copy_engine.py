@@ -0,0 +1,258 @@
+"""
+Server-side copy of an S3 object, choosing a strategy by object size.
+
+Objects up to the multipart threshold are copied with a single CopyObject
+call. Larger objects are copied with UploadPartCopy, several parts at a time.
+Either way the object is copied once and the target tags are written as
+part of the copy.
+
+A multipart copy that runs short of time returns a checkpoint (the upload id
+and the parts copied so far) instead of finishing, so a later invocation can
+continue where it left off.
+"""
+
+import os
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlencode
+
+from uploader_runtime import log
+
+MIB = 1024 * 1024
+
+# S3 limits for multipart uploads
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/qfacts.html
+MIN_PART_SIZE = 5 * MIB
+MAX_PARTS = 10000
+MAX_SINGLE_COPY_SIZE = 5 * 1024 * MIB
+
+MULTIPART_THRESHOLD = int(os.environ.get("COPY_MULTIPART_THRESHOLD_MB", "128")) * MIB
+PART_SIZE = int(os.environ.get("COPY_PART_SIZE_MB", "64")) * MIB
+MAX_CONCURRENCY = int(os.environ.get("COPY_MAX_CONCURRENCY", "8"))
+
+# stop starting new parts this long before the invocation times out. parts
+# already running have to finish in this time.
+SAFETY_MARGIN_MS = int(os.environ.get("COPY_SAFETY_MARGIN_MS", "15000"))
+
+# checkpoints with more parts than this are resumed by listing the parts
+MAX_CHECKPOINT_PARTS = 1000
+
+# object attributes that CopyObject carries over but a multipart upload does not
+COPIED_ATTRIBUTES = [
+    "CacheControl",
+    "ContentDisposition",
+    "ContentEncoding",
+    "ContentLanguage",
+    "ContentType",
+    "Expires",
+    "Metadata",
+]
+
+
+def part_ranges(size, part_size=PART_SIZE):
+    """List of ``(part_number, first_byte, last_byte)`` covering ``size`` bytes.
+
+    The part size is raised if necessary to stay within the part count limit.
+    """
+
+    part_size = max(part_size, MIN_PART_SIZE, -(-size // MAX_PARTS))
+
+    return [
+        (part_number, first, min(first + part_size, size) - 1)
+        for part_number, first in enumerate(range(0, size, part_size), start=1)
+    ]
+
+
+def encode_tags(tag_set):
+    """Encode a TagSet the way the Tagging request parameter expects."""
+
+    return urlencode([(tag["Key"], tag["Value"]) for tag in tag_set])
+
+
+class CopyEngine:
+    def __init__(
+        self,
+        s3_client,
+        multipart_threshold=MULTIPART_THRESHOLD,
+        part_size=PART_SIZE,
+        max_concurrency=MAX_CONCURRENCY,
+    ):
+
+        self.s3_client = s3_client
+        # a single CopyObject can't copy more than 5 GB
+        self.multipart_threshold = min(multipart_threshold, MAX_SINGLE_COPY_SIZE)
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+
+    def copy(self, source, target, tag_set, size=None, checkpoint=None, time_left=None):
+        """Copy ``source`` to ``target`` and apply ``tag_set`` to the copy.
+
+        ``source`` and ``target`` are dicts with Bucket and Key. Pass ``size``
+        if it is already known to save a HeadObject call on small objects.
+
+        A multipart copy stops starting new parts when ``time_left()`` (in
+        milliseconds) drops below the safety margin. The result then has a
+        ``checkpoint`` that can be passed back in to continue the copy.
+
+        :returns: dict with the strategy used, the number of bytes copied so
+            far and, if the copy is unfinished, a checkpoint
+        """
+
+        head = None
+        if size is None and not checkpoint:
+            head = self.s3_client.head_object(**source)
+            size = head["ContentLength"]
+
+        if not checkpoint and size <= self.multipart_threshold:
+            self.s3_client.copy_object(
+                CopySource=source,
+                TaggingDirective="REPLACE",
+                Tagging=encode_tags(tag_set),
+                **target,
+            )
+            return {"strategy": "single", "bytes": size}
+
+        if head is None:
+            head = self.s3_client.head_object(**source)
+
+        return self.multipart_copy(source, target, tag_set, head, checkpoint, time_left)
+
+    def multipart_copy(self, source, target, tag_set, head, checkpoint, time_left):
+
+        size = head["ContentLength"]
+        part_size = self.part_size
+        upload_id, parts = None, {}
+        if checkpoint:
+            upload_id = checkpoint["UploadId"]
+            # the part boundaries have to match the earlier invocations
+            part_size = checkpoint["PartSize"]
+            try:
+                parts = self.completed_parts(target, checkpoint)
+            except self.s3_client.exceptions.NoSuchUpload:
+                log.warning("upload %s no longer exists, starting over", upload_id)
+                upload_id, parts = None, {}
+
+        if not upload_id:
+            attributes = {
+                name: head[name] for name in COPIED_ATTRIBUTES if name in head
+            }
+            upload_id = self.s3_client.create_multipart_upload(
+                Tagging=encode_tags(tag_set), **attributes, **target
+            )["UploadId"]
+
+        def copy_part(part):
+            part_number, first, last = part
+            response = self.s3_client.upload_part_copy(
+                CopySource=source,
+                CopySourceRange=f"bytes={first}-{last}",
+                PartNumber=part_number,
+                UploadId=upload_id,
+                **target,
+            )
+            return part_number, response["CopyPartResult"]["ETag"], last - first + 1
+
+        def out_of_time():
+            return time_left is not None and time_left() < SAFETY_MARGIN_MS
+
+        ranges = part_ranges(size, part_size)
+        todo = [part for part in ranges if part[0] not in parts]
+        todo.reverse()
+        copied = size - sum(last - first + 1 for _, first, last in todo)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                running = set()
+                while todo or running:
+                    while todo and len(running) < self.max_concurrency:
+                        if out_of_time():
+                            todo = []
+                            break
+                        # keep the invocation's metrics and profile
+                        running.add(
+                            executor.submit(
+                                contextvars.copy_context().run, copy_part, todo.pop()
+                            )
+                        )
+                    if not running:
+                        break
+
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        part_number, etag, length = future.result()
+                        parts[part_number] = etag
+                        copied += length
+
+        except Exception:
+            # don't leave an incomplete upload behind
+            self.abort(target, upload_id)
+            raise
+
+        if len(parts) < len(ranges):
+            # out of time. hand back what is needed to pick up from here.
+            return {
+                "strategy": "multipart",
+                "bytes": copied,
+                "checkpoint": make_checkpoint(upload_id, part_size, parts),
+            }
+
+        self.s3_client.complete_multipart_upload(
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": number, "ETag": parts[number]}
+                    for number in sorted(parts)
+                ]
+            },
+            **target,
+        )
+        self.abort_orphans(target, keep=upload_id)
+
+        return {"strategy": "multipart", "bytes": size}
+
+    def completed_parts(self, target, checkpoint):
+        """Parts already copied for the upload in ``checkpoint``.
+
+        Large uploads don't record their parts in the checkpoint, so they
+        are listed from S3.
+        """
+
+        if "Parts" in checkpoint:
+            return {number: etag for number, etag in checkpoint["Parts"]}
+
+        parts = {}
+        paginator = self.s3_client.get_paginator("list_parts")
+        for page in paginator.paginate(UploadId=checkpoint["UploadId"], **target):
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"]
+
+        return parts
+
+    def abort_orphans(self, target, keep=None):
+        """Abort unfinished uploads to the target key, e.g. from an invocation
+        that timed out before it could checkpoint."""
+
+        response = self.s3_client.list_multipart_uploads(
+            Bucket=target["Bucket"], Prefix=target["Key"]
+        )
+        for upload in response.get("Uploads", []):
+            if upload["Key"] != target["Key"] or upload["UploadId"] == keep:
+                continue
+            log.warning("aborting orphaned upload %s", upload["UploadId"])
+            self.abort(target, upload["UploadId"])
+
+    def abort(self, target, upload_id):
+
+        try:
+            self.s3_client.abort_multipart_upload(UploadId=upload_id, **target)
+        except self.s3_client.exceptions.ClientError as exc:
+            log.error("error aborting upload %s - %s", upload_id, exc)
+
+
+def make_checkpoint(upload_id, part_size, parts):
+
+    checkpoint = {"UploadId": upload_id, "PartSize": part_size}
+    # keep the event well under the 256 KB PutEvents limit
+    if len(parts) <= MAX_CHECKPOINT_PARTS:
+        checkpoint["Parts"] = [[number, parts[number]] for number in sorted(parts)]
+
+    return checkpoint
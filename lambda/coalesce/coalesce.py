@@ -0,0 +1,59 @@
+"""
+Drops superseded versions of an object before they reach call_api.
+
+new_object_received holds each new object in the coalesce queue for the
+coalescing window. By the time a message is delivered here, any overwrite of
+the same key within the window has been recorded in the latest version table,
+so only the newest version is sent on as ready_for_api.
+"""
+
+import os
+import json
+
+from uploader_runtime import clients, log, metrics
+from uploader_runtime.events import EventBatcher, batch_item_failures, status_event
+from uploader_runtime.versions import LatestVersions
+
+
+@metrics.instrument("coalesce")
+def lambda_handler(event, context):
+
+    log.debug(event)
+
+    latest_versions = LatestVersions(os.environ.get("LATEST_VERSION_TABLE"))
+    batcher = EventBatcher(clients.client("events"))
+
+    records = [
+        (record["messageId"], json.loads(record["body"])["detail"])
+        for record in event["Records"]
+    ]
+    stage_metrics = metrics.current()
+    with stage_metrics.timer("BatchGetItem"):
+        newest = latest_versions.newest(
+            {(detail["Bucket"], detail["Key"]) for _, detail in records}
+        )
+
+    superseded = 0
+    for message_id, detail in records:
+        if latest_versions.is_superseded(detail, newest):
+            log.sampled("dropping superseded version of %s", detail["Key"])
+            superseded += 1
+            continue
+
+        stage_metrics.stage_latency(detail)
+        detail["status"] = ["ready_for_api"]
+        ready = status_event(detail, context.invoked_function_arn)
+        log.debug(ready)
+        batcher.add(ready, tag=message_id)
+
+    batcher.flush()
+
+    log.info(
+        "%s forwarded, %s superseded, %s failed",
+        len(batcher.succeeded),
+        superseded,
+        len(batcher.failed),
+    )
+
+    # only the records that could not be forwarded are redelivered
+    return batch_item_failures(tag for tag, _ in batcher.failed)
@@ -1,28 +1,68 @@
-import os
 import json
-import boto3
 
+from uploader_runtime import clients, events, log, metrics
 
+
+def delete_records(records, sqs_client):
+    """Delete the retry messages named by a batch of events with
+    DeleteMessageBatch, grouped by queue."""
+
+    failures = []
+    by_queue = {}
+
+    for record in records:
+        try:
+            event_detail = json.loads(record["body"])["detail"]
+            message_data = event_detail["message"]
+            entry = {
+                "Id": record["messageId"],
+                "ReceiptHandle": message_data["receipt_handle"],
+            }
+        except (ValueError, KeyError) as exc:
+            log.error("%s - unreadable event - %s", record["messageId"], exc)
+            failures.append(record["messageId"])
+            continue
+
+        metrics.stage_latency(event_detail)
+        by_queue.setdefault(message_data["queue_url"], []).append(entry)
+
+    for queue_url, entries in by_queue.items():
+        failures.extend(
+            events.sqs_batch_call(
+                "delete_message_batch", queue_url, entries, sqs_client
+            )
+        )
+
+    return events.batch_item_failures(failures)
+
+
+@metrics.instrument("delete_message")
 def lambda_handler(event, context):
 
-    print(json.dumps(event))
+    log.debug(event)
+
+    # DeleteMessageMode=batch
+    if "Records" in event:
+        return delete_records(event["Records"], clients.client("sqs"))
 
     event_detail = event["detail"]
+    metrics.stage_latency(event_detail)
     message_data = event_detail.get("message")
     if not message_data:
-        print("no message found in event")
+        log.error("no message found in event")
         return {"status": "failed"}
 
-    sqs = boto3.resource("sqs")
+    sqs = clients.resource("sqs")
 
     # delete message from Q
     message = sqs.Message(message_data["queue_url"], message_data["receipt_handle"])
 
     try:
-        message.delete()
+        with metrics.timed("DeleteMessage"):
+            message.delete()
         status = "succeeded"
     except sqs.meta.client.exceptions.ClientError as exc:
         status = "failed"
-        print(f"{message} - {exc}")
+        log.error("%s - %s", message, exc)
 
     return {"status": status}
@@ -1,26 +1,98 @@
-import os
 import json
-import boto3
 
+from uploader_runtime import clients, events, log, metrics
 
+# DeleteObjects limit
+MAX_BATCH_KEYS = 1000
+
+
+def delete_records(records, s3_client):
+    """Delete the objects named by a batch of events with DeleteObjects,
+    grouped by bucket. In a versioned bucket the version that was processed
+    is deleted, not whatever is current.
+    """
+
+    failures = []
+    # (key, version) -> message ids, per bucket. the same object can be
+    # in a batch more than once.
+    by_bucket = {}
+
+    for record in records:
+        try:
+            event_detail = json.loads(record["body"])["detail"]
+            bucket, key = event_detail["Bucket"], event_detail["Key"]
+        except (ValueError, KeyError) as exc:
+            log.error("%s - unreadable event - %s", record["messageId"], exc)
+            failures.append(record["messageId"])
+            continue
+
+        metrics.stage_latency(event_detail)
+        object_id = (key, event_detail.get("VersionId"))
+        by_bucket.setdefault(bucket, {}).setdefault(object_id, []).append(
+            record["messageId"]
+        )
+
+    for bucket, objects in by_bucket.items():
+        for batch in events.batches(objects, MAX_BATCH_KEYS):
+            delete = {
+                "Objects": [
+                    {"Key": key, "VersionId": version} if version else {"Key": key}
+                    for key, version in batch
+                ],
+                # only errors are returned
+                "Quiet": True,
+            }
+            try:
+                with metrics.timed("DeleteObjects"):
+                    response = s3_client.delete_objects(Bucket=bucket, Delete=delete)
+            except s3_client.exceptions.ClientError as exc:
+                log.error(
+                    "error deleting %s objects from %s - %s", len(batch), bucket, exc
+                )
+                failures.extend(id for object_id in batch for id in objects[object_id])
+                continue
+
+            for error in response.get("Errors", []):
+                log.error(
+                    "error deleting %s - %s: %s",
+                    error["Key"],
+                    error["Code"],
+                    error.get("Message"),
+                )
+                failures.extend(objects.get((error["Key"], error.get("VersionId")), []))
+
+    return events.batch_item_failures(failures)
+
+
+@metrics.instrument("delete_object")
 def lambda_handler(event, context):
 
-    print(json.dumps(event))
+    log.debug(event)
 
-    s3 = boto3.resource("s3")
+    s3 = clients.resource("s3")
     s3_client = s3.meta.client
 
+    # DeleteObjectMode=batch
+    if "Records" in event:
+        return delete_records(event["Records"], s3_client)
+
     event_detail = event["detail"]
+    metrics.stage_latency(event_detail)
 
     # delete the object from the originating bucket
     s3_object = s3.Object(event_detail["Bucket"], event_detail["Key"])
+    version = {}
+    if event_detail.get("VersionId"):
+        # the version that was processed, in a versioned bucket
+        version["VersionId"] = event_detail["VersionId"]
 
     try:
-        s3_object.delete()
+        with metrics.timed("DeleteObject"):
+            s3_object.delete(**version)
         status = "succeeded"
 
     except s3_client.exceptions.ClientError as exc:
-        print(f"error deleting {s3_object} - {exc}")
+        log.error("error deleting %s - %s", s3_object, exc)
         status = "failed"
 
     return {"status": status}
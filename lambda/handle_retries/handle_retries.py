@@ -1,78 +1,285 @@
-import sys
 import os
-import json
-from datetime import datetime, timedelta, timezone
-import boto3
+import time
+import contextvars
 
+from uploader_runtime import clients, lazy, log, metrics, retries
+from uploader_runtime.events import (
+    EventBatcher,
+    batch_item_failures,
+    sqs_batch_call,
+    status_event,
+)
 
-def lambda_handler(event, context):
+# number of concurrent receive/forward workers
+POLLER_COUNT = int(os.environ.get("POLLER_COUNT", "4"))
 
-    if "DEBUG" in os.environ:
-        print(json.dumps(event))
+# long poll duration for each receive
+RECEIVE_WAIT_SECONDS = int(os.environ.get("RECEIVE_WAIT_SECONDS", "15"))
 
-    # https://docs.aws.amazon.com/AWSSimpleQueueService/latest/SQSDeveloperGuide/sqs-basic-architecture.html
+# stop polling this long before the invocation times out, leaving room to
+# forward the last batch
+SAFETY_MARGIN_MS = int(os.environ.get("SAFETY_MARGIN_MS", "5000"))
 
-    queue_url = os.environ.get("QUEUE_URL")
-    sqs = boto3.resource("sqs")
-    sqs_client = sqs.meta.client
-    # sqs_client = boto3.client('sqs')
+# the pollers only run on the schedule, not for event source batches
+futures = lazy.load("concurrent.futures")
+
+DEFAULT_TIMEOUT_MS = 60 * 1000
+
+
+def remaining_millis(context, start):
+    """Milliseconds left in this invocation.
+
+    Falls back to the function's 60 second timeout when there is no Lambda
+    context, e.g. when run from the command line.
+    """
+
+    if hasattr(context, "get_remaining_time_in_millis"):
+        return context.get_remaining_time_in_millis()
+
+    return DEFAULT_TIMEOUT_MS - (time.monotonic() - start) * 1000
+
+
+def ready_detail(body, message=None, receive_count=1):
+    """The ready_for_api detail for a retry message body."""
+
+    detail = retries.decode(body)
+    metrics.stage_latency(detail)
+
+    # earlier receives of the same message were failed attempts too
+    attempt = detail.get("attempt", 0) + receive_count - 1
+    if attempt:
+        detail["attempt"] = attempt
+
+    detail["status"] = ["ready_for_api"]
+    if message:
+        detail["message"] = message
+
+    return detail
+
+
+def ready_event(detail, lambda_arn):
+    """Build the event to send to the event bus."""
 
-    event_client = boto3.client("events")
-    lambda_arn = context.invoked_function_arn
+    ready = status_event(detail, lambda_arn)
+    log.debug(ready)
 
-    retry_queue = sqs.Queue(queue_url)
-    start_time = datetime.now(timezone.utc)
-    end_time = start_time + timedelta(minutes=1)
+    return ready
 
-    messages_processed = 0
-    done = False
-    # check context value for time remaining?
-    while not done:
+
+def record_attempts(detail):
+    """Record how many attempts an object has failed. The count is carried
+    in the retry record, so it holds whether a retry is a new message or the
+    same message received again."""
+
+    stage_metrics = metrics.current()
+    if stage_metrics:
+        stage_metrics.put("RetryAttempts", detail.get("attempt", 0))
+
+
+def back_off(entries, queue_url, sqs_client):
+    """Set the visibility timeout of received messages."""
+
+    # those that fail come back after the queue's visibility timeout instead
+    sqs_batch_call("change_message_visibility_batch", queue_url, entries, sqs_client)
+
+
+def dead_letter(messages, queue_url, sqs_client):
+    """Move the messages of objects that are out of attempts from the retry
+    Q to the dead-letter queue."""
+
+    dead_letter_queue_url = retries.dead_letter_queue_url()
+    entries = []
+    receipt_handles = {}
+    for message, detail in messages:
+        log.warning("giving up on %s", detail.get("Key"))
+        entries.append(
+            {"Id": message["MessageId"], "MessageBody": retries.encode(detail)}
+        )
+        receipt_handles[message["MessageId"]] = message["ReceiptHandle"]
+
+    try:
+        with metrics.timed("SendMessageBatch"):
+            response = sqs_client.send_message_batch(
+                QueueUrl=dead_letter_queue_url, Entries=entries
+            )
+        # the others come round again and are moved then
+        sent = [entry["Id"] for entry in response.get("Successful", [])]
+        if sent:
+            with metrics.timed("DeleteMessageBatch"):
+                sqs_client.delete_message_batch(
+                    QueueUrl=queue_url,
+                    Entries=[
+                        {"Id": id, "ReceiptHandle": receipt_handles[id]} for id in sent
+                    ],
+                )
+    except sqs_client.exceptions.ClientError as exc:
+        log.error("%s - %s", dead_letter_queue_url, exc)
+
+
+def forward(messages, queue_url, lambda_arn, batcher, sqs_client):
+    """Send a ready_for_api event for each retry message."""
+
+    ready = []
+    visibility = []
+    dead = []
+    for message in messages:
+        attributes = message.get("Attributes", {})
+        # the message stays in flight. delete_message removes it from the Q
+        # once the API call succeeds.
         try:
-            messages = retry_queue.receive_messages(
-                #             VisibilityTimeout=60,
-                MaxNumberOfMessages=10,
-                WaitTimeSeconds=15,
+            detail = ready_detail(
+                message["Body"],
+                message={
+                    "queue_url": queue_url,
+                    "receipt_handle": message["ReceiptHandle"],
+                },
+                receive_count=int(attributes.get("ApproximateReceiveCount", 1)),
             )
+        except (ValueError, KeyError) as exc:
+            # left alone, it keeps coming back until the redrive policy
+            # moves it to the dead-letter queue
+            log.error("%s - unreadable retry message - %s", message["MessageId"], exc)
+            continue
+        record_attempts(detail)
+        if retries.exhausted(detail):
+            dead.append((message, detail))
+            continue
+
+        ready.append((ready_event(detail, lambda_arn), message["MessageId"]))
+        # if the API call fails, the message comes back once the backoff
+        # after one more failed attempt has passed
+        visibility.append(
+            {
+                "Id": message["MessageId"],
+                "ReceiptHandle": message["ReceiptHandle"],
+                "VisibilityTimeout": retries.visibility_timeout(
+                    detail.get("attempt", 0) + 1, detail.get("Size")
+                ),
+            }
+        )
+
+    if dead:
+        dead_letter(dead, queue_url, sqs_client)
+
+    # before forwarding, while the messages can't have been deleted yet
+    back_off(visibility, queue_url, sqs_client)
+
+    for event, message_id in ready:
+        batcher.add(event, tag=message_id)
+
+    # one PutEvents call per receive. messages that could not be forwarded
+    # stay in flight and reappear after the visibility timeout.
+    batcher.flush()
+
+
+def forward_records(records, lambda_arn, event_client):
+    """Handle a batch delivered by an SQS event source mapping.
+
+    Lambda deletes the records that are not listed in the response, so the
+    forwarded events don't carry the message. If the API call fails again,
+    send_to_retry_queue puts a new message in the Q.
+    """
+
+    batcher = EventBatcher(event_client)
+    failures = []
+
+    for record in records:
+        try:
+            detail = ready_detail(record["body"])
+            event = ready_event(detail, lambda_arn)
+        except (ValueError, KeyError) as exc:
+            log.error("%s - unreadable retry message - %s", record["messageId"], exc)
+            failures.append(record["messageId"])
+            continue
+        record_attempts(detail)
+
+        batcher.add(event, tag=record["messageId"])
+
+    batcher.flush()
+    failures.extend(tag for tag, _ in batcher.failed)
+
+    return batch_item_failures(failures)
+
+
+def poll(queue_url, lambda_arn, sqs_client, event_client, time_left):
+    """Receive and forward messages until the queue is empty or time runs out."""
+
+    batcher = EventBatcher(event_client)
+
+    while True:
+        # don't start a long poll that could outlive the invocation
+        budget_seconds = (time_left() - SAFETY_MARGIN_MS) / 1000
+        if budget_seconds <= 0:
+            break
+        wait_seconds = int(min(RECEIVE_WAIT_SECONDS, budget_seconds))
+
+        try:
+            with metrics.timed("ReceiveMessage"):
+                response = sqs_client.receive_message(
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=10,
+                    WaitTimeSeconds=wait_seconds,
+                    AttributeNames=["ApproximateReceiveCount"],
+                )
         except sqs_client.exceptions.ClientError as exc:
-            print(f"{queue_url} - {exc}")
+            log.error("%s - %s", queue_url, exc)
             break
 
+        messages = response.get("Messages", [])
         if not messages:
-            done = True
-            continue
+            break
 
-        for message in messages:
-            print(message.message_id)
-            body = json.loads(message.body)
+        forward(messages, queue_url, lambda_arn, batcher, sqs_client)
 
-            detail = (body["detail"]).copy()
+    return batcher
 
-            # create a new event to send to the event bus
-            detail["status"] = ["ready_for_api"]
-            detail["message"] = {
-                "queue_url": queue_url,
-                "receipt_handle": message.receipt_handle,
-            }
 
-            status_event = {
-                "DetailType": "API Status",
-                "Source": lambda_arn,
-                "Detail": json.dumps(detail),
-            }
+@metrics.instrument("handle_retries")
+def lambda_handler(event, context):
 
-            try:
-                print("sending event")
-                print(json.dumps(status_event))
-                response = event_client.put_events(Entries=[status_event])
-                messages_processed += 1
+    log.debug(event)
 
-            except event_client.exceptions.InternalException as exc:
-                print(f"{exc} - " + json.dumps(status_event))
+    # https://docs.aws.amazon.com/AWSSimpleQueueService/latest/SQSDeveloperGuide/sqs-basic-architecture.html
+
+    start = time.monotonic()
+    lambda_arn = getattr(context, "invoked_function_arn", "handle_retries")
+
+    # invoked by the SQS event source mapping
+    if "Records" in event:
+        return forward_records(event["Records"], lambda_arn, clients.client("events"))
+
+    # invoked by the schedule. drain the Q.
+    queue_url = os.environ.get("QUEUE_URL")
+
+    # clients are thread safe, resources are not. each poller holds a
+    # connection open while it long polls.
+    sqs_client = clients.client("sqs", max_pool_connections=max(10, POLLER_COUNT))
+    event_client = clients.client("events")
 
-        done = datetime.now(timezone.utc) >= end_time
+    def time_left():
+        return remaining_millis(context, start)
+
+    with futures.ThreadPoolExecutor(max_workers=POLLER_COUNT) as executor:
+        # the pollers record into this invocation's metrics
+        pollers = [
+            executor.submit(
+                contextvars.copy_context().run,
+                poll,
+                queue_url,
+                lambda_arn,
+                sqs_client,
+                event_client,
+                time_left,
+            )
+            for _ in range(POLLER_COUNT)
+        ]
+        batchers = [poller.result() for poller in pollers]
 
-    return {"messages_processed": messages_processed}
+    return {
+        "messages_processed": sum(len(b.succeeded) for b in batchers),
+        "messages_failed": sum(len(b.failed) for b in batchers),
+        "put_events_calls": sum(b.calls for b in batchers),
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+"""
+Runtime code shared by the uploader Lambda functions.
+
+Deployed as a Lambda layer; the package is importable from every handler.
+"""
@@ -0,0 +1,119 @@
+"""
+boto3 clients and resources shared by every invocation in an execution
+environment.
+
+Creating a client resolves credentials, loads the service model and sets up
+the endpoint, and its connection pool is thrown away with it. Handlers get
+their clients from here so that work (and the open connections) carry over
+to the next warm invocation.
+
+Connection settings come from the environment:
+
+``CLIENT_MAX_POOL_CONNECTIONS``
+    connections kept open per client (default 10)
+``CLIENT_RETRY_MODE``
+    botocore retry mode, ``standard`` or ``adaptive`` (default standard)
+``CLIENT_MAX_ATTEMPTS``
+    attempts per call, including the first (default 3)
+``CLIENT_CONNECT_TIMEOUT``, ``CLIENT_READ_TIMEOUT``
+    socket timeouts in seconds (default 5 and 30). The read timeout has to
+    be longer than an SQS long poll.
+"""
+
+import os
+import threading
+
+from uploader_runtime import lazy, profiler
+
+# most of a cold start's import time. with LAZY_IMPORTS it is loaded by the
+# first call that needs a client.
+boto3 = lazy.load("boto3")
+
+_lock = threading.Lock()
+_clients = {}
+_resources = {}
+
+
+def default_config():
+
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=int(os.environ.get("CLIENT_MAX_POOL_CONNECTIONS", "10")),
+        retries={
+            "mode": os.environ.get("CLIENT_RETRY_MODE", "standard"),
+            "total_max_attempts": int(os.environ.get("CLIENT_MAX_ATTEMPTS", "3")),
+        },
+        connect_timeout=float(os.environ.get("CLIENT_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.environ.get("CLIENT_READ_TIMEOUT", "30")),
+    )
+
+
+def _config(overrides):
+
+    from botocore.config import Config
+
+    config = default_config()
+    if overrides:
+        config = config.merge(Config(**overrides))
+
+    return config
+
+
+def _key(service_name, overrides):
+    return (service_name, tuple(sorted(overrides.items())))
+
+
+def client(service_name, **overrides):
+    """A cached ``boto3.client``. Keyword arguments override the default
+    ``botocore.config.Config`` settings, e.g. ``max_pool_connections``."""
+
+    key = _key(service_name, overrides)
+    try:
+        return _clients[key]
+    except KeyError:
+        pass
+
+    # creating clients from the default session is not thread safe
+    with _lock:
+        if key not in _clients:
+            _clients[key] = boto3.client(service_name, config=_config(overrides))
+            if profiler.enabled():
+                profiler.attach(_clients[key].meta.events)
+
+    return _clients[key]
+
+
+def resource(service_name, **overrides):
+    """A cached ``boto3.resource``. Resources are not thread safe; use
+    ``resource(...).meta.client`` or ``client(...)`` from worker threads."""
+
+    key = _key(service_name, overrides)
+    try:
+        return _resources[key]
+    except KeyError:
+        pass
+
+    with _lock:
+        if key not in _resources:
+            _resources[key] = boto3.resource(service_name, config=_config(overrides))
+            if profiler.enabled():
+                profiler.attach(_resources[key].meta.client.meta.events)
+
+    return _resources[key]
+
+
+def install(service_name, client):
+    """Use ``client`` wherever ``client(service_name)`` is called, e.g. to
+    route PutEvents calls to a local simulator."""
+
+    with _lock:
+        _clients[_key(service_name, {})] = client
+
+
+def reset():
+    """Drop every cached client, e.g. between tests."""
+
+    with _lock:
+        _clients.clear()
+        _resources.clear()
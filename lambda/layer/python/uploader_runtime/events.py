@@ -0,0 +1,223 @@
+"""
+Building and sending the "API Status" events that move objects through the
+pipeline, and working through batches of them delivered from SQS.
+"""
+
+import json
+import random
+import time
+
+from uploader_runtime import clients, log, metrics
+
+DETAIL_TYPE = "API Status"
+
+# PutEvents accepts at most 10 entries and 256 KB per request.
+# https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-putevent-size.html
+MAX_ENTRIES_PER_CALL = 10
+MAX_REQUEST_BYTES = 256 * 1024
+
+# per-entry error codes that are worth resubmitting
+RETRYABLE_ERROR_CODES = {"InternalFailure", "ThrottlingException"}
+
+# SQS batch calls accept at most 10 entries and 256 KB of message bodies
+MAX_SQS_BATCH_ENTRIES = 10
+MAX_SQS_BATCH_BYTES = 256 * 1024
+
+
+def entry_size(entry):
+    """Size of a PutEvents entry as EventBridge counts it against the limit."""
+
+    size = 14 if entry.get("Time") else 0
+    for field in ("Source", "DetailType", "Detail"):
+        value = entry.get(field)
+        if value:
+            size += len(value.encode("utf-8"))
+    for resource in entry.get("Resources", []):
+        size += len(resource.encode("utf-8"))
+
+    return size
+
+
+class EventBatcher:
+    """Packs entries into as few PutEvents calls as the service limits allow.
+
+    Entries are added with an opaque ``tag`` (e.g. an SQS message id). After
+    a flush, ``succeeded`` lists the tags that were accepted and ``failed``
+    lists ``(tag, error_code)`` for entries that were still failing after
+    ``max_attempts`` submissions. Only failed entries are resubmitted, with
+    exponential backoff and full jitter between attempts.
+    """
+
+    def __init__(
+        self,
+        client,
+        max_attempts=4,
+        base_delay=0.1,
+        max_delay=2.0,
+        sleep=time.sleep,
+    ):
+
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+        self.pending = []
+        self.pending_bytes = 0
+        self.succeeded = []
+        self.failed = []
+        self.calls = 0
+
+    def add(self, entry, tag=None):
+
+        size = entry_size(entry)
+        if size > MAX_REQUEST_BYTES:
+            log.error("event for %s is %s bytes, too large to send", tag, size)
+            self.failed.append((tag, "EntryTooLarge"))
+            return
+
+        if (
+            len(self.pending) >= MAX_ENTRIES_PER_CALL
+            or self.pending_bytes + size > MAX_REQUEST_BYTES
+        ):
+            self.flush()
+
+        self.pending.append((entry, tag))
+        self.pending_bytes += size
+
+    def flush(self):
+
+        batch = self.pending
+        self.pending = []
+        self.pending_bytes = 0
+
+        attempt = 0
+        while batch:
+            if attempt:
+                delay = min(self.max_delay, self.base_delay * (2**attempt))
+                self.sleep(random.uniform(0, delay))
+            attempt += 1
+
+            batch = self._put(batch, final=attempt >= self.max_attempts)
+
+    def _put(self, batch, final):
+        """Send one PutEvents call. Returns the entries that should be retried."""
+
+        self.calls += 1
+        try:
+            with metrics.timed("PutEvents"):
+                response = self.client.put_events(Entries=[entry for entry, _ in batch])
+
+        except self.client.exceptions.ClientError as exc:
+            log.warning("PutEvents failed for %s entries - %s", len(batch), exc)
+            if final:
+                code = exc.response.get("Error", {}).get("Code", "ClientError")
+                self.failed.extend((tag, code) for _, tag in batch)
+                return []
+            return batch
+
+        if not response.get("FailedEntryCount"):
+            self.succeeded.extend(tag for _, tag in batch)
+            return []
+
+        # result entries are returned in the same order as the request
+        retry = []
+        for (entry, tag), result in zip(batch, response["Entries"]):
+            code = result.get("ErrorCode")
+            if not code:
+                self.succeeded.append(tag)
+            elif code in RETRYABLE_ERROR_CODES and not final:
+                retry.append((entry, tag))
+            else:
+                log.error("%s - %s: %s", tag, code, result.get("ErrorMessage"))
+                self.failed.append((tag, code))
+
+        return retry
+
+
+def batches(items, max_items, max_bytes=None, item_bytes=None):
+    """Split ``items`` into lists of at most ``max_items``, and at most
+    ``max_bytes`` as counted by ``item_bytes``."""
+
+    batch = []
+    batch_bytes = 0
+    for item in items:
+        size = item_bytes(item) if item_bytes else 0
+        if batch and (
+            len(batch) >= max_items or (max_bytes and batch_bytes + size > max_bytes)
+        ):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(item)
+        batch_bytes += size
+
+    if batch:
+        yield batch
+
+
+def message_bytes(entry):
+    return len(entry.get("MessageBody", "").encode())
+
+
+def sqs_batch_call(operation, queue_url, entries, sqs_client):
+    """Make an SQS batch call, e.g. ``delete_message_batch``, for ``entries``
+    in as few requests as the limits allow.
+
+    :returns: ids of the entries that failed where a retry might succeed
+    """
+
+    call = getattr(sqs_client, operation)
+    metric = operation.title().replace("_", "")
+    failures = []
+
+    for batch in batches(
+        entries, MAX_SQS_BATCH_ENTRIES, MAX_SQS_BATCH_BYTES, message_bytes
+    ):
+        try:
+            with metrics.timed(metric):
+                response = call(QueueUrl=queue_url, Entries=batch)
+        except sqs_client.exceptions.ClientError as exc:
+            log.error("%s - %s", queue_url, exc)
+            failures.extend(entry["Id"] for entry in batch)
+            continue
+
+        for failed in response.get("Failed", []):
+            log.error("%s - %s: %s", queue_url, failed["Code"], failed.get("Message"))
+            # e.g. an expired receipt handle, or a message SQS won't take.
+            # trying again won't help.
+            if not failed.get("SenderFault"):
+                failures.append(failed["Id"])
+
+    return failures
+
+
+def batch_item_failures(message_ids):
+    """Response to an SQS event source mapping. The records with these
+    message ids are delivered again, the others are deleted."""
+
+    return {"batchItemFailures": [{"itemIdentifier": id} for id in message_ids]}
+
+
+def status_event(detail, source):
+    """A PutEvents entry carrying ``detail``."""
+
+    return {
+        "DetailType": DETAIL_TYPE,
+        "Source": source,
+        "Detail": json.dumps(detail),
+    }
+
+
+def send_status(detail, source, event_client=None):
+    """Send one status event. Returns True if EventBridge accepted it."""
+
+    entry = status_event(detail, source)
+    log.debug(entry)
+
+    batcher = EventBatcher(event_client or clients.client("events"))
+    batcher.add(entry)
+    batcher.flush()
+
+    return not batcher.failed
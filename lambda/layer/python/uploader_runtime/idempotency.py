@@ -0,0 +1,160 @@
+"""
+Makes sure each version of an object is only sent to the API once.
+
+Objects are identified by bucket, key and eTag. Before doing any work a
+handler claims the object in a DynamoDB table with a conditional write. The
+claim is a lease: if the handler dies without completing or releasing it,
+another attempt can take over once the lease expires. A completed object
+keeps the outcome of its API call, so duplicates can be handled the same way.
+Objects this execution environment has already completed are remembered in
+memory, so repeated duplicates don't cost a DynamoDB call.
+
+Set ``AWS_ENDPOINT_URL_DYNAMODB`` to run against DynamoDB Local.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from uploader_runtime import clients
+
+CLAIMED = "claimed"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+
+def idempotency_key(bucket, key, etag):
+    # HeadObject quotes the eTag, S3 events don't
+    etag = etag.strip('"')
+    return f"{bucket}/{key}/{etag}"
+
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        table_name,
+        lease_seconds=300,
+        retention_seconds=7 * 24 * 3600,
+        cache_size=1024,
+        client=None,
+    ):
+
+        self.table_name = table_name
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.client = client or clients.client("dynamodb")
+
+        self.cache_size = cache_size
+        self.completed = OrderedDict()
+        self.lock = threading.Lock()
+
+    def remember(self, item_key, outcome):
+
+        with self.lock:
+            self.completed[item_key] = outcome
+            self.completed.move_to_end(item_key)
+            while len(self.completed) > self.cache_size:
+                self.completed.popitem(last=False)
+
+    def claim(self, bucket, key, etag, token):
+        """Claim an object for processing.
+
+        ``token`` identifies the claimant. Claiming again with the same token
+        (e.g. to resume a copy) renews the lease.
+
+        :returns: CLAIMED, or IN_PROGRESS / COMPLETED if this is a duplicate
+        """
+
+        item_key = idempotency_key(bucket, key, etag)
+        with self.lock:
+            if item_key in self.completed:
+                self.completed.move_to_end(item_key)
+                return COMPLETED
+
+        now = int(time.time())
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "IdempotencyKey": {"S": item_key},
+                    "ObjectStatus": {"S": IN_PROGRESS},
+                    "Token": {"S": token},
+                    "LeaseExpires": {"N": str(now + self.lease_seconds)},
+                    "ExpiresAt": {"N": str(now + self.retention_seconds)},
+                },
+                # TTL deletes are lazy, so expired items are checked here too
+                ConditionExpression=(
+                    "attribute_not_exists(IdempotencyKey)"
+                    " OR ExpiresAt < :now"
+                    " OR (ObjectStatus = :in_progress"
+                    " AND (LeaseExpires < :now OR #token = :token))"
+                ),
+                ExpressionAttributeNames={"#token": "Token"},
+                ExpressionAttributeValues={
+                    ":now": {"N": str(now)},
+                    ":in_progress": {"S": IN_PROGRESS},
+                    ":token": {"S": token},
+                },
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            item = self.client.get_item(
+                TableName=self.table_name,
+                Key={"IdempotencyKey": {"S": item_key}},
+                ConsistentRead=True,
+            ).get("Item", {})
+            status = item.get("ObjectStatus", {}).get("S", IN_PROGRESS)
+            if status == COMPLETED:
+                self.remember(item_key, item.get("Outcome", {}).get("S"))
+            return status
+
+        return CLAIMED
+
+    def complete(self, bucket, key, etag, outcome):
+        """Mark an object as done, with the outcome of its API call. Later
+        claims are duplicates."""
+
+        item_key = idempotency_key(bucket, key, etag)
+        self.client.update_item(
+            TableName=self.table_name,
+            Key={"IdempotencyKey": {"S": item_key}},
+            UpdateExpression=(
+                "SET ObjectStatus = :completed, Outcome = :outcome"
+                " REMOVE LeaseExpires"
+            ),
+            ExpressionAttributeValues={
+                ":completed": {"S": COMPLETED},
+                ":outcome": {"S": outcome},
+            },
+        )
+        self.remember(item_key, outcome)
+
+    def outcome(self, bucket, key, etag):
+        """The outcome a completed object was stored with, or None."""
+
+        item_key = idempotency_key(bucket, key, etag)
+        with self.lock:
+            if item_key in self.completed:
+                return self.completed[item_key]
+
+        item = self.client.get_item(
+            TableName=self.table_name,
+            Key={"IdempotencyKey": {"S": item_key}},
+            ConsistentRead=True,
+        ).get("Item", {})
+
+        return item.get("Outcome", {}).get("S")
+
+    def release(self, bucket, key, etag, token):
+        """Give up a claim so that a retry can process the object."""
+
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={"IdempotencyKey": {"S": idempotency_key(bucket, key, etag)}},
+                ConditionExpression="#token = :token",
+                ExpressionAttributeNames={"#token": "Token"},
+                ExpressionAttributeValues={":token": {"S": token}},
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            # the lease expired and someone else has the object now
+            pass
@@ -0,0 +1,46 @@
+"""
+Deferred imports for modules that only some invocations need.
+
+When ``LAZY_IMPORTS`` is ``true``, ``load`` returns the module without
+running it; its code runs the first time one of its attributes is used. An
+invocation that never touches the module never pays for it. Otherwise
+``load`` is a plain import, so the work happens during the init phase of a
+cold start, as it would with an import statement.
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+
+
+def enabled():
+    return os.environ.get("LAZY_IMPORTS", "").lower() == "true"
+
+
+def load(name):
+    """Import module ``name``, deferred if lazy imports are enabled.
+
+    Use the module through its attributes (``module.Thing``); ``from``
+    imports would load it straight away.
+    """
+
+    if name in sys.modules or not enabled():
+        return importlib.import_module(name)
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    # as the import system would, so "import a.b" then "a.b.c" finds it
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+
+    return module
@@ -0,0 +1,101 @@
+"""
+Logging helpers for the handlers.
+
+Messages are written as one JSON object per line, e.g.
+
+    {"level": "ERROR", "message": "error deleting inbound/a.csv - ..."}
+
+and only built when their level is enabled: arguments are formatted into
+the message with ``%`` and the line serialized after the level check, so a
+disabled ``info`` costs a comparison. ``LOG_LEVEL`` (default INFO) sets the
+level. Messages logged for every object go through ``sampled``, which writes
+a ``LOG_SAMPLE_RATE`` fraction of them (default all).
+
+``debug`` dumps whole events and stays tied to the EnableDebug context flag,
+which also turns sampling off.
+"""
+
+import json
+import os
+import random
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+NAMES = {level: name for name, level in LEVELS.items()}
+
+
+def debug_enabled():
+    """True when the stack was deployed with the EnableDebug context flag."""
+
+    return "DEBUG" in os.environ
+
+
+def level():
+
+    if debug_enabled():
+        return DEBUG
+
+    return LEVELS.get(os.environ.get("LOG_LEVEL", "INFO").upper(), INFO)
+
+
+def sample_rate():
+
+    if debug_enabled():
+        return 1.0
+
+    try:
+        return float(os.environ.get("LOG_SAMPLE_RATE", "1"))
+    except ValueError:
+        return 1.0
+
+
+def enabled(message_level):
+    return message_level >= level()
+
+
+def write(message_level, message, args, fields):
+
+    record = {
+        "level": NAMES[message_level],
+        "message": message % args if args else message,
+    }
+    record.update(fields)
+    print(json.dumps(record, default=str))
+
+
+def info(message, *args, **fields):
+    """Log ``message % args`` with any extra ``fields`` at INFO."""
+
+    if enabled(INFO):
+        write(INFO, message, args, fields)
+
+
+def warning(message, *args, **fields):
+
+    if enabled(WARNING):
+        write(WARNING, message, args, fields)
+
+
+def error(message, *args, **fields):
+
+    if enabled(ERROR):
+        write(ERROR, message, args, fields)
+
+
+def sampled(message, *args, **fields):
+    """``info`` for messages repeated for every object, written for a
+    LOG_SAMPLE_RATE fraction of calls."""
+
+    if enabled(INFO) and random.random() < sample_rate():
+        write(INFO, message, args, fields)
+
+
+def debug(payload):
+    """Dump ``payload`` as JSON when debugging is enabled."""
+
+    if debug_enabled():
+        print(json.dumps(payload))
@@ -0,0 +1,173 @@
+"""
+Per-invocation metrics written to the log in CloudWatch Embedded Metric
+Format. CloudWatch extracts the metrics from the log line, so recording them
+costs no API calls.
+https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+
+Handlers are wrapped with ``instrument``, which collects the metrics of one
+invocation and writes them when it returns. Code the handler calls records
+into the same invocation through ``current()`` or ``timed()``, which do
+nothing outside an instrumented handler.
+
+Every metric has a ``Stage`` dimension, the name of the handler. The
+namespace comes from ``METRICS_NAMESPACE`` (default Uploader).
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from uploader_runtime import profiler
+
+# EMF limits per log line
+MAX_METRICS = 100
+MAX_VALUES = 100
+
+MILLISECONDS = "Milliseconds"
+BYTES = "Bytes"
+COUNT = "Count"
+
+_current = contextvars.ContextVar("metrics", default=None)
+
+
+class Metrics:
+    """Values recorded during one invocation of ``stage``."""
+
+    def __init__(self, stage, namespace=None):
+
+        self.stage = stage
+        self.namespace = namespace or os.environ.get("METRICS_NAMESPACE", "Uploader")
+        self.values = {}
+        self.units = {}
+        self.lock = threading.Lock()
+
+    def put(self, name, value, unit=COUNT):
+
+        with self.lock:
+            self.values.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Record how long the block takes as ``<name>Time``."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(f"{name}Time", (time.perf_counter() - start) * 1000, MILLISECONDS)
+
+    def stage_latency(self, detail):
+        """Record the time since the object in ``detail`` was received."""
+
+        received = detail.get("received")
+        if not received:
+            return
+
+        try:
+            received_time = datetime.fromisoformat(received)
+        except ValueError:
+            return
+
+        latency = datetime.now(timezone.utc) - received_time
+        self.put("StageLatency", latency.total_seconds() * 1000, MILLISECONDS)
+
+    def documents(self):
+        """EMF documents with everything recorded, split to stay within the
+        limits on metrics and values per line."""
+
+        with self.lock:
+            pending = {name: list(values) for name, values in self.values.items()}
+
+        timestamp = int(time.time() * 1000)
+        while pending:
+            names = sorted(pending)[:MAX_METRICS]
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Stage"]],
+                            "Metrics": [
+                                {"Name": name, "Unit": self.units[name]}
+                                for name in names
+                            ],
+                        }
+                    ],
+                },
+                "Stage": self.stage,
+            }
+            for name in names:
+                values = pending[name][:MAX_VALUES]
+                document[name] = values[0] if len(values) == 1 else values
+                del pending[name][:MAX_VALUES]
+                if not pending[name]:
+                    del pending[name]
+
+            yield document
+
+    def flush(self):
+
+        for document in self.documents():
+            print(json.dumps(document))
+
+        with self.lock:
+            self.values.clear()
+
+
+def current():
+    """Metrics of the running invocation, or None."""
+
+    return _current.get()
+
+
+def stage_latency(detail):
+    """Record the time since ``detail`` was received into the running
+    invocation's metrics, if any."""
+
+    metrics = current()
+    if metrics:
+        metrics.stage_latency(detail)
+
+
+@contextlib.contextmanager
+def timed(name):
+    """Time the block into the running invocation's metrics, if any."""
+
+    metrics = current()
+    if not metrics:
+        yield
+        return
+
+    with metrics.timer(name):
+        yield
+
+
+def instrument(stage):
+    """Decorator for a lambda_handler that records metrics for ``stage``,
+    and profiles its AWS calls if that is enabled."""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+
+            metrics = Metrics(stage)
+            token = _current.set(metrics)
+            profile = profiler.start(stage)
+            try:
+                return handler(event, context)
+            finally:
+                _current.reset(token)
+                metrics.flush()
+                if profile:
+                    profiler.finish(profile)
+
+        return wrapper
+
+    return decorator
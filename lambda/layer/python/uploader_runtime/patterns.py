@@ -0,0 +1,209 @@
+"""
+EventBridge event patterns evaluated in code.
+
+``compile_pattern`` turns a pattern into a predicate, so the pattern is only
+walked once and each event is checked with a flat list of field tests. It
+lets a handler drop events the rules can't filter out, and lets the local
+simulator route events the way the deployed rules do. ``matches`` is the
+straightforward recursive matcher it replaces, kept for comparison.
+
+Supported filters: literal values, ``prefix``, ``suffix``, ``anything-but``,
+``numeric``, ``exists`` and ``equals-ignore-case``.
+https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-event-patterns-content-based-filtering.html
+"""
+
+import operator
+
+MISSING = object()
+
+NUMERIC_OPERATORS = {
+    "=": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def literal_key(value):
+    # keep True and 1 apart, as EventBridge does
+    return (type(value) is bool, value)
+
+
+def numeric_test(conditions):
+
+    if len(conditions) % 2:
+        raise ValueError(f"bad numeric filter {conditions}")
+
+    tests = []
+    for name, bound in zip(conditions[::2], conditions[1::2]):
+        if name not in NUMERIC_OPERATORS or not is_number(bound):
+            raise ValueError(f"bad numeric filter {conditions}")
+        tests.append((NUMERIC_OPERATORS[name], bound))
+
+    def test(value):
+        return is_number(value) and all(op(value, bound) for op, bound in tests)
+
+    return test
+
+
+def anything_but_test(excluded):
+
+    if isinstance(excluded, dict):
+        inner = value_test(excluded)
+        return lambda value: value is not None and not inner(value)
+
+    if not isinstance(excluded, list):
+        excluded = [excluded]
+    keys = {literal_key(value) for value in excluded}
+
+    return lambda value: value is not None and literal_key(value) not in keys
+
+
+def value_test(rule):
+    """Test for one filter, e.g. ``{"prefix": "processed/"}``, applied to a
+    single (non-list) value."""
+
+    if len(rule) != 1:
+        raise ValueError(f"bad filter {rule}")
+    ((name, operand),) = rule.items()
+
+    if name == "prefix":
+        return lambda value: isinstance(value, str) and value.startswith(operand)
+    if name == "suffix":
+        return lambda value: isinstance(value, str) and value.endswith(operand)
+    if name == "equals-ignore-case":
+        folded = operand.casefold()
+        return lambda value: isinstance(value, str) and value.casefold() == folded
+    if name == "numeric":
+        return numeric_test(operand)
+    if name == "anything-but":
+        return anything_but_test(operand)
+
+    raise ValueError(f"unsupported filter {rule}")
+
+
+def field_test(rules):
+    """Test for one field: true if any of ``rules`` matches."""
+
+    if not isinstance(rules, list):
+        raise ValueError(f"pattern values must be lists, not {rules!r}")
+
+    literals = set()
+    tests = []
+    exists = set()
+    for rule in rules:
+        if isinstance(rule, dict) and "exists" in rule:
+            exists.add(bool(rule["exists"]))
+        elif isinstance(rule, dict):
+            tests.append(value_test(rule))
+        else:
+            literals.add(literal_key(rule))
+
+    def test(value):
+        if value is MISSING:
+            return False in exists
+        if True in exists:
+            return True
+
+        for item in value if isinstance(value, list) else (value,):
+            try:
+                if literal_key(item) in literals:
+                    return True
+            except TypeError:
+                # objects can't be compared with literals
+                pass
+            for item_test in tests:
+                if item_test(item):
+                    return True
+
+        return False
+
+    if tests or exists:
+        return test
+
+    def literal_test(value):
+        # most fields are strings compared with a list of values
+        if type(value) is str:
+            return (False, value) in literals
+        return test(value)
+
+    return literal_test
+
+
+def compile_fields(pattern, path, fields):
+
+    if not isinstance(pattern, dict):
+        raise ValueError(f"bad pattern {pattern!r}")
+
+    for name, rules in pattern.items():
+        if isinstance(rules, dict):
+            compile_fields(rules, path + (name,), fields)
+        else:
+            fields.append((path + (name,), field_test(rules)))
+
+
+def compile_pattern(pattern):
+    """Predicate that is true for events matching ``pattern``.
+
+    Raises ValueError for patterns EventBridge would not accept.
+    """
+
+    fields = []
+    compile_fields(pattern, (), fields)
+
+    def predicate(event):
+        for path, test in fields:
+            value = event
+            for name in path:
+                if not isinstance(value, dict):
+                    value = MISSING
+                    break
+                value = value.get(name, MISSING)
+            if not test(value):
+                return False
+
+        return True
+
+    return predicate
+
+
+def matches(pattern, event):
+    """True if ``event`` matches ``pattern``, interpreting the pattern on
+    every call."""
+
+    for name, rules in pattern.items():
+        value = event.get(name, MISSING) if isinstance(event, dict) else MISSING
+
+        if isinstance(rules, dict):
+            if not matches(rules, value if isinstance(value, dict) else {}):
+                return False
+            continue
+
+        if not any(matches_rule(rule, value) for rule in rules):
+            return False
+
+    return True
+
+
+def matches_rule(rule, value):
+
+    if isinstance(rule, dict) and "exists" in rule:
+        return (value is not MISSING) == bool(rule["exists"])
+    if value is MISSING:
+        return False
+
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(rule, dict):
+            if value_test(rule)(item):
+                return True
+        elif type(rule) is type(item) and rule == item:
+            return True
+        elif is_number(rule) and is_number(item) and rule == item:
+            return True
+
+    return False
@@ -0,0 +1,157 @@
+"""
+Opt-in profile of the AWS calls a handler makes.
+
+With ``PROFILE_AWS_CALLS`` set to ``true``, every client from
+``uploader_runtime.clients`` gets hooks on botocore's event system that
+record, per operation, the number of calls, their latency, retries, errors
+and the bytes sent and received. At the end of each invocation one line is
+printed:
+
+    AWS_CALLS {"stage": "call_api", "ms": 412.3, "operations": {...}}
+
+``tools/aws_call_report.py`` aggregates these lines from many invocations.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+
+PREFIX = "AWS_CALLS"
+
+_current = contextvars.ContextVar("aws_call_profile", default=None)
+
+
+def enabled():
+    return os.environ.get("PROFILE_AWS_CALLS", "").lower() == "true"
+
+
+class Profile:
+    """AWS calls made during one invocation."""
+
+    def __init__(self, stage):
+
+        self.stage = stage
+        self.start = time.perf_counter()
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def record(self, operation, seconds, retries=0, sent=0, received=0, error=False):
+
+        with self.lock:
+            stats = self.operations.setdefault(
+                operation,
+                {
+                    "calls": 0,
+                    "ms": 0.0,
+                    "max_ms": 0.0,
+                    "retries": 0,
+                    "errors": 0,
+                    "sent": 0,
+                    "received": 0,
+                },
+            )
+            ms = seconds * 1000
+            stats["calls"] += 1
+            stats["ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+            stats["retries"] += retries
+            stats["errors"] += int(error)
+            stats["sent"] += sent
+            stats["received"] += received
+
+    def summary(self):
+
+        with self.lock:
+            operations = {
+                name: {
+                    key: round(value, 1) if isinstance(value, float) else value
+                    for key, value in stats.items()
+                }
+                for name, stats in self.operations.items()
+            }
+
+        return {
+            "stage": self.stage,
+            "ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "operations": operations,
+        }
+
+
+def start(stage):
+    """Begin profiling an invocation. Returns None when profiling is off."""
+
+    if not enabled():
+        return None
+
+    profile = Profile(stage)
+    _current.set(profile)
+
+    return profile
+
+
+def finish(profile):
+
+    _current.set(None)
+    print(f"{PREFIX} {json.dumps(profile.summary())}")
+
+
+def operation_name(event_name):
+    # e.g. after-call.s3.CopyObject
+    return event_name.split(".", 1)[-1]
+
+
+def _before_call(context, **kwargs):
+
+    context["profile_start"] = time.perf_counter()
+    context["profile_sent"] = 0
+
+
+def _request_created(request, **kwargs):
+
+    # once per attempt, so retried requests count every time
+    body = request.body
+    if isinstance(body, (bytes, str)) and "profile_sent" in request.context:
+        request.context["profile_sent"] += len(body)
+
+
+def _after_call(event_name, http_response, parsed, context, **kwargs):
+
+    profile = _current.get()
+    if not profile or "profile_start" not in context:
+        return
+
+    profile.record(
+        operation_name(event_name),
+        time.perf_counter() - context["profile_start"],
+        retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+        sent=context["profile_sent"],
+        received=int(http_response.headers.get("content-length") or 0),
+        error="Error" in parsed,
+    )
+
+
+def _after_call_error(event_name, exception, context, **kwargs):
+
+    profile = _current.get()
+    if not profile or "profile_start" not in context:
+        return
+
+    metadata = getattr(exception, "response", {}).get("ResponseMetadata", {})
+    profile.record(
+        operation_name(event_name),
+        time.perf_counter() - context["profile_start"],
+        retries=metadata.get("RetryAttempts", 0),
+        sent=context["profile_sent"],
+        error=True,
+    )
+
+
+def attach(event_system):
+    """Add the profiling hooks to a client's ``meta.events``."""
+
+    event_system.register("before-call", _before_call)
+    event_system.register("request-created", _request_created)
+    event_system.register("after-call", _after_call)
+    event_system.register("after-call-error", _after_call_error)
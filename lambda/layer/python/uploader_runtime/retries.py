@@ -0,0 +1,180 @@
+"""
+Messages in the retry queue.
+
+A retry message carries the detail of the failed status event in a small
+versioned record, without the EventBridge envelope:
+
+    {"v":1,"detail":{"Bucket":"inbound","Key":"processed/a.csv",...}}
+
+Messages sent before the record was introduced hold the whole event, which
+has the detail in the same place, so both can be read.
+
+The detail counts the failed ``attempt``s. Each retry waits longer than the
+one before, ``RETRY_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)`` up to
+``RETRY_BACKOFF_MAX_SECONDS``, with jitter so that objects that failed
+together don't come back together. send_to_retry_queue delays new messages
+by that much, and handle_retries keeps a received message invisible for that
+long, so it comes round again only after the backoff if the attempt fails.
+It is kept invisible for longer for big objects, and call_api's
+``Heartbeat`` extends it while the object is being worked on, so that a
+slow attempt isn't received and sent to the API a second time.
+
+After ``RETRY_MAX_ATTEMPTS`` failed attempts an object is given up on, and
+its record goes to the retry dead-letter queue (``RETRY_DLQ_URL``) instead.
+``tools/dlq_report.py`` lists what is there.
+"""
+
+import contextvars
+import json
+import os
+import random
+import threading
+
+from uploader_runtime import log
+
+VERSION = 1
+
+# SQS limits
+MAX_DELAY_SECONDS = 900
+MAX_VISIBILITY_SECONDS = 12 * 60 * 60
+
+# the retry queue's default visibility timeout. call_api needs at least this
+# long before a message it is working on is received again.
+MIN_VISIBILITY_SECONDS = 60
+
+# a slow copy rate, for the time call_api may need for an object
+COPY_BYTES_PER_SECOND = 20 * 1024 * 1024
+
+# set again when the object is retried
+DROPPED_FIELDS = ("status", "message")
+
+
+def encode(detail):
+    """Retry message body for the failed object in ``detail``."""
+
+    record = {
+        "v": VERSION,
+        "detail": {
+            name: value for name, value in detail.items() if name not in DROPPED_FIELDS
+        },
+    }
+
+    return json.dumps(record, separators=(",", ":"))
+
+
+def decode(body):
+    """Detail of the object in a retry message.
+
+    Raises ValueError or KeyError if the message can't be read.
+    """
+
+    record = json.loads(body)
+    # a whole event has no version
+    version = record.get("v", 0)
+    if version > VERSION:
+        raise ValueError(f"unknown retry record version {version}")
+
+    return record["detail"]
+
+
+def backoff_seconds(attempt):
+    """Seconds to wait before retrying after ``attempt`` failed attempts."""
+
+    if attempt < 1:
+        return 0
+
+    base = float(os.environ.get("RETRY_BACKOFF_BASE_SECONDS", "60"))
+    cap = float(os.environ.get("RETRY_BACKOFF_MAX_SECONDS", "900"))
+    backoff = min(cap, base * 2 ** (attempt - 1))
+
+    # half fixed, so the wait still grows with every attempt
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+def failed(detail):
+    """Detail for the next attempt after the one in ``detail`` failed, and
+    the DelaySeconds to send it with."""
+
+    attempt = detail.get("attempt", 0) + 1
+    delay = min(MAX_DELAY_SECONDS, int(backoff_seconds(attempt)))
+
+    return {**detail, "attempt": attempt}, delay
+
+
+def visibility_timeout(attempt, size=0):
+    """Visibility timeout for a received message that will have failed
+    ``attempt`` times if the API call it is forwarded for fails. ``size`` is
+    the object's size in bytes."""
+
+    minimum = MIN_VISIBILITY_SECONDS + int((size or 0) / COPY_BYTES_PER_SECOND)
+    seconds = max(minimum, int(backoff_seconds(attempt)))
+
+    return min(MAX_VISIBILITY_SECONDS, seconds)
+
+
+class Heartbeat:
+    """Keeps a received retry message invisible while its object is worked
+    on, by extending its visibility timeout every ``interval`` seconds.
+
+    Each extension is the backoff for one more failed attempt, so if the
+    attempt fails the message still comes round again only after it.
+    """
+
+    def __init__(self, sqs_client, message, attempt=0, size=0, interval=None):
+
+        self.sqs_client = sqs_client
+        self.queue_url = message["queue_url"]
+        self.receipt_handle = message["receipt_handle"]
+        self.attempt = attempt
+        self.size = size
+        self.interval = interval or MIN_VISIBILITY_SECONDS / 2
+        self.beats = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def beat(self):
+
+        try:
+            self.sqs_client.change_message_visibility(
+                QueueUrl=self.queue_url,
+                ReceiptHandle=self.receipt_handle,
+                VisibilityTimeout=visibility_timeout(self.attempt + 1, self.size),
+            )
+            self.beats += 1
+        except self.sqs_client.exceptions.ClientError as exc:
+            # e.g. the message was deleted or the receipt handle expired
+            log.warning("%s - %s", self.queue_url, exc)
+            self.stopped.set()
+
+    def run(self):
+
+        while not self.stopped.wait(self.interval):
+            self.beat()
+
+    def __enter__(self):
+
+        # the calls are profiled with the invocation's
+        self.thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(self.run,), daemon=True
+        )
+        self.thread.start()
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.stopped.set()
+        self.thread.join()
+
+
+def dead_letter_queue_url():
+    return os.environ.get("RETRY_DLQ_URL")
+
+
+def exhausted(detail):
+    """True when the object in ``detail`` has failed as often as it may be
+    retried and there is a dead-letter queue to put it in."""
+
+    max_attempts = int(os.environ.get("RETRY_MAX_ATTEMPTS", "10"))
+
+    return bool(dead_letter_queue_url()) and detail.get("attempt", 0) >= max_attempts
@@ -0,0 +1,104 @@
+"""
+Tracks the newest version of each object key, so that rapid overwrites of the
+same key can be coalesced into one call to the API.
+
+Versions are ordered by the ``sequencer`` in the S3 event. Sequencers are hex
+strings that may differ in length; left-padding them to a common length makes
+string order match write order.
+https://docs.aws.amazon.com/AmazonS3/latest/userguide/notification-content-structure.html
+"""
+
+import time
+
+from uploader_runtime import clients
+
+SEQUENCER_LENGTH = 32
+
+# BatchGetItem reads at most 100 keys per call
+MAX_BATCH_GET_KEYS = 100
+
+
+def normalize_sequencer(sequencer):
+    return sequencer.upper().rjust(SEQUENCER_LENGTH, "0")
+
+
+def object_id(bucket, key):
+    return f"{bucket}/{key}"
+
+
+class LatestVersions:
+    """DynamoDB table with the newest sequencer seen for each bucket/key.
+
+    Items expire ``ttl_seconds`` after they were written.
+    """
+
+    def __init__(self, table_name, ttl_seconds=3600, client=None):
+
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.client = client or clients.client("dynamodb")
+
+    def record(self, bucket, key, sequencer):
+        """Record a new version of an object.
+
+        :returns: False if a newer version has already been recorded
+        """
+
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={"ObjectId": {"S": object_id(bucket, key)}},
+                UpdateExpression="SET Sequencer = :sequencer, ExpiresAt = :expires",
+                ConditionExpression=(
+                    "attribute_not_exists(Sequencer) OR Sequencer <= :sequencer"
+                ),
+                ExpressionAttributeValues={
+                    ":sequencer": {"S": normalize_sequencer(sequencer)},
+                    ":expires": {"N": str(int(time.time()) + self.ttl_seconds)},
+                },
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+        return True
+
+    def newest(self, objects):
+        """Newest recorded sequencer for each ``(bucket, key)`` in ``objects``.
+
+        :returns: dict mapping ``(bucket, key)`` to a normalized sequencer.
+            Objects with no record are left out.
+        """
+
+        ids = {object_id(bucket, key): (bucket, key) for bucket, key in objects}
+        pending = list(ids)
+        newest = {}
+
+        while pending:
+            request = {
+                self.table_name: {
+                    "Keys": [
+                        {"ObjectId": {"S": item_id}}
+                        for item_id in pending[:MAX_BATCH_GET_KEYS]
+                    ],
+                    "ConsistentRead": True,
+                }
+            }
+            pending = pending[MAX_BATCH_GET_KEYS:]
+
+            while request:
+                response = self.client.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    newest[ids[item["ObjectId"]["S"]]] = item["Sequencer"]["S"]
+                request = response.get("UnprocessedKeys")
+
+        return newest
+
+    def is_superseded(self, detail, newest):
+        """True if ``newest`` has a later version of the object in ``detail``."""
+
+        sequencer = detail.get("Sequencer")
+        latest = newest.get((detail["Bucket"], detail["Key"]))
+        if not sequencer or not latest:
+            return False
+
+        return normalize_sequencer(sequencer) < latest
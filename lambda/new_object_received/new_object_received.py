@@ -1,20 +1,34 @@
 import os
-import os.path
 import re
 import json
 from datetime import datetime, timezone
-import boto3
 
+from uploader_runtime import clients, events, lazy, log, metrics
+from uploader_runtime.patterns import compile_pattern
 
-def lambda_handler(event, context):
+# only used with a coalescing window
+versions = lazy.load("uploader_runtime.versions")
+
+# how long a new object waits for overwrites before it is sent to the API
+COALESCE_WINDOW_SECONDS = int(os.environ.get("COALESCE_WINDOW_SECONDS", "0"))
+
+# event pattern for objects the rule lets through but that should be ignored,
+# e.g. keys without one of the wanted suffixes
+FILTER_PATTERN = os.environ.get("FILTER_PATTERN")
+event_filter = compile_pattern(json.loads(FILTER_PATTERN)) if FILTER_PATTERN else None
 
-    if "DEBUG" in os.environ:
-        print(json.dumps(event))
 
-    s3 = boto3.resource("s3")
-    event_client = boto3.client("events")
+@metrics.instrument("new_object_received")
+def lambda_handler(event, context):
+
+    log.debug(event)
 
     s3_info = event["detail"]
+    object_info = s3_info["object"]
+
+    if event_filter and not event_filter(event):
+        log.sampled("ignoring %s", object_info["key"])
+        return {"status": "filtered"}
 
     received_time = None
     try:
@@ -24,39 +38,79 @@ def lambda_handler(event, context):
             received_time = datetime.fromisoformat(time_string)
 
     except ValueError as exc:
-        print("could not parse datetime")
+        log.warning("could not parse datetime")
 
-    if not received_time:
-        received_time = datetime.now(timezone.utc)
-
-    s3_object = s3.Object(s3_info["bucket"]["name"], s3_info["object"]["key"])
     detail = {
-        "Bucket": s3_object.bucket_name,
-        "Key": s3_object.key,
-        "LastModified": s3_object.last_modified.isoformat(),
-        "eTag": s3_object.e_tag,
-        "received": received_time.isoformat(),
+        "Bucket": s3_info["bucket"]["name"],
+        "Key": object_info["key"],
         "status": ["ready_for_api"],
     }
 
-    status_event = {
-        "DetailType": "API Status",
-        "Source": context.invoked_function_arn,
-        "Detail": json.dumps(detail),
-    }
+    # the "Object Created" event already describes the object, so there is
+    # no need to HEAD it. the event time is when the object was written.
+    if received_time and object_info.get("etag") and "size" in object_info:
+        detail["LastModified"] = received_time.isoformat()
+        # same quoted form that HeadObject returns
+        detail["eTag"] = '"' + object_info["etag"] + '"'
+        detail["Size"] = object_info["size"]
+
+    else:
+        log.info("incomplete event for %s, reading object metadata", detail["Key"])
+        s3_client = clients.client("s3")
+        with metrics.timed("HeadObject"):
+            head = s3_client.head_object(Bucket=detail["Bucket"], Key=detail["Key"])
+        detail["LastModified"] = head["LastModified"].isoformat()
+        detail["eTag"] = head["ETag"]
+        detail["Size"] = head["ContentLength"]
+
+    # used to order writes to the same key
+    if object_info.get("sequencer"):
+        detail["Sequencer"] = object_info["sequencer"]
+    if object_info.get("version-id"):
+        detail["VersionId"] = object_info["version-id"]
+
+    if not received_time:
+        received_time = datetime.now(timezone.utc)
+    detail["received"] = received_time.isoformat()
+
+    # how long S3 and EventBridge took to deliver the event
+    metrics.current().stage_latency(detail)
 
     # if success, write the key in dynamo
     #  some combination of bucket name, object key, etag
     #  md5, uuid modules
 
-    try:
-        print("sending event")
-        print(json.dumps(status_event))
-        response = event_client.put_events(Entries=[status_event])
-        status = "succeeded"
+    coalesce_queue_url = os.environ.get("COALESCE_QUEUE_URL")
+    if coalesce_queue_url and "Sequencer" in detail:
+        return hold_for_coalescing(detail, coalesce_queue_url)
 
-    except event_client.exceptions.InternalException as exc:
-        print(f"{exc} - " + json.dumps(status_event))
+    if events.send_status(detail, context.invoked_function_arn):
+        status = "succeeded"
+    else:
         status = "failed"
 
     return {"status": status}
+
+
+def hold_for_coalescing(detail, queue_url):
+    """Record the new version and hold it in the coalesce queue for the
+    coalescing window. The coalesce function sends it on if nothing newer
+    was written to the same key in the meantime."""
+
+    latest_versions = versions.LatestVersions(
+        os.environ.get("LATEST_VERSION_TABLE"),
+        ttl_seconds=COALESCE_WINDOW_SECONDS + 3600,
+    )
+    if not latest_versions.record(detail["Bucket"], detail["Key"], detail["Sequencer"]):
+        # events can arrive out of order
+        log.sampled("newer version of %s already received", detail["Key"])
+        return {"status": "superseded"}
+
+    with metrics.timed("SendMessage"):
+        clients.client("sqs").send_message(
+            QueueUrl=queue_url,
+            MessageBody=json.dumps({"detail": detail}),
+            DelaySeconds=COALESCE_WINDOW_SECONDS,
+        )
+
+    return {"status": "succeeded"}
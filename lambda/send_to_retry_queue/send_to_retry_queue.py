@@ -1,25 +1,80 @@
 import os
 import json
-import boto3
 
+from uploader_runtime import clients, events, log, metrics, retries
 
+
+def send_records(records, queue_url, sqs_client):
+    """Put the failed objects in a batch of events in the retry Q with
+    SendMessageBatch, or in the dead-letter queue once they are out of
+    attempts.
+    """
+
+    failures = []
+    by_queue = {}
+
+    for record in records:
+        try:
+            event_detail = json.loads(record["body"])["detail"]
+            retry_detail, delay = retries.failed(event_detail)
+            body = retries.encode(retry_detail)
+        except (ValueError, KeyError, AttributeError) as exc:
+            log.error("%s - unreadable event - %s", record["messageId"], exc)
+            failures.append(record["messageId"])
+            continue
+
+        metrics.stage_latency(event_detail)
+        entry = {"Id": record["messageId"], "MessageBody": body}
+        if retries.exhausted(retry_detail):
+            log.warning("giving up on %s", event_detail.get("Key"))
+            by_queue.setdefault(retries.dead_letter_queue_url(), []).append(entry)
+        else:
+            entry["DelaySeconds"] = delay
+            by_queue.setdefault(queue_url, []).append(entry)
+
+    for target_url, entries in by_queue.items():
+        failures.extend(
+            events.sqs_batch_call("send_message_batch", target_url, entries, sqs_client)
+        )
+
+    return events.batch_item_failures(failures)
+
+
+@metrics.instrument("send_to_retry_queue")
 def lambda_handler(event, context):
 
-    print(json.dumps(event))
+    log.debug(event)
 
     key = "QUEUE_URL"
     queue_url = os.environ.get(key)
     if not queue_url:
-        print(f"missing value for {key}")
+        log.error("missing value for %s", key)
         return {"status": "failed"}
 
-    sqs = boto3.resource("sqs")
-    retry_queue = sqs.Queue(queue_url)
+    # SendToRetryQueueMode=batch
+    if "Records" in event:
+        return send_records(event["Records"], queue_url, clients.client("sqs"))
+
+    metrics.stage_latency(event.get("detail", {}))
+
+    sqs = clients.resource("sqs")
+
+    # back off longer after every failed attempt
+    retry_detail, delay = retries.failed(event["detail"])
+    status = "message_sent"
+    if retries.exhausted(retry_detail):
+        log.warning("giving up on %s", retry_detail.get("Key"))
+        queue_url = retries.dead_letter_queue_url()
+        delay = 0
+        status = "dead_lettered"
 
     try:
-        response = retry_queue.send_message(MessageBody=json.dumps(event))
-        print(json.dumps(response))
+        with metrics.timed("SendMessage"):
+            response = sqs.Queue(queue_url).send_message(
+                MessageBody=retries.encode(retry_detail), DelaySeconds=delay
+            )
+        log.sampled("sent retry message %s", response["MessageId"])
     except sqs.meta.client.exceptions.InvalidMessageContents as exc:
-        print(exc)
+        log.error("%s", exc)
 
-    return {"status": "message_sent"}
+    return {"status": status}
@@ -1,16 +1,60 @@
 import os
-import os.path
 import re
 import json
+import base64
+import gzip
+import hashlib
 from datetime import datetime, timezone
-import boto3
 
-# class ApiResult():
-#     def event_detail(self, event=None):
-#         pass
-#
-# class Succeeded(ApiResult):
-#     pass
+# status codes for the outcomes call_api's client understands
+ACCEPTED = 200
+UNAVAILABLE = 503
+UNPROCESSABLE = 422
+
+
+def submit_status(detail, now=None):
+    """Response status for a submitted object, decided by its filename the
+    way call_api does without an API."""
+
+    last_modified = datetime.fromisoformat(detail["LastModified"])
+    now = now or datetime.now(timezone.utc)
+    elapsed_seconds = (now - last_modified).total_seconds()
+
+    filename = os.path.basename(detail["Key"])
+    if re.search("fail", filename, re.I) and elapsed_seconds < 120:
+        # after 120 seconds, let the transfer succeed
+        return UNAVAILABLE
+    if re.search("reject", filename, re.I):
+        return UNPROCESSABLE
+
+    return ACCEPTED
+
+
+def submitted(event):
+    """Details of the submitted object. They come in a header when the
+    content is sent, and the content is checked against its Content-MD5."""
+
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    if isinstance(body, str):
+        body = body.encode()
+
+    headers = {
+        name.lower(): value for name, value in (event.get("headers") or {}).items()
+    }
+    # API Gateway only decompresses requests when compression is enabled
+    if headers.get("content-encoding") == "gzip" and body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+
+    if "x-object-detail" not in headers:
+        return json.loads(body)
+
+    content_md5 = base64.b64encode(hashlib.md5(body).digest()).decode()
+    if headers.get("content-md5", content_md5) != content_md5:
+        raise ValueError(f"{len(body)} bytes don't match Content-MD5")
+
+    return json.loads(headers["x-object-detail"])
 
 
 def lambda_handler(event, context):
@@ -18,6 +62,21 @@ def lambda_handler(event, context):
     if "DEBUG" in os.environ:
         print(json.dumps(event))
 
+    if event.get("httpMethod") == "POST" and event["path"].endswith("/submit"):
+        try:
+            detail = submitted(event)
+            status_code = submit_status(detail)
+        except (ValueError, KeyError, TypeError) as exc:
+            detail = {}
+            status_code = 400
+            print(f"bad request - {exc}")
+
+        return {
+            "statusCode": status_code,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"Key": detail.get("Key"), "statusCode": status_code}),
+        }
+
     qsp = event.get("queryStringParameters", {})
     if not qsp:
         qsp = {}
@@ -47,84 +106,3 @@ def lambda_handler(event, context):
     print(json.dumps(return_dict))
 
     return return_dict
-
-    # event_detail = event["detail"]
-
-    # s3 = boto3.resource("s3")
-    # s3_client = s3.meta.client
-    # event_client = boto3.client("events")
-
-    # # for testing, copy the object to another s3 bucket
-    # # begin TESTING cleverness
-
-    # target_bucket = s3.Bucket(os.environ.get("OUTBOUND_BUCKET"))
-    # source_object = s3.Object(event_detail["Bucket"], event_detail["Key"])
-
-    # last_modified = datetime.fromisoformat(event_detail["LastModified"])
-    # now = datetime.now(timezone.utc)
-    # elapsed_seconds = (now - last_modified).total_seconds()
-
-    # filename = os.path.basename(source_object.key)
-    # if re.search("fail", filename, re.I) and elapsed_seconds < 120:
-    #     # after 120 seconds, let the transfer succeed
-    #     api_status = "failed"
-    # elif re.search("reject", filename, re.I):
-    #     api_status = "rejected"
-    # else:
-    #     api_status = "succeeded"
-
-    # if api_status == "succeeded":
-    #     try:
-    #         target_object = target_bucket.Object(f"copied/{source_object.key}")
-
-    #         target_object.copy_from(
-    #             CopySource={
-    #                 "Bucket": source_object.bucket_name,
-    #                 "Key": source_object.key,
-    #             },
-    #             TaggingDirective="COPY",
-    #         )
-
-    #         # need to add ElapsedSeconds tag
-
-    #         response = s3_client.get_object_tagging(
-    #             Bucket=source_object.bucket_name, Key=source_object.key
-    #         )
-    #         tag_set = response["TagSet"]
-
-    #         target_object.copy(
-    #             {"Bucket": source_object.bucket_name, "Key": source_object.key}
-    #         )
-
-    #         tag_set.append({"Key": "ElapsedSeconds", "Value": str(elapsed_seconds)})
-
-    #         s3_client.put_object_tagging(
-    #             Bucket=target_object.bucket_name,
-    #             Key=target_object.key,
-    #             Tagging={"TagSet": tag_set},
-    #         )
-
-    #     except s3_client.exceptions.ClientError as exc:
-    #         print(f"error copying {source_object} to {target_bucket} - {exc}")
-    #         return {"status": "failed"}
-
-    # # end TESTING cleverness
-
-    # detail = event_detail.copy()
-    # detail["status"] = [api_status]
-
-    # status_event = {
-    #     "DetailType": "API Status",
-    #     "Source": context.invoked_function_arn,
-    #     "Detail": json.dumps(detail),
-    # }
-
-    # try:
-    #     print("sending event")
-    #     print(json.dumps(status_event))
-    #     response = event_client.put_events(Entries=[status_event])
-
-    # except event_client.exceptions.InternalException as exc:
-    #     print(f"{exc} - " + json.dumps(status_event))
-
-    # return {"status": "success"}
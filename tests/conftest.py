@@ -0,0 +1,15 @@
+import os
+import sys
+
+# The Lambda handlers are deployed as separate assets, so each directory under
+# lambda/ is its own import root. Put them all on the path for the unit tests,
+# along with the shared runtime layer.
+lambda_root = os.path.join(os.path.dirname(os.path.dirname(__file__)), "lambda")
+for name in sorted(os.listdir(lambda_root)):
+    path = os.path.join(lambda_root, name)
+    if name == "layer":
+        path = os.path.join(path, "python")
+    if os.path.isdir(path) and path not in sys.path:
+        sys.path.append(path)
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,131 @@
+"""
+Minimal stand-ins for the boto3 clients the handlers use.
+"""
+
+import json
+
+import botocore.exceptions
+
+
+class FakeEventsClient:
+    """Records PutEvents calls and fails entries according to ``failures``."""
+
+    class exceptions:
+        ClientError = botocore.exceptions.ClientError
+
+    def __init__(self, failures=None):
+        # maps entry Detail -> list of error codes to return on successive calls
+        self.failures = failures or {}
+        self.calls = []
+
+    def put_events(self, Entries):
+        self.calls.append(Entries)
+        results = []
+        for entry in Entries:
+            codes = self.failures.get(entry["Detail"])
+            if codes:
+                code = codes.pop(0)
+                results.append({"ErrorCode": code, "ErrorMessage": code})
+            else:
+                results.append({"EventId": "id"})
+        failed = sum(1 for result in results if "ErrorCode" in result)
+        return {"FailedEntryCount": failed, "Entries": results}
+
+
+class FakeSqsClient:
+    class exceptions:
+        ClientError = botocore.exceptions.ClientError
+
+    def __init__(self, count=0, failures=None):
+        self.messages = [
+            {
+                "MessageId": str(n),
+                "ReceiptHandle": f"handle-{n}",
+                "Body": json.dumps({"detail": {"Key": f"processed/{n}"}}),
+            }
+            for n in range(count)
+        ]
+        self.waits = []
+        # maps receipt handle (deletes) or entry id (sends) -> (error code,
+        # sender fault)
+        self.failures = failures or {}
+        self.deleted = []
+        self.sent = []
+        self.batches = []
+        self.visibility = {}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds, **kwargs):
+        self.waits.append(WaitTimeSeconds)
+        batch = self.messages[:MaxNumberOfMessages]
+        del self.messages[:MaxNumberOfMessages]
+        return {"Messages": batch} if batch else {}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self.visibility[ReceiptHandle] = VisibilityTimeout
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        for entry in Entries:
+            self.visibility[entry["ReceiptHandle"]] = entry["VisibilityTimeout"]
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.batches.append((QueueUrl, len(Entries)))
+        response = {"Successful": [], "Failed": []}
+        for entry in Entries:
+            failure = self.failures.get(entry["ReceiptHandle"])
+            if failure:
+                code, sender_fault = failure
+                response["Failed"].append(
+                    {"Id": entry["Id"], "Code": code, "SenderFault": sender_fault}
+                )
+            else:
+                self.deleted.append(entry["ReceiptHandle"])
+                response["Successful"].append({"Id": entry["Id"]})
+        return response
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.batches.append((QueueUrl, len(Entries)))
+        response = {"Successful": [], "Failed": []}
+        for entry in Entries:
+            failure = self.failures.get(entry["Id"])
+            if failure:
+                code, sender_fault = failure
+                response["Failed"].append(
+                    {"Id": entry["Id"], "Code": code, "SenderFault": sender_fault}
+                )
+            else:
+                self.sent.append(entry["MessageBody"])
+                response["Successful"].append({"Id": entry["Id"]})
+        return response
+
+
+class ZerosBody:
+    """StreamingBody of ``size`` zero bytes, made as they are read."""
+
+    def __init__(self, size):
+        self.left = size
+        self.closed = False
+
+    def read(self, amt):
+        count = min(amt, self.left)
+        self.left -= count
+        return bytes(count)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeS3Client:
+    """GetObject of an object of zeros, ``size`` bytes long."""
+
+    class exceptions:
+        ClientError = botocore.exceptions.ClientError
+
+    def __init__(self, size, etag):
+        self.size = size
+        self.etag = etag
+        self.bodies = []
+
+    def get_object(self, **kwargs):
+        self.bodies.append(ZerosBody(self.size))
+        return {"Body": self.bodies[-1], "ETag": self.etag, "ContentLength": self.size}
@@ -0,0 +1,287 @@
+import gzip
+import hashlib
+import io
+import json
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import api_client
+from api_client import FAILED, REJECTED, SUCCEEDED, ApiClient, api_status
+import test_api
+from uploader.simulator.api_server import ApiServer, read_chunked
+
+from .fakes import FakeS3Client
+
+MIB = 1024 * 1024
+
+
+def detail(key, age_seconds=0):
+    last_modified = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    return {
+        "Bucket": "inbound",
+        "Key": key,
+        "eTag": "abc",
+        "Size": 4,
+        "LastModified": last_modified.isoformat(),
+        "message": {"queue_url": "q", "receipt_handle": "r"},
+    }
+
+
+@pytest.mark.parametrize(
+    "status_code,status",
+    [
+        (200, SUCCEEDED),
+        (204, SUCCEEDED),
+        (400, REJECTED),
+        (422, REJECTED),
+        (408, FAILED),
+        (429, FAILED),
+        (500, FAILED),
+        (503, FAILED),
+        (302, FAILED),
+    ],
+)
+def test_api_status(status_code, status):
+    assert api_status(status_code) == status
+
+
+@pytest.fixture
+def api():
+    with ApiServer() as server:
+        yield server
+
+
+def test_submit_against_test_api(api):
+    client = ApiClient(api.url)
+
+    assert client.submit(detail("processed/object-1.txt")) == SUCCEEDED
+    assert client.submit(detail("processed/reject-1.txt")) == REJECTED
+    assert client.submit(detail("processed/fail-1.txt")) == FAILED
+    # test_api lets failing objects through once they are old enough
+    assert client.submit(detail("processed/fail-1.txt", age_seconds=300)) == SUCCEEDED
+
+    # the connection is kept open for every request
+    assert api.requests == 4
+    assert api.connections == 1
+
+
+def test_request_body():
+    client = ApiClient("http://127.0.0.1/submit", gzip_min_bytes=0)
+
+    body, headers = client.request_body(detail("processed/a.txt"))
+
+    assert headers["Content-Encoding"] == "gzip"
+    sent = json.loads(gzip.decompress(body))
+    assert sent["Key"] == "processed/a.txt"
+    assert "message" not in sent
+
+    body, headers = ApiClient("http://127.0.0.1/submit").request_body(
+        detail("processed/a.txt")
+    )
+    assert "Content-Encoding" not in headers
+
+
+def test_gzipped_request_is_read_by_test_api(api):
+    client = ApiClient(api.url, gzip_min_bytes=0)
+
+    assert client.submit(detail("processed/reject-2.txt")) == REJECTED
+
+
+def test_slow_api_fails():
+    def slow_handler(event, context):
+        time.sleep(1)
+        return {"statusCode": 200}
+
+    with ApiServer(handler=slow_handler) as api:
+        client = ApiClient(api.url, read_timeout=0.1)
+
+        assert client.submit(detail("processed/object-1.txt")) == FAILED
+
+
+def test_unreachable_api_fails():
+    with ApiServer() as api:
+        url = api.url
+
+    assert ApiClient(url, connect_timeout=0.5).submit(detail("a.txt")) == FAILED
+
+
+def test_test_api_rejects_bad_requests():
+    response = test_api.lambda_handler(
+        {"httpMethod": "POST", "path": "/submit", "body": "{}"}, None
+    )
+
+    assert response["statusCode"] == 400
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="inbound")
+        yield client
+
+
+def put(s3_client, key, parts):
+    """Upload ``parts`` as one object, in parts if there is more than one."""
+
+    if len(parts) == 1:
+        response = s3_client.put_object(Bucket="inbound", Key=key, Body=parts[0])
+    else:
+        upload = s3_client.create_multipart_upload(Bucket="inbound", Key=key)
+        uploaded = []
+        for number, part in enumerate(parts, 1):
+            response = s3_client.upload_part(
+                Bucket="inbound",
+                Key=key,
+                PartNumber=number,
+                UploadId=upload["UploadId"],
+                Body=part,
+            )
+            uploaded.append({"PartNumber": number, "ETag": response["ETag"]})
+        response = s3_client.complete_multipart_upload(
+            Bucket="inbound",
+            Key=key,
+            UploadId=upload["UploadId"],
+            MultipartUpload={"Parts": uploaded},
+        )
+
+    return {**detail(key), "eTag": response["ETag"], "Size": sum(map(len, parts))}
+
+
+@pytest.fixture
+def recording_api():
+    received = []
+
+    def handler(event, context):
+        received.append(event)
+        return test_api.lambda_handler(event, context)
+
+    with ApiServer(handler=handler) as server:
+        server.received = received
+        yield server
+
+
+@pytest.mark.parametrize(
+    "parts",
+    [
+        [b"small object"],
+        [b"a" * 5 * MIB, b"b" * 5 * MIB, b"c" * 100],
+        # S3 doesn't require the parts to be the same size
+        [b"a" * 5 * MIB, b"b" * (6 * MIB + 3), b"c" * 5 * MIB, b"d" * 100],
+    ],
+    ids=["single", "multipart", "mixed_part_sizes"],
+)
+def test_upload(s3_client, recording_api, parts):
+    object_detail = put(s3_client, "processed/object-1.dat", parts)
+    client = ApiClient(recording_api.url, chunk_bytes=MIB + 7)
+
+    assert client.upload(object_detail, s3_client) == SUCCEEDED
+
+    (event,) = recording_api.received
+    headers = {name.lower(): value for name, value in event["headers"].items()}
+    assert headers["transfer-encoding"] == "chunked"
+    assert json.loads(headers["x-object-detail"])["Key"] == "processed/object-1.dat"
+    assert ("content-md5" in headers) == (len(parts) == 1)
+    assert test_api.submitted(event)["eTag"] == object_detail["eTag"]
+
+
+def test_upload_with_too_many_parts_to_look_up(s3_client, recording_api, monkeypatch):
+    monkeypatch.setattr(api_client, "MAX_PART_LOOKUPS", 2)
+    object_detail = put(
+        s3_client, "processed/object-1.dat", [b"a" * 5 * MIB, b"b" * 5 * MIB, b"c"]
+    )
+    client = ApiClient(recording_api.url)
+
+    # sent without checking the ETag
+    assert client.upload(object_detail, s3_client) == SUCCEEDED
+
+
+def test_upload_of_replaced_object_is_rejected(s3_client, recording_api):
+    object_detail = put(s3_client, "processed/object-1.dat", [b"first"])
+    put(s3_client, "processed/object-1.dat", [b"second"])
+
+    client = ApiClient(recording_api.url)
+
+    assert client.upload(object_detail, s3_client) == REJECTED
+    assert recording_api.requests == 0
+
+
+class CorruptingS3Client:
+    """Changes the last byte of every object read."""
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+        self.exceptions = s3_client.exceptions
+
+    def get_object(self, **kwargs):
+        response = self.s3_client.get_object(**kwargs)
+        response["Body"] = io.BytesIO(response["Body"].read()[:-1] + b"!")
+        return response
+
+
+def test_corrupted_upload_is_not_completed(s3_client, recording_api):
+    object_detail = put(s3_client, "processed/object-1.dat", [b"x" * 3 * MIB])
+    client = ApiClient(recording_api.url)
+
+    status = client.upload(object_detail, CorruptingS3Client(s3_client))
+
+    assert status == FAILED
+    # the request was started, but never finished
+    assert recording_api.requests == 0
+    assert client.upload(object_detail, s3_client) == SUCCEEDED
+
+
+class DrainHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        for chunk in read_chunked(self.rfile):
+            self.server.received += len(chunk)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_upload_memory_is_flat():
+    size = 64 * MIB
+    md5 = hashlib.md5()
+    for _ in range(size // MIB):
+        md5.update(bytes(MIB))
+    s3_client = FakeS3Client(size, f'"{md5.hexdigest()}"')
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DrainHandler)
+    server.received = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = ApiClient(
+            f"http://127.0.0.1:{server.server_port}/submit", chunk_bytes=MIB
+        )
+        object_detail = {**detail("processed/big.dat"), "eTag": s3_client.etag}
+
+        tracemalloc.start()
+        try:
+            status = client.upload(object_detail, s3_client)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert status == SUCCEEDED
+    assert server.received == size
+    assert s3_client.bodies[0].closed
+    # a few chunks at a time, however big the object
+    assert peak < 8 * MIB
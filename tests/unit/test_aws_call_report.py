@@ -0,0 +1,78 @@
+import json
+
+from tools.aws_call_report import aggregate, report, summaries
+
+
+def profile_line(stage, ms, operations, prefix=""):
+    profile = {"stage": stage, "ms": ms, "operations": operations}
+    return f"{prefix}AWS_CALLS {json.dumps(profile)}\n"
+
+
+LINES = [
+    "START RequestId: 1 Version: $LATEST\n",
+    # the metrics line written next to the profile
+    json.dumps({"_aws": {"Timestamp": 0, "CloudWatchMetrics": []}, "Stage": "x"})
+    + "\n",
+    profile_line(
+        "call_api",
+        120.0,
+        {
+            "s3.CopyObject": {"calls": 1, "ms": 80.0, "max_ms": 80.0, "sent": 10},
+            "events.PutEvents": {"calls": 1, "ms": 20.0, "max_ms": 20.0},
+        },
+        prefix="2024-01-01T00:00:00.000Z\t1\tINFO\t",
+    ),
+    profile_line(
+        "call_api",
+        60.0,
+        {"s3.CopyObject": {"calls": 2, "ms": 50.0, "max_ms": 30.0, "retries": 1}},
+    ),
+    profile_line(
+        "delete_object",
+        15.0,
+        {"s3.DeleteObject": {"calls": 1, "ms": 10.0, "max_ms": 10.0, "errors": 1}},
+    ),
+    "AWS_CALLS {not json\n",
+]
+
+
+def test_summaries_skip_other_lines():
+    profiles = list(summaries(LINES))
+
+    assert [profile["stage"] for profile in profiles] == [
+        "call_api",
+        "call_api",
+        "delete_object",
+    ]
+
+
+def test_aggregate():
+    operations, stages = aggregate(summaries(LINES))
+
+    copy = operations["s3.CopyObject"]
+    assert copy["calls"] == 3
+    assert copy["ms"] == 130.0
+    assert copy["max_ms"] == 80.0
+    assert copy["retries"] == 1
+    assert copy["sent"] == 10
+    assert operations["s3.DeleteObject"]["errors"] == 1
+
+    assert stages["call_api"] == {"invocations": 2, "ms": 180.0, "aws_ms": 150.0}
+    assert stages["delete_object"]["invocations"] == 1
+
+
+def test_aggregate_one_stage():
+    operations, stages = aggregate(summaries(LINES), stage="delete_object")
+
+    assert list(operations) == ["s3.DeleteObject"]
+    assert list(stages) == ["delete_object"]
+
+
+def test_report_ranks_operations():
+    operations, stages = aggregate(summaries(LINES))
+
+    lines = report(operations, stages, sort="ms", top=2).splitlines()
+
+    assert lines[1].startswith("s3.CopyObject")
+    assert lines[2].startswith("events.PutEvents")
+    assert "s3.DeleteObject" not in lines[3]
@@ -0,0 +1,99 @@
+import base64
+import hashlib
+
+import pytest
+
+from checksums import ChecksumMismatch, ObjectDigest, etag_parts
+
+
+def multipart_etag(data, part_sizes):
+    digests = []
+    start = 0
+    for size in part_sizes:
+        digests.append(hashlib.md5(data[start : start + size]).digest())
+        start += size
+    return f'"{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}"'
+
+
+def feed(digest, data, chunk_size):
+    for start in range(0, len(data), chunk_size):
+        digest.update(data[start : start + chunk_size])
+
+
+def test_single_part_etag():
+    data = b"some content" * 100
+    digest = ObjectDigest(f'"{hashlib.md5(data).hexdigest()}"')
+    feed(digest, data, 7)
+
+    assert digest.verify() == 1
+    assert digest.size == len(data)
+    assert digest.content_md5 == base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 16, 17, 1000])
+@pytest.mark.parametrize(
+    "part_sizes", [[16] * 48, [300, 100, 368], [700, 68]], ids=["same", "mixed", "2"]
+)
+def test_multipart_etag(chunk_size, part_sizes):
+    data = bytes(range(256)) * 3
+    digest = ObjectDigest(multipart_etag(data, part_sizes), part_sizes=part_sizes)
+    feed(digest, data, chunk_size)
+
+    assert digest.verify() == 1
+    assert digest.content_md5 is None
+
+
+def test_etag_parts():
+    assert etag_parts('"9b2cf535f27731c974343645a3985328-3"') == 3
+    assert etag_parts("9b2cf535f27731c974343645a3985328") == 0
+    assert etag_parts('"not-an-md5"') == 0
+    assert etag_parts(None) == 0
+
+
+def test_mismatch():
+    digest = ObjectDigest(f'"{hashlib.md5(b"expected").hexdigest()}"')
+    digest.update(b"received")
+
+    with pytest.raises(ChecksumMismatch):
+        digest.verify()
+
+    data = b"x" * 40
+    digest = ObjectDigest(multipart_etag(data, [16, 16, 8]), part_sizes=[16, 16, 8])
+    feed(digest, data[:32], 16)
+
+    with pytest.raises(ChecksumMismatch):
+        digest.verify()
+
+    # more content than the parts
+    digest = ObjectDigest(multipart_etag(data, [16, 24]), part_sizes=[16, 24])
+    feed(digest, data + b"x", 16)
+
+    with pytest.raises(ChecksumMismatch):
+        digest.verify()
+
+
+def test_sha256():
+    data = b"some content"
+    sha256 = base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+    digest = ObjectDigest(sha256=sha256)
+    digest.update(data)
+    assert digest.verify() == 1
+
+    digest = ObjectDigest(sha256=sha256)
+    digest.update(b"other content")
+    with pytest.raises(ChecksumMismatch):
+        digest.verify()
+
+    # a checksum of the parts' checksums
+    digest = ObjectDigest(sha256=f"{sha256}-2")
+    digest.update(data)
+    assert digest.verify() == 0
+
+
+def test_unknown_etag_is_not_checked():
+    digest = ObjectDigest('"not-an-md5"')
+    digest.update(b"data")
+
+    assert digest.verify() == 0
+    assert digest.content_md5 is None
@@ -0,0 +1,31 @@
+import pytest
+
+from uploader_runtime import clients
+
+
+@pytest.fixture(autouse=True)
+def reset_clients():
+    clients.reset()
+    yield
+    clients.reset()
+
+
+def test_clients_are_cached():
+    assert clients.client("sqs") is clients.client("sqs")
+    assert clients.resource("s3") is clients.resource("s3")
+    assert clients.client("sqs") is not clients.client("sqs", max_pool_connections=20)
+
+
+def test_config_from_environment(monkeypatch):
+    monkeypatch.setenv("CLIENT_MAX_POOL_CONNECTIONS", "25")
+    monkeypatch.setenv("CLIENT_RETRY_MODE", "adaptive")
+    monkeypatch.setenv("CLIENT_READ_TIMEOUT", "40")
+
+    config = clients.client("events").meta.config
+    assert config.max_pool_connections == 25
+    assert config.retries["mode"] == "adaptive"
+    assert config.read_timeout == 40
+
+    config = clients.client("s3", max_pool_connections=50).meta.config
+    assert config.max_pool_connections == 50
+    assert config.retries["mode"] == "adaptive"
@@ -0,0 +1,81 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import coalesce
+from uploader_runtime import clients
+from uploader_runtime.versions import LatestVersions, normalize_sequencer
+
+from .fakes import FakeEventsClient
+
+
+@pytest.fixture
+def latest_versions(monkeypatch):
+    monkeypatch.setenv("LATEST_VERSION_TABLE", "versions")
+    clients.reset()
+    with mock_aws():
+        boto3.client("dynamodb").create_table(
+            TableName="versions",
+            KeySchema=[{"AttributeName": "ObjectId", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "ObjectId", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield LatestVersions("versions")
+    clients.reset()
+
+
+def test_sequencers_compare_in_write_order():
+    assert normalize_sequencer("0055AED6DCD90281E5") < normalize_sequencer(
+        "0055AED6DCD90281E6"
+    )
+    assert normalize_sequencer("FF") < normalize_sequencer("100")
+
+
+def test_only_newer_versions_are_recorded(latest_versions):
+    assert latest_versions.record("inbound", "processed/a", "0A")
+    assert latest_versions.record("inbound", "processed/a", "0C")
+    # arrived late
+    assert not latest_versions.record("inbound", "processed/a", "0B")
+
+    newest = latest_versions.newest({("inbound", "processed/a"), ("inbound", "other")})
+    assert newest == {("inbound", "processed/a"): normalize_sequencer("0C")}
+
+
+def test_superseded_versions_are_dropped(latest_versions, monkeypatch):
+    events_client = FakeEventsClient()
+    client = clients.client
+    monkeypatch.setattr(
+        clients,
+        "client",
+        lambda name: events_client if name == "events" else client(name),
+    )
+
+    latest_versions.record("inbound", "processed/a", "01")
+    latest_versions.record("inbound", "processed/a", "02")
+    latest_versions.record("inbound", "processed/b", "03")
+
+    def record(message_id, key, sequencer):
+        detail = {"Bucket": "inbound", "Key": key, "Sequencer": sequencer}
+        return {"messageId": message_id, "body": json.dumps({"detail": detail})}
+
+    class Context:
+        invoked_function_arn = "arn:coalesce"
+
+    event = {
+        "Records": [
+            record("1", "processed/a", "01"),
+            record("2", "processed/a", "02"),
+            record("3", "processed/b", "03"),
+        ]
+    }
+    response = coalesce.lambda_handler(event, Context())
+
+    assert response == {"batchItemFailures": []}
+    forwarded = [json.loads(entry["Detail"]) for entry in events_client.calls[0]]
+    assert [(d["Key"], d["Sequencer"]) for d in forwarded] == [
+        ("processed/a", "02"),
+        ("processed/b", "03"),
+    ]
+    assert all(d["status"] == ["ready_for_api"] for d in forwarded)
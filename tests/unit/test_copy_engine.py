@@ -0,0 +1,94 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from copy_engine import MIB, MAX_PARTS, MIN_PART_SIZE, CopyEngine, part_ranges
+
+
+def test_part_ranges_cover_object():
+    ranges = list(part_ranges(12 * MIB + 1, part_size=5 * MIB))
+
+    assert [number for number, _, _ in ranges] == [1, 2, 3]
+    assert ranges[0][1] == 0
+    assert ranges[-1][2] == 12 * MIB
+    assert all(
+        last + 1 == first for (_, _, last), (_, first, _) in zip(ranges, ranges[1:])
+    )
+
+
+def test_part_ranges_respect_limits():
+    assert len(list(part_ranges(100 * MIB, part_size=1))) == 20
+    assert (
+        len(list(part_ranges(MAX_PARTS * MIN_PART_SIZE * 2, part_size=MIN_PART_SIZE)))
+        == MAX_PARTS
+    )
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="inbound")
+        client.create_bucket(Bucket="outbound")
+        yield client
+
+
+@pytest.mark.parametrize(
+    "size,strategy", [(1024, "single"), (12 * MIB + 3, "multipart")]
+)
+def test_copy(s3_client, size, strategy):
+    body = bytes(range(256)) * (size // 256) + b"x" * (size % 256)
+    s3_client.put_object(
+        Bucket="inbound",
+        Key="processed/a",
+        Body=body,
+        ContentType="text/csv",
+        Tagging="Owner=me",
+    )
+
+    engine = CopyEngine(s3_client, multipart_threshold=8 * MIB, part_size=5 * MIB)
+    tag_set = [
+        {"Key": "Owner", "Value": "me"},
+        {"Key": "ElapsedSeconds", "Value": "1.5"},
+    ]
+    result = engine.copy(
+        {"Bucket": "inbound", "Key": "processed/a"},
+        {"Bucket": "outbound", "Key": "copied/processed/a"},
+        tag_set,
+    )
+
+    assert result == {"strategy": strategy, "bytes": size}
+    copied = s3_client.get_object(Bucket="outbound", Key="copied/processed/a")
+    assert copied["Body"].read() == body
+    assert copied["ContentType"] == "text/csv"
+    tags = s3_client.get_object_tagging(Bucket="outbound", Key="copied/processed/a")
+    assert tags["TagSet"] == tag_set
+    assert not s3_client.list_multipart_uploads(Bucket="outbound").get("Uploads")
+
+
+def test_copy_resumes_from_checkpoint(s3_client):
+    body = b"y" * (12 * MIB)
+    s3_client.put_object(Bucket="inbound", Key="processed/big", Body=body)
+    source = {"Bucket": "inbound", "Key": "processed/big"}
+    target = {"Bucket": "outbound", "Key": "copied/processed/big"}
+
+    # an upload left behind by an invocation that timed out
+    orphan = s3_client.create_multipart_upload(**target)["UploadId"]
+
+    engine = CopyEngine(
+        s3_client, multipart_threshold=8 * MIB, part_size=5 * MIB, max_concurrency=1
+    )
+    remaining = iter([60000, 1000])
+    first = engine.copy(source, target, [], time_left=lambda: next(remaining))
+
+    checkpoint = first["checkpoint"]
+    assert first["bytes"] == 5 * MIB
+    assert checkpoint["PartSize"] == 5 * MIB
+    assert [number for number, _ in checkpoint["Parts"]] == [1]
+
+    second = engine.copy(source, target, [], checkpoint=checkpoint)
+
+    assert second == {"strategy": "multipart", "bytes": 12 * MIB}
+    assert s3_client.get_object(**target)["Body"].read() == body
+    uploads = s3_client.list_multipart_uploads(Bucket="outbound").get("Uploads", [])
+    assert orphan not in [upload["UploadId"] for upload in uploads]
@@ -0,0 +1,35 @@
+import json
+
+from delete_message import delete_records
+
+from .fakes import FakeSqsClient
+
+
+def record(message_id, queue_url, receipt_handle):
+    detail = {
+        "Key": f"processed/{message_id}",
+        "status": ["succeeded"],
+        "message": {"queue_url": queue_url, "receipt_handle": receipt_handle},
+    }
+    return {"messageId": message_id, "body": json.dumps({"detail": detail})}
+
+
+def test_messages_deleted_in_batches_per_queue():
+    records = [record(f"a{n}", "queue-a", f"handle-a{n}") for n in range(12)]
+    records += [record(f"b{n}", "queue-b", f"handle-b{n}") for n in range(3)]
+    records.append({"messageId": "bad", "body": "not json"})
+    sqs_client = FakeSqsClient(
+        failures={
+            "handle-a3": ("InternalError", False),
+            # retrying won't help
+            "handle-b1": ("ReceiptHandleIsInvalid", True),
+        }
+    )
+
+    response = delete_records(records, sqs_client)
+
+    assert sqs_client.batches == [("queue-a", 10), ("queue-a", 2), ("queue-b", 3)]
+    assert len(sqs_client.deleted) == 13
+    assert response == {
+        "batchItemFailures": [{"itemIdentifier": "bad"}, {"itemIdentifier": "a3"}]
+    }
@@ -0,0 +1,47 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from delete_object import delete_records
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="inbound")
+        client.put_bucket_versioning(
+            Bucket="inbound", VersioningConfiguration={"Status": "Enabled"}
+        )
+        yield client
+
+
+def record(message_id, bucket, key, version=None):
+    detail = {"Bucket": bucket, "Key": key, "status": ["succeeded"]}
+    if version:
+        detail["VersionId"] = version
+    return {"messageId": message_id, "body": json.dumps({"detail": detail})}
+
+
+def test_objects_deleted_in_bulk(s3_client):
+    processed = s3_client.put_object(Bucket="inbound", Key="a.csv", Body=b"1")
+    newer = s3_client.put_object(Bucket="inbound", Key="a.csv", Body=b"2")
+    for n in range(1100):
+        s3_client.put_object(Bucket="inbound", Key=f"b/{n}.csv", Body=b"")
+
+    records = [record("a", "inbound", "a.csv", processed["VersionId"])]
+    records += [record(f"b{n}", "inbound", f"b/{n}.csv") for n in range(1100)]
+    # delivered twice
+    records.append(record("b0-again", "inbound", "b/0.csv"))
+    records.append(record("missing", "no-such-bucket", "c.csv"))
+
+    response = delete_records(records, s3_client)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "missing"}]}
+    # only the version that was processed is gone
+    versions = s3_client.list_object_versions(Bucket="inbound", Prefix="a.csv")
+    assert [v["VersionId"] for v in versions["Versions"]] == [newer["VersionId"]]
+    remaining = s3_client.list_objects_v2(Bucket="inbound", Prefix="b/")
+    assert remaining["KeyCount"] == 0
@@ -0,0 +1,75 @@
+import json
+
+from uploader_runtime import retries
+
+from tools.dlq_report import entries, summary
+
+NOW = 1_700_000_000
+
+
+def message(id, detail=None, body=None, hours_ago=1.0):
+    sent = int((NOW - hours_ago * 3600) * 1000)
+    return {
+        "MessageId": id,
+        "Body": body if body is not None else retries.encode(detail),
+        "Attributes": {"SentTimestamp": str(sent)},
+    }
+
+
+MESSAGES = [
+    message(
+        "1",
+        {"Bucket": "inbound", "Key": "processed/a/1.csv", "Size": 10, "attempt": 10},
+        hours_ago=2,
+    ),
+    message(
+        "2",
+        {"Bucket": "inbound", "Key": "processed/a/2.csv", "Size": 20, "attempt": 10},
+        hours_ago=5,
+    ),
+    message(
+        "3",
+        {"Bucket": "other", "Key": "processed/b/3.csv", "Size": 5, "attempt": 12},
+    ),
+    # a whole event, from before the retry record
+    message(
+        "4",
+        body=json.dumps({"detail": {"Bucket": "inbound", "Key": "processed/a/4.csv"}}),
+    ),
+    message("5", body="not json"),
+]
+
+
+def test_entries():
+    rows = entries(MESSAGES, now=NOW)
+
+    assert rows[0] == {
+        "bucket": "inbound",
+        "key": "processed/a/1.csv",
+        "size": 10,
+        "attempts": 10,
+        "received": None,
+        "hours_in_queue": 2.0,
+    }
+    assert rows[3]["attempts"] == 0
+    # unreadable bodies are still listed
+    assert rows[4]["key"] == "<unreadable message 5>"
+    assert rows[4]["bucket"] is None
+
+
+def test_summary():
+    totals = summary(entries(MESSAGES, now=NOW))
+
+    assert totals["objects"] == 5
+    assert totals["bytes"] == 35
+    assert totals["oldest_hours"] == 5.0
+    assert totals["by_bucket"] == {"inbound": 3, "other": 1, None: 1}
+    assert totals["by_prefix"] == {"processed/a": 3, "processed/b": 1, "/": 1}
+    assert totals["by_attempts"] == {0: 2, 10: 2, 12: 1}
+
+
+def test_summary_of_nothing():
+    totals = summary([])
+
+    assert totals["objects"] == 0
+    assert totals["oldest_hours"] is None
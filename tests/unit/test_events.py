@@ -0,0 +1,86 @@
+import json
+
+from uploader_runtime.events import (
+    MAX_ENTRIES_PER_CALL,
+    MAX_SQS_BATCH_BYTES,
+    EventBatcher,
+    batches,
+    entry_size,
+    message_bytes,
+)
+
+from .fakes import FakeEventsClient
+
+
+def make_entry(n, size=10):
+    return {
+        "DetailType": "API Status",
+        "Source": "test",
+        "Detail": json.dumps({"n": n, "pad": "x" * size}),
+    }
+
+
+def test_entries_are_packed_by_count():
+    client = FakeEventsClient()
+    batcher = EventBatcher(client, sleep=lambda _: None)
+    for n in range(25):
+        batcher.add(make_entry(n), tag=n)
+    batcher.flush()
+
+    assert [len(call) for call in client.calls] == [MAX_ENTRIES_PER_CALL] * 2 + [5]
+    assert batcher.succeeded == list(range(25))
+    assert not batcher.failed
+
+
+def test_entries_are_packed_by_size():
+    client = FakeEventsClient()
+    batcher = EventBatcher(client, sleep=lambda _: None)
+    entries = [make_entry(n, size=100 * 1024) for n in range(3)]
+    for n, entry in enumerate(entries):
+        batcher.add(entry, tag=n)
+    batcher.flush()
+
+    assert [len(call) for call in client.calls] == [2, 1]
+    assert all(sum(entry_size(e) for e in call) <= 256 * 1024 for call in client.calls)
+
+
+def test_only_failed_entries_are_resubmitted():
+    entries = [make_entry(n) for n in range(3)]
+    client = FakeEventsClient(failures={entries[1]["Detail"]: ["ThrottlingException"]})
+    delays = []
+    batcher = EventBatcher(client, sleep=delays.append)
+    for n, entry in enumerate(entries):
+        batcher.add(entry, tag=n)
+    batcher.flush()
+
+    assert [len(call) for call in client.calls] == [3, 1]
+    assert client.calls[1][0] is entries[1]
+    assert sorted(batcher.succeeded) == [0, 1, 2]
+    assert len(delays) == 1
+
+
+def test_non_retryable_failures_are_reported():
+    entries = [make_entry(n) for n in range(2)]
+    client = FakeEventsClient(
+        failures={
+            entries[0]["Detail"]: ["MalformedDetail"],
+            entries[1]["Detail"]: ["InternalFailure"] * 10,
+        }
+    )
+    batcher = EventBatcher(client, max_attempts=3, sleep=lambda _: None)
+    for n, entry in enumerate(entries):
+        batcher.add(entry, tag=n)
+    batcher.flush()
+
+    assert len(client.calls) == 3
+    assert batcher.succeeded == []
+    assert sorted(batcher.failed) == [(0, "MalformedDetail"), (1, "InternalFailure")]
+
+
+def test_batches_stay_under_the_size_limit():
+    body = "x" * (MAX_SQS_BATCH_BYTES // 2)
+    entries = [{"Id": str(n), "MessageBody": body} for n in range(5)]
+
+    sizes = [len(b) for b in batches(entries, 10, MAX_SQS_BATCH_BYTES, message_bytes)]
+    assert sizes == [2, 2, 1]
+    assert [len(b) for b in batches(range(25), 10)] == [10, 10, 5]
@@ -0,0 +1,121 @@
+import json
+
+from uploader_runtime import metrics
+from handle_retries import SAFETY_MARGIN_MS, forward_records, poll
+
+from .fakes import FakeEventsClient, FakeSqsClient
+
+
+def test_poll_drains_queue():
+    sqs_client = FakeSqsClient(35)
+    events_client = FakeEventsClient()
+    batcher = poll("queue", "arn", sqs_client, events_client, lambda: 60000)
+
+    assert len(batcher.succeeded) == 35
+    assert len(events_client.calls) == 4
+    detail = json.loads(events_client.calls[0][0]["Detail"])
+    assert detail["status"] == ["ready_for_api"]
+    assert detail["message"] == {"queue_url": "queue", "receipt_handle": "handle-0"}
+
+
+def test_poll_stops_before_deadline():
+    sqs_client = FakeSqsClient(100)
+    remaining = iter([60000, 12000, SAFETY_MARGIN_MS])
+    batcher = poll(
+        "queue", "arn", sqs_client, FakeEventsClient(), lambda: next(remaining)
+    )
+
+    # the second receive only waits as long as the invocation can afford
+    assert sqs_client.waits == [15, 7]
+    assert len(batcher.succeeded) == 20
+
+
+def test_records_report_batch_item_failures():
+    records = [
+        {"messageId": str(n), "body": json.dumps({"detail": {"Key": f"k{n}"}})}
+        for n in range(3)
+    ]
+    records.append({"messageId": "bad", "body": "not json"})
+    client = FakeEventsClient(
+        failures={
+            json.dumps({"Key": "k1", "status": ["ready_for_api"]}): ["MalformedDetail"]
+        }
+    )
+    response = forward_records(records, "arn", client)
+
+    assert response == {
+        "batchItemFailures": [{"itemIdentifier": "bad"}, {"itemIdentifier": "1"}]
+    }
+    # the mapping deletes the records, so the events don't reference them
+    assert all("message" not in json.loads(e["Detail"]) for e in client.calls[0])
+
+
+def test_attempts_are_recorded_from_the_retry_record(capsys):
+    # with the event source mapping each retry is a new message
+    records = [
+        {
+            "messageId": "0",
+            "body": json.dumps({"v": 1, "detail": {"Key": "k0", "attempt": 3}}),
+            "attributes": {"ApproximateReceiveCount": "1"},
+        }
+    ]
+
+    @metrics.instrument("handle_retries")
+    def handler(event, context):
+        return forward_records(event["Records"], "arn", FakeEventsClient())
+
+    handler({"Records": records}, None)
+
+    (document,) = [
+        json.loads(line)
+        for line in capsys.readouterr().out.splitlines()
+        if "RetryAttempts" in line
+    ]
+    assert document["RetryAttempts"] == 3
+
+
+def test_received_messages_back_off(monkeypatch):
+    monkeypatch.setenv("RETRY_BACKOFF_BASE_SECONDS", "100")
+    sqs_client = FakeSqsClient(2)
+    sqs_client.messages[0]["Body"] = json.dumps(
+        {"v": 1, "detail": {"Key": "processed/0", "attempt": 3}}
+    )
+    sqs_client.messages[1]["Attributes"] = {"ApproximateReceiveCount": "2"}
+    events_client = FakeEventsClient()
+    poll("queue", "arn", sqs_client, events_client, lambda: 60000)
+
+    # if this attempt fails too, they come back after the backoff for it
+    assert 400 <= sqs_client.visibility["handle-0"] <= 800
+    assert 100 <= sqs_client.visibility["handle-1"] <= 200
+    details = [json.loads(entry["Detail"]) for entry in events_client.calls[0]]
+    assert [detail.get("attempt") for detail in details] == [3, 1]
+
+
+def test_objects_out_of_attempts_are_dead_lettered(monkeypatch):
+    monkeypatch.setenv("RETRY_MAX_ATTEMPTS", "3")
+    monkeypatch.setenv("RETRY_DLQ_URL", "dlq")
+    sqs_client = FakeSqsClient(2)
+    # the third failed attempt was the one before this receive
+    sqs_client.messages[0]["Attributes"] = {"ApproximateReceiveCount": "4"}
+    events_client = FakeEventsClient()
+    batcher = poll("queue", "arn", sqs_client, events_client, lambda: 60000)
+
+    assert len(batcher.succeeded) == 1
+    assert sqs_client.batches == [("dlq", 1), ("queue", 1)]
+    assert json.loads(sqs_client.sent[0])["detail"] == {
+        "Key": "processed/0",
+        "attempt": 3,
+    }
+    assert sqs_client.deleted == ["handle-0"]
+
+
+def test_unreadable_message_is_skipped():
+    sqs_client = FakeSqsClient(3)
+    sqs_client.messages[1]["Body"] = "not json"
+    events_client = FakeEventsClient()
+    batcher = poll("queue", "arn", sqs_client, events_client, lambda: 60000)
+
+    assert len(batcher.succeeded) == 2
+    # the others still back off, the bad one is left for the redrive policy
+    assert set(sqs_client.visibility) == {"handle-0", "handle-2"}
+    assert sqs_client.deleted == []
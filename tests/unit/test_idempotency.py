@@ -0,0 +1,93 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from uploader_runtime import clients
+from uploader_runtime.idempotency import (
+    CLAIMED,
+    COMPLETED,
+    IN_PROGRESS,
+    IdempotencyStore,
+)
+
+OBJECT = ("inbound", "processed/a.csv", '"b1946ac92492d2347c6235b4d2611184"')
+
+
+@pytest.fixture
+def dynamodb():
+    clients.reset()
+    with mock_aws():
+        client = boto3.client("dynamodb")
+        client.create_table(
+            TableName="idempotency",
+            KeySchema=[{"AttributeName": "IdempotencyKey", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "IdempotencyKey", "AttributeType": "S"}
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+    clients.reset()
+
+
+def test_duplicates_while_in_progress(dynamodb):
+    store = IdempotencyStore("idempotency")
+
+    assert store.claim(*OBJECT, "first") == CLAIMED
+    assert store.claim(*OBJECT, "second") == IN_PROGRESS
+    # the original claimant can renew its lease
+    assert store.claim(*OBJECT, "first") == CLAIMED
+
+
+def test_release_lets_a_retry_claim(dynamodb):
+    store = IdempotencyStore("idempotency")
+
+    store.claim(*OBJECT, "first")
+    store.release(*OBJECT, "first")
+    assert store.claim(*OBJECT, "retry") == CLAIMED
+
+    # a stale release doesn't drop the new claim
+    store.release(*OBJECT, "first")
+    assert store.claim(*OBJECT, "other") == IN_PROGRESS
+
+
+def test_expired_lease_can_be_taken_over(dynamodb):
+    store = IdempotencyStore("idempotency", lease_seconds=-1)
+
+    store.claim(*OBJECT, "first")
+    assert store.claim(*OBJECT, "second") == CLAIMED
+
+
+def test_completed_objects_are_cached(dynamodb):
+    store = IdempotencyStore("idempotency", cache_size=1)
+
+    store.claim(*OBJECT, "first")
+    store.complete(*OBJECT, "succeeded")
+
+    other = IdempotencyStore("idempotency")
+    assert other.claim(*OBJECT, "second") == COMPLETED
+
+    dynamodb.delete_table(TableName="idempotency")
+    # answered from memory without touching the table
+    assert store.claim(*OBJECT, "third") == COMPLETED
+    assert other.claim(*OBJECT, "third") == COMPLETED
+
+
+def test_outcome_is_kept(dynamodb):
+    store = IdempotencyStore("idempotency")
+
+    store.claim(*OBJECT, "first")
+    store.complete(*OBJECT, "rejected")
+
+    assert store.outcome(*OBJECT) == "rejected"
+    other = IdempotencyStore("idempotency")
+    assert other.claim(*OBJECT, "second") == COMPLETED
+    assert other.outcome(*OBJECT) == "rejected"
+
+
+def test_etag_quoting_is_ignored(dynamodb):
+    store = IdempotencyStore("idempotency")
+
+    store.claim(*OBJECT, "first")
+    bucket, key, etag = OBJECT
+    assert store.claim(bucket, key, etag.strip('"'), "second") == IN_PROGRESS
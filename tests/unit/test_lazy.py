@@ -0,0 +1,36 @@
+import sys
+
+from uploader_runtime import lazy
+
+
+def test_eager_by_default(monkeypatch):
+    monkeypatch.delenv("LAZY_IMPORTS", raising=False)
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+
+    module = lazy.load("colorsys")
+
+    assert module is sys.modules["colorsys"]
+    assert type(module).__name__ == "module"
+
+
+def test_lazy_module_runs_on_first_use(monkeypatch):
+    monkeypatch.setenv("LAZY_IMPORTS", "true")
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+
+    module = lazy.load("colorsys")
+    assert type(module).__name__ == "_LazyModule"
+
+    assert module.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert type(module).__name__ == "module"
+
+
+def test_lazy_submodule_reachable_from_parent(monkeypatch):
+    monkeypatch.setenv("LAZY_IMPORTS", "true")
+    monkeypatch.delitem(sys.modules, "json.tool", raising=False)
+
+    import json
+
+    monkeypatch.delattr(json, "tool", raising=False)
+    module = lazy.load("json.tool")
+
+    assert json.tool is module
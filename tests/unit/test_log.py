@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from uploader_runtime import log
+
+
+class Unserializable:
+    def __str__(self):
+        raise AssertionError("formatted a disabled message")
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    for name in ("DEBUG", "LOG_LEVEL", "LOG_SAMPLE_RATE"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_structured_lines(capsys):
+    log.info("copied %s bytes (%s)", 6, "copy_object", key="a.csv")
+    log.debug({"detail": {}})
+
+    assert lines(capsys) == [
+        {"level": "INFO", "message": "copied 6 bytes (copy_object)", "key": "a.csv"}
+    ]
+
+
+def test_disabled_levels_are_not_formatted(monkeypatch, capsys):
+    monkeypatch.setenv("LOG_LEVEL", "error")
+
+    log.info("%s", Unserializable())
+    log.warning("%s", Unserializable())
+    log.error("failed")
+
+    assert [line["level"] for line in lines(capsys)] == ["ERROR"]
+
+
+def test_sampling(monkeypatch, capsys):
+    monkeypatch.setenv("LOG_SAMPLE_RATE", "0")
+    log.sampled("ignoring %s", "a.txt")
+    log.error("failed")
+    assert [line["level"] for line in lines(capsys)] == ["ERROR"]
+
+    # EnableDebug logs everything
+    monkeypatch.setenv("DEBUG", "true")
+    log.sampled("ignoring %s", "a.txt")
+    log.debug({"detail": {}})
+    assert lines(capsys) == [
+        {"level": "INFO", "message": "ignoring a.txt"},
+        {"detail": {}},
+    ]
@@ -0,0 +1,52 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from uploader_runtime import metrics
+
+
+def emitted(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_instrumented_handler_emits_emf(capsys):
+    received = datetime.now(timezone.utc) - timedelta(seconds=2)
+
+    @metrics.instrument("call_api")
+    def handler(event, context):
+        metrics.stage_latency(event["detail"])
+        with metrics.timed("PutEvents"):
+            pass
+        metrics.current().put("BytesCopied", 6, metrics.BYTES)
+        return "done"
+
+    assert handler({"detail": {"received": received.isoformat()}}, None) == "done"
+
+    (document,) = emitted(capsys)
+    (directive,) = document["_aws"]["CloudWatchMetrics"]
+    assert directive["Dimensions"] == [["Stage"]]
+    assert {m["Name"]: m["Unit"] for m in directive["Metrics"]} == {
+        "BytesCopied": "Bytes",
+        "PutEventsTime": "Milliseconds",
+        "StageLatency": "Milliseconds",
+    }
+    assert document["Stage"] == "call_api"
+    assert document["BytesCopied"] == 6
+    assert 2000 <= document["StageLatency"] < 60000
+
+
+def test_values_split_across_lines(capsys):
+    recorder = metrics.Metrics("handle_retries")
+    for n in range(250):
+        recorder.put("RetryAttempts", n)
+    recorder.flush()
+
+    documents = emitted(capsys)
+    assert [len(d["RetryAttempts"]) for d in documents] == [100, 100, 50]
+
+
+def test_nothing_recorded_outside_a_handler(capsys):
+    with metrics.timed("PutEvents"):
+        metrics.stage_latency({"received": "2022-10-24T18:19:30+00:00"})
+
+    assert metrics.current() is None
+    assert capsys.readouterr().out == ""
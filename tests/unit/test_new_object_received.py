@@ -0,0 +1,94 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+import new_object_received
+from uploader_runtime import clients, events
+from uploader_runtime.patterns import compile_pattern
+
+
+class Context:
+    invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:new"
+
+
+def object_created(**object_info):
+    return {
+        "detail-type": "Object Created",
+        "source": "aws.s3",
+        "time": "2022-10-24T18:19:30Z",
+        "detail": {
+            "bucket": {"name": "inbound"},
+            "object": {"key": "processed/a.csv", **object_info},
+        },
+    }
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    details = []
+
+    def send_status(detail, source):
+        details.append(detail)
+        return True
+
+    monkeypatch.setattr(events, "send_status", send_status)
+    clients.reset()
+    yield details
+    clients.reset()
+
+
+def test_detail_built_from_event(sent, monkeypatch):
+    def no_clients(*args, **kwargs):
+        raise AssertionError("unexpected AWS client")
+
+    monkeypatch.setattr(clients, "client", no_clients)
+    monkeypatch.setattr(clients, "resource", no_clients)
+
+    event = object_created(
+        etag="b1946ac92492d2347c6235b4d2611184",
+        size=6,
+        sequencer="00617F08299329D189",
+        **{"version-id": "v1"},
+    )
+    result = new_object_received.lambda_handler(event, Context())
+
+    assert result == {"status": "succeeded"}
+    assert sent == [
+        {
+            "Bucket": "inbound",
+            "Key": "processed/a.csv",
+            "status": ["ready_for_api"],
+            "LastModified": "2022-10-24T18:19:30+00:00",
+            "eTag": '"b1946ac92492d2347c6235b4d2611184"',
+            "Size": 6,
+            "Sequencer": "00617F08299329D189",
+            "VersionId": "v1",
+            "received": "2022-10-24T18:19:30+00:00",
+        }
+    ]
+
+
+def test_head_when_event_is_incomplete(sent):
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="inbound")
+        put = s3_client.put_object(
+            Bucket="inbound", Key="processed/a.csv", Body=b"hello\n"
+        )
+
+        new_object_received.lambda_handler(object_created(), Context())
+
+    assert sent[0]["eTag"] == put["ETag"]
+    assert sent[0]["Size"] == 6
+    assert "Sequencer" not in sent[0]
+
+
+def test_filtered_before_any_work(sent, monkeypatch):
+    pattern = {"detail": {"object": {"key": [{"suffix": ".json"}]}}}
+    monkeypatch.setattr(new_object_received, "event_filter", compile_pattern(pattern))
+
+    # no eTag or size, so anything past the filter would HEAD the object
+    result = new_object_received.lambda_handler(object_created(), Context())
+
+    assert result == {"status": "filtered"}
+    assert sent == []
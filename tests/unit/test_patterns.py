@@ -0,0 +1,75 @@
+import pytest
+
+from uploader_runtime.patterns import compile_pattern, matches
+
+FAILED_RULE = {
+    "detail-type": ["API Status"],
+    "source": ["call_api"],
+    "detail": {
+        "Bucket": ["inbound"],
+        "status": ["failed"],
+        "message": {"queue_url": [{"exists": False}]},
+    },
+}
+
+
+def status_event(**detail):
+    return {
+        "detail-type": "API Status",
+        "source": "call_api",
+        "detail": {"Bucket": "inbound", "status": ["failed"], **detail},
+    }
+
+
+@pytest.mark.parametrize(
+    "pattern, event, expected",
+    [
+        (FAILED_RULE, status_event(), True),
+        (FAILED_RULE, status_event(message={"queue_url": "q"}), False),
+        (FAILED_RULE, status_event(status=["succeeded"]), False),
+        (FAILED_RULE, status_event(Bucket="outbound"), False),
+        # status is a list in the event; any element can match
+        (FAILED_RULE, status_event(status=["retrying", "failed"]), True),
+        ({"key": [{"prefix": "processed/"}]}, {"key": "processed/a.csv"}, True),
+        ({"key": [{"prefix": "processed/"}]}, {"key": "incoming/a.csv"}, False),
+        ({"key": [{"suffix": ".csv"}, {"suffix": ".json"}]}, {"key": "a.json"}, True),
+        ({"key": [{"suffix": ".csv"}]}, {"key": "a.csv.tmp"}, False),
+        ({"key": [{"suffix": ".csv"}]}, {}, False),
+        ({"status": [{"anything-but": "failed"}]}, {"status": "succeeded"}, True),
+        ({"status": [{"anything-but": ["failed", "x"]}]}, {"status": "x"}, False),
+        ({"status": [{"anything-but": "failed"}]}, {}, False),
+        ({"key": [{"anything-but": {"prefix": "tmp/"}}]}, {"key": "tmp/a"}, False),
+        ({"size": [{"numeric": [">", 0, "<=", 5]}]}, {"size": 5}, True),
+        ({"size": [{"numeric": [">", 0, "<=", 5]}]}, {"size": 6}, False),
+        ({"size": [{"numeric": [">", 0]}]}, {"size": "6"}, False),
+        ({"size": [{"numeric": ["=", 1]}]}, {"size": True}, False),
+        ({"size": [{"exists": True}]}, {"size": None}, True),
+        ({"a": {"b": [{"exists": True}]}}, {"a": "not an object"}, False),
+        ({"a": {"b": [{"exists": False}]}}, {}, True),
+        ({"a": [None]}, {"a": None}, True),
+        ({"a": [None]}, {}, False),
+        ({"a": [1]}, {"a": True}, False),
+        (
+            {"reason": [{"equals-ignore-case": "putobject"}]},
+            {"reason": "PutObject"},
+            True,
+        ),
+    ],
+)
+def test_compiled_matches_naive(pattern, event, expected):
+    assert matches(pattern, event) is expected
+    assert compile_pattern(pattern)(event) is expected
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        {"key": "processed/"},
+        {"key": [{"wildcard": "*.csv"}]},
+        {"size": [{"numeric": [">", 0, "<"]}]},
+        {"size": [{"numeric": ["~", 0]}]},
+    ],
+)
+def test_bad_patterns_rejected(pattern):
+    with pytest.raises(ValueError):
+        compile_pattern(pattern)
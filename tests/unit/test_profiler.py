@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from moto import mock_aws
+
+from uploader_runtime import clients, metrics, profiler
+
+
+@pytest.fixture
+def profiling(monkeypatch):
+    monkeypatch.setenv("PROFILE_AWS_CALLS", "true")
+    clients.reset()
+    with mock_aws():
+        yield
+    clients.reset()
+
+
+def profile_lines(capsys):
+    return [
+        json.loads(line[len(profiler.PREFIX) + 1 :])
+        for line in capsys.readouterr().out.splitlines()
+        if line.startswith(profiler.PREFIX)
+    ]
+
+
+def test_calls_profiled_per_invocation(profiling, capsys):
+    sqs = clients.client("sqs")
+    queue_url = sqs.create_queue(QueueName="retry")["QueueUrl"]
+
+    @metrics.instrument("send_to_retry_queue")
+    def handler(event, context):
+        for _ in range(3):
+            sqs.send_message(QueueUrl=queue_url, MessageBody="x" * 100)
+        with pytest.raises(sqs.exceptions.ClientError):
+            clients.client("s3").delete_bucket(Bucket="missing")
+
+    handler({}, None)
+
+    (summary,) = profile_lines(capsys)
+    assert summary["stage"] == "send_to_retry_queue"
+    send = summary["operations"]["sqs.SendMessage"]
+    assert send["calls"] == 3
+    assert send["errors"] == 0
+    assert send["sent"] > 300
+    assert send["ms"] >= send["max_ms"] > 0
+    assert summary["operations"]["s3.DeleteBucket"]["errors"] == 1
+    # made before the invocation
+    assert "sqs.CreateQueue" not in summary["operations"]
+
+
+def test_off_by_default(monkeypatch, capsys):
+    monkeypatch.delenv("PROFILE_AWS_CALLS", raising=False)
+
+    metrics.instrument("stage")(lambda event, context: None)({}, None)
+
+    assert profile_lines(capsys) == []
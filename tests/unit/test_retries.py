@@ -0,0 +1,58 @@
+import json
+import time
+
+from uploader_runtime import retries
+
+from .fakes import FakeSqsClient
+
+MIB = 1024 * 1024
+
+
+def test_whole_events_still_read():
+    detail = {"Bucket": "inbound", "Key": "processed/a", "status": ["failed"]}
+    event = json.dumps({"detail-type": "API Status", "detail": detail})
+
+    assert retries.decode(event) == detail
+    assert retries.decode(retries.encode(detail)) == {
+        "Bucket": "inbound",
+        "Key": "processed/a",
+    }
+
+
+def test_backoff_grows_with_attempts(monkeypatch):
+    monkeypatch.setenv("RETRY_BACKOFF_BASE_SECONDS", "60")
+    monkeypatch.setenv("RETRY_BACKOFF_MAX_SECONDS", "900")
+
+    for attempt, low, high in [(1, 30, 60), (2, 60, 120), (3, 120, 240), (9, 450, 900)]:
+        assert low <= retries.backoff_seconds(attempt) <= high
+
+    detail, delay = retries.failed({"Key": "processed/a", "attempt": 2})
+    assert detail["attempt"] == 3
+    assert 120 <= delay <= 240
+    # a received message stays in flight at least as long as before
+    assert retries.visibility_timeout(0) == retries.MIN_VISIBILITY_SECONDS
+
+
+def test_big_objects_stay_invisible_longer(monkeypatch):
+    monkeypatch.setenv("RETRY_BACKOFF_BASE_SECONDS", "0")
+
+    assert retries.visibility_timeout(1) == 60
+    assert retries.visibility_timeout(1, size=20 * 60 * MIB) == 120
+
+
+def test_heartbeat_extends_visibility_while_working(monkeypatch):
+    monkeypatch.setenv("RETRY_BACKOFF_BASE_SECONDS", "100")
+    sqs_client = FakeSqsClient()
+    message = {"queue_url": "queue", "receipt_handle": "handle"}
+
+    with retries.Heartbeat(sqs_client, message, attempt=1, interval=0.01) as heartbeat:
+        time.sleep(0.1)
+
+    assert heartbeat.beats
+    # the backoff after a second failed attempt
+    assert 100 <= sqs_client.visibility["handle"] <= 200
+
+    # no beats for quick work
+    with retries.Heartbeat(FakeSqsClient(), message) as heartbeat:
+        pass
+    assert heartbeat.beats == 0
@@ -0,0 +1,35 @@
+import json
+
+from send_to_retry_queue import send_records
+
+from .fakes import FakeSqsClient
+
+
+def test_failed_objects_sent_in_batches():
+    records = [
+        {
+            "messageId": str(n),
+            "body": json.dumps(
+                {
+                    "detail-type": "API Status",
+                    "detail": {"Key": f"processed/{n}", "status": ["failed"]},
+                }
+            ),
+        }
+        for n in range(23)
+    ]
+    records.append({"messageId": "bad", "body": "{}"})
+    sqs_client = FakeSqsClient(
+        failures={"4": ("InternalError", False), "7": ("InvalidMessageContents", True)}
+    )
+
+    response = send_records(records, "retry", sqs_client)
+
+    assert sqs_client.batches == [("retry", 10), ("retry", 10), ("retry", 3)]
+    assert response == {
+        "batchItemFailures": [{"itemIdentifier": "bad"}, {"itemIdentifier": "4"}]
+    }
+    assert json.loads(sqs_client.sent[0]) == {
+        "v": 1,
+        "detail": {"Key": "processed/0", "attempt": 1},
+    }
@@ -0,0 +1,105 @@
+import json
+
+import boto3
+import pytest
+
+from uploader.simulator.simulator import Simulator
+from uploader.simulator.template import synthesize
+
+
+@pytest.fixture(scope="module")
+def template():
+    return synthesize({"RetryMode": "schedule", "EnableIdempotency": "True"})
+
+
+def test_objects_move_through_the_pipeline(template):
+    with Simulator(template, concurrency=4) as sim:
+        for n in range(8):
+            sim.put_object(f"processed/object-{n}.txt", b"data")
+        sim.put_object("processed/reject-me.txt", b"data")
+        sim.put_object("processed/fail-me.txt", b"data")
+        # not under the prefix, so NewObjectInBucketRule ignores it
+        sim.put_object("incoming/ignored.txt", b"data")
+
+        assert sim.run_until_idle(timeout=60)
+
+        s3 = boto3.client("s3")
+        inbound = s3.list_objects_v2(Bucket=sim.bucket("Inbound"))
+        outbound = s3.list_objects_v2(Bucket=sim.bucket("Outbound"))
+        assert {item["Key"] for item in inbound["Contents"]} == {
+            "processed/reject-me.txt",
+            "processed/fail-me.txt",
+            "incoming/ignored.txt",
+        }
+        assert len(outbound["Contents"]) == 8
+
+        sqs = boto3.client("sqs")
+        (queue_url,) = sqs.list_queues(QueueNamePrefix="retryqueue")["QueueUrls"]
+        messages = sqs.receive_message(QueueUrl=queue_url)["Messages"]
+        assert (
+            json.loads(messages[0]["Body"])["detail"]["Key"] == "processed/fail-me.txt"
+        )
+
+        report = sim.report()
+        assert report["new_object_received"]["invocations"] == 10
+        assert report["call_api"]["statuses"] == {"success": 10}
+        assert report["delete_object"]["invocations"] == 8
+        assert report["send_to_retry_queue"]["invocations"] == 1
+
+        calls = sim.calls()
+        assert calls["s3.CopyObject"] == 8
+        assert calls["s3.DeleteObject"] == 8
+        assert calls["events.PutEvents"] == 20
+
+
+@pytest.mark.parametrize("send_content", ["false", "true"])
+def test_call_api_calls_the_api_over_http(template, send_content):
+    environment = {"API_SEND_CONTENT": send_content}
+    with Simulator(template, concurrency=4, environment=environment, api=True) as sim:
+        for n in range(4):
+            sim.put_object(f"processed/object-{n}.txt", b"data")
+        sim.put_object("processed/reject-me.txt", b"data")
+
+        assert sim.run_until_idle(timeout=60)
+
+        s3 = boto3.client("s3")
+        inbound = s3.list_objects_v2(Bucket=sim.bucket("Inbound"))
+        outbound = s3.list_objects_v2(Bucket=sim.bucket("Outbound"))
+        assert [item["Key"] for item in inbound["Contents"]] == [
+            "processed/reject-me.txt"
+        ]
+        # the API took the objects, so nothing was copied
+        assert "Contents" not in outbound
+
+        assert sim.api_server.requests == 5
+        assert sim.report()["call_api"]["statuses"] == {"success": 5}
+
+
+def test_same_content_uploaded_again_is_deleted(template):
+    with Simulator(template, concurrency=4) as sim:
+        sim.put_object("processed/object-1.txt", b"data")
+        assert sim.run_until_idle(timeout=60)
+        sim.put_object("processed/object-1.txt", b"data")
+        assert sim.run_until_idle(timeout=60)
+
+        s3 = boto3.client("s3")
+        inbound = s3.list_objects_v2(Bucket=sim.bucket("Inbound"))
+        assert "Contents" not in inbound
+
+        calls = sim.calls()
+        # only the first upload was copied
+        assert calls["s3.CopyObject"] == 1
+        assert calls["s3.DeleteObject"] == 2
+
+
+def test_rejected_object_uploaded_again_is_kept(template):
+    with Simulator(template, concurrency=4) as sim:
+        sim.put_object("processed/reject-1.dat", b"data")
+        assert sim.run_until_idle(timeout=60)
+        sim.put_object("processed/reject-1.dat", b"data")
+        assert sim.run_until_idle(timeout=60)
+
+        s3 = boto3.client("s3")
+        inbound = s3.list_objects_v2(Bucket=sim.bucket("Inbound"))
+        assert [o["Key"] for o in inbound["Contents"]] == ["processed/reject-1.dat"]
+        assert "s3.DeleteObject" not in sim.calls()
@@ -1,8 +1,11 @@
+import json
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
 
 from uploader.uploader_stack import UploaderStack
 
+
 # example tests. To run these tests, uncomment this file along with the example
 # resource in uploader/uploader_stack.py
 def test_sqs_queue_created():
@@ -14,3 +17,141 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def test_retry_queue_drained_on_schedule_by_default():
+    app = core.App()
+    stack = UploaderStack(app, "uploader")
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::Lambda::EventSourceMapping", 0)
+    template.has_resource_properties(
+        "AWS::Events::Rule", {"ScheduleExpression": "rate(1 minute)"}
+    )
+
+
+def test_retry_queue_event_source_mode():
+    app = core.App(
+        context={
+            "RetryMode": "event_source",
+            "RetryBatchSize": "50",
+            "RetryBatchingWindowSeconds": "5",
+        }
+    )
+    stack = UploaderStack(app, "uploader")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BatchSize": 50,
+            "MaximumBatchingWindowInSeconds": 5,
+            "FunctionResponseTypes": ["ReportBatchItemFailures"],
+        },
+    )
+    rules = template.find_resources(
+        "AWS::Events::Rule", {"Properties": {"ScheduleExpression": "rate(1 minute)"}}
+    )
+    assert not rules
+
+
+def test_handlers_share_runtime_layer():
+    app = core.App()
+    stack = UploaderStack(app, "uploader")
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::Lambda::LayerVersion", 1)
+    functions = template.find_resources(
+        "AWS::Lambda::Function",
+        {"Properties": {"Layers": assertions.Match.any_value()}},
+    )
+    handlers = {function["Properties"]["Handler"] for function in functions.values()}
+    assert "call_api.lambda_handler" in handlers
+    assert "handle_retries.lambda_handler" in handlers
+
+
+def test_coalescing_window():
+    app = core.App(context={"CoalesceWindowSeconds": "30"})
+    stack = UploaderStack(app, "uploader")
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::DynamoDB::Table", 1)
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "Handler": "new_object_received.lambda_handler",
+            "Environment": {
+                "Variables": assertions.Match.object_like(
+                    {"COALESCE_WINDOW_SECONDS": "30"}
+                )
+            },
+        },
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {"FunctionResponseTypes": ["ReportBatchItemFailures"]},
+    )
+
+
+def test_delete_message_batch_mode():
+    app = core.App(context={"DeleteMessageMode": "batch", "DeleteBatchSize": "50"})
+    stack = UploaderStack(app, "uploader")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BatchSize": 50,
+            "MaximumBatchingWindowInSeconds": 5,
+            "FunctionResponseTypes": ["ReportBatchItemFailures"],
+        },
+    )
+    (rule,) = [
+        rule
+        for logical_id, rule in template.find_resources("AWS::Events::Rule").items()
+        if logical_id.startswith("ApiSucceededMessageRule")
+    ]
+    (target,) = rule["Properties"]["Targets"]
+    assert target["Arn"]["Fn::GetAtt"][0].startswith("DeleteMessageQueue")
+
+
+def test_delete_object_batch_mode():
+    app = core.App(context={"DeleteObjectMode": "batch"})
+    stack = UploaderStack(app, "uploader")
+    template = assertions.Template.from_stack(stack)
+
+    (rule,) = [
+        rule
+        for logical_id, rule in template.find_resources("AWS::Events::Rule").items()
+        if logical_id.startswith("ApiSucceededObjectRule")
+    ]
+    (target,) = rule["Properties"]["Targets"]
+    assert target["Arn"]["Fn::GetAtt"][0].startswith("DeleteObjectQueue")
+    (role,) = [
+        role
+        for logical_id, role in template.find_resources("AWS::IAM::Role").items()
+        if logical_id.startswith("DeleteObjectRole")
+    ]
+    (policy,) = role["Properties"]["Policies"]
+    (statement,) = policy["PolicyDocument"]["Statement"]
+    assert statement["Action"] == ["s3:DeleteObject", "s3:DeleteObjectVersion"]
+
+
+def test_call_api_uses_test_api():
+    app = core.App(context={"ApiUrl": "test", "ApiReadTimeoutSeconds": "5"})
+    stack = UploaderStack(app, "uploader")
+    template = assertions.Template.from_stack(stack)
+
+    (function,) = [
+        function
+        for logical_id, function in template.find_resources(
+            "AWS::Lambda::Function"
+        ).items()
+        if logical_id.startswith("CallApi")
+    ]
+    environment = function["Properties"]["Environment"]["Variables"]
+    assert "RestApi" in json.dumps(environment["API_URL"])
+    assert environment["API_READ_TIMEOUT_SECONDS"] == "5"
+    template.has_resource_properties(
+        "AWS::ApiGateway::RestApi", {"MinimumCompressionSize": 1024}
+    )
@@ -0,0 +1,124 @@
+"""
+Rank the AWS operations that take the most time across many invocations.
+
+Reads handler logs written with PROFILE_AWS_CALLS enabled, e.g. exported
+from CloudWatch Logs or captured from the local simulator, and aggregates
+the per-invocation AWS_CALLS lines.
+
+    aws logs tail /aws/lambda/UploaderStack-CallApi... --since 1h > call_api.log
+    python -m tools.aws_call_report call_api.log
+    python -m tools.aws_call_report --sort retries --top 5 < all.log
+"""
+
+import argparse
+import fileinput
+import json
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "lambda", "layer", "python")
+)
+
+from uploader_runtime.profiler import PREFIX  # noqa: E402
+
+COUNTERS = ["calls", "ms", "retries", "errors", "sent", "received"]
+
+
+def summaries(lines):
+    """Profile summaries found in ``lines``. Lines may carry a log prefix,
+    such as the timestamp and request id Lambda adds."""
+
+    marker = f"{PREFIX} "
+    for line in lines:
+        start = line.find(marker)
+        if start < 0:
+            continue
+        start += len(marker)
+        try:
+            yield json.loads(line[start:])
+        except ValueError:
+            continue
+
+
+def aggregate(profiles, stage=None):
+    """Totals per operation and per stage."""
+
+    operations = defaultdict(lambda: {**{name: 0 for name in COUNTERS}, "max_ms": 0})
+    stages = defaultdict(lambda: {"invocations": 0, "ms": 0.0, "aws_ms": 0.0})
+
+    for profile in profiles:
+        if stage and profile["stage"] != stage:
+            continue
+
+        totals = stages[profile["stage"]]
+        totals["invocations"] += 1
+        totals["ms"] += profile["ms"]
+
+        for name, stats in profile["operations"].items():
+            totals["aws_ms"] += stats["ms"]
+            operation = operations[name]
+            for counter in COUNTERS:
+                operation[counter] += stats.get(counter, 0)
+            operation["max_ms"] = max(operation["max_ms"], stats.get("max_ms", 0))
+
+    return operations, stages
+
+
+def report(operations, stages, sort="ms", top=20):
+
+    total_ms = sum(stats["ms"] for stats in operations.values()) or 1
+
+    lines = [
+        f"{'operation':<36}{'calls':>8}{'total ms':>11}{'mean ms':>9}{'max ms':>9}"
+        f"{'share':>7}{'retries':>8}{'errors':>7}{'sent':>11}{'received':>11}"
+    ]
+    ranked = sorted(operations.items(), key=lambda item: item[1][sort], reverse=True)
+    for name, stats in ranked[:top]:
+        lines.append(
+            f"{name:<36}{stats['calls']:>8}{stats['ms']:>11.0f}"
+            f"{stats['ms'] / stats['calls']:>9.1f}{stats['max_ms']:>9.0f}"
+            f"{stats['ms'] / total_ms:>7.0%}{stats['retries']:>8}{stats['errors']:>7}"
+            f"{stats['sent']:>11}{stats['received']:>11}"
+        )
+
+    lines.append("")
+    lines.append(
+        f"{'stage':<36}{'invocations':>12}{'mean ms':>9}{'AWS ms':>9}{'other ms':>10}"
+    )
+    for name, totals in sorted(stages.items()):
+        count = totals["invocations"]
+        # parallel calls can add up to more than the invocation
+        other = max(0.0, totals["ms"] - totals["aws_ms"])
+        lines.append(
+            f"{name:<36}{count:>12}{totals['ms'] / count:>9.1f}"
+            f"{totals['aws_ms'] / count:>9.1f}{other / count:>10.1f}"
+        )
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", help="log files, default stdin")
+    parser.add_argument("--stage", help="only invocations of this handler")
+    parser.add_argument("--sort", choices=COUNTERS + ["max_ms"], default="ms")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with fileinput.input(args.files) as lines:
+        operations, stages = aggregate(summaries(lines), args.stage)
+
+    if not stages:
+        print(f"no {PREFIX} lines found")
+        return 1
+
+    print(report(operations, stages, args.sort, args.top))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
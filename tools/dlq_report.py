@@ -0,0 +1,158 @@
+"""
+Report what is in the retry dead-letter queue.
+
+Objects land there after RetryMaxAttempts failed API calls. The messages are
+received without being deleted, so they stay in the queue, but they are
+invisible to other readers for ``--visibility`` seconds.
+
+    python -m tools.dlq_report --stack UploaderStack
+    python -m tools.dlq_report --queue-url https://sqs.../RetryDeadLetterQueue --json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import boto3
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "lambda", "layer", "python")
+)
+
+from uploader_runtime import retries  # noqa: E402
+
+OUTPUT_KEY = "RetryDeadLetterQueueUrl"
+
+
+def stack_queue_url(stack_name, cloudformation):
+
+    (stack,) = cloudformation.describe_stacks(StackName=stack_name)["Stacks"]
+    for output in stack.get("Outputs", []):
+        if output["OutputKey"] == OUTPUT_KEY:
+            return output["OutputValue"]
+
+    raise KeyError(f"{stack_name} has no {OUTPUT_KEY} output")
+
+
+def peek(sqs, queue_url, limit, visibility):
+    """Up to ``limit`` messages from the queue, left in it."""
+
+    messages = {}
+    while len(messages) < limit:
+        batch = sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(10, limit - len(messages)),
+            VisibilityTimeout=visibility,
+            AttributeNames=["SentTimestamp"],
+            WaitTimeSeconds=1,
+        ).get("Messages", [])
+        if not batch:
+            break
+        for message in batch:
+            messages[message["MessageId"]] = message
+
+    return list(messages.values())
+
+
+def entries(messages, now=None):
+    """One row per dead-lettered object."""
+
+    now = now or time.time()
+    rows = []
+    for message in messages:
+        try:
+            detail = retries.decode(message["Body"])
+        except (ValueError, KeyError):
+            detail = {"Key": f"<unreadable message {message['MessageId']}>"}
+
+        sent = int(message.get("Attributes", {}).get("SentTimestamp", 0)) / 1000
+        rows.append(
+            {
+                "bucket": detail.get("Bucket"),
+                "key": detail.get("Key"),
+                "size": detail.get("Size"),
+                "attempts": detail.get("attempt", 0),
+                "received": detail.get("received"),
+                "hours_in_queue": round((now - sent) / 3600, 1) if sent else None,
+            }
+        )
+
+    return rows
+
+
+def summary(rows):
+
+    ages = [row["hours_in_queue"] for row in rows if row["hours_in_queue"] is not None]
+
+    return {
+        "objects": len(rows),
+        "bytes": sum(row["size"] or 0 for row in rows),
+        "oldest_hours": max(ages, default=None),
+        "by_bucket": dict(Counter(row["bucket"] for row in rows).most_common()),
+        "by_prefix": dict(
+            Counter(
+                os.path.dirname(row["key"] or "") or "/" for row in rows
+            ).most_common(10)
+        ),
+        "by_attempts": dict(sorted(Counter(row["attempts"] for row in rows).items())),
+    }
+
+
+def report(rows, totals, top=20):
+
+    lines = [
+        f"{totals['objects']} objects, {totals['bytes']} bytes,"
+        f" oldest {totals['oldest_hours']} hours in the queue",
+        "",
+        "by bucket:   "
+        + ", ".join(f"{name} {count}" for name, count in totals["by_bucket"].items()),
+        "by prefix:   "
+        + ", ".join(f"{name} {count}" for name, count in totals["by_prefix"].items()),
+        "by attempts: "
+        + ", ".join(f"{name} {count}" for name, count in totals["by_attempts"].items()),
+        "",
+        f"{'hours':>7}{'attempts':>10}{'size':>12}  key",
+    ]
+    oldest = sorted(rows, key=lambda row: row["hours_in_queue"] or 0, reverse=True)
+    for row in oldest[:top]:
+        lines.append(
+            f"{row['hours_in_queue'] or 0:>7}{row['attempts']:>10}"
+            f"{row['size'] or '':>12}  {row['bucket']}/{row['key']}"
+        )
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--queue-url")
+    source.add_argument("--stack", help="read the queue URL from the stack outputs")
+    parser.add_argument("--limit", type=int, default=1000, help="messages to read")
+    parser.add_argument("--visibility", type=int, default=30)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    queue_url = args.queue_url or stack_queue_url(
+        args.stack, boto3.client("cloudformation")
+    )
+    rows = entries(peek(boto3.client("sqs"), queue_url, args.limit, args.visibility))
+    totals = summary(rows)
+
+    if args.json:
+        print(json.dumps({**totals, "entries": rows}, indent=2))
+    elif rows:
+        print(report(rows, totals, args.top))
+    else:
+        print("the dead-letter queue is empty")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
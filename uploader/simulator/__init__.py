@@ -0,0 +1,3 @@
+"""
+Local, in-process simulation of the deployed UploaderStack.
+"""
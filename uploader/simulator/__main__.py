@@ -0,0 +1,72 @@
+"""
+Push objects through a simulated UploaderStack and print per-stage timings.
+
+    python -m uploader.simulator --objects 1000
+    python -m uploader.simulator -c RetryMode=event_source
+    python -m uploader.simulator --template cdk.out/UploaderStack.template.json
+"""
+
+import argparse
+import sys
+import time
+
+from uploader.simulator.simulator import Simulator, format_report, quiet
+from uploader.simulator.template import load_template, synthesize
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m uploader.simulator")
+    parser.add_argument("--objects", type=int, default=100)
+    parser.add_argument("--size", type=int, default=1024, help="object size in bytes")
+    parser.add_argument("--prefix", default="processed/")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument(
+        "-c",
+        "--context",
+        action="append",
+        default=[],
+        metavar="Name=value",
+        help="CDK context, as with cdk synth -c",
+    )
+    parser.add_argument("--template", help="synthesized template to use")
+    parser.add_argument(
+        "--api", action="store_true", help="call test_api over HTTP from call_api"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the handlers' output"
+    )
+    args = parser.parse_args(argv)
+
+    if args.template:
+        template = load_template(args.template)
+    else:
+        context = dict(item.split("=", 1) for item in args.context)
+        template = synthesize(context)
+
+    body = b"x" * args.size
+
+    with Simulator(template, concurrency=args.concurrency, api=args.api) as sim:
+        start = time.perf_counter()
+        with quiet(not args.verbose):
+            for n in range(args.objects):
+                sim.put_object(f"{args.prefix}object-{n:06}.txt", body)
+            idle = sim.run_until_idle(timeout=args.timeout)
+        elapsed = time.perf_counter() - start
+
+        print(format_report(sim.report()))
+        print(
+            f"{args.objects} objects in {elapsed:.2f}s"
+            f" ({args.objects / elapsed:.0f} objects/s)"
+        )
+
+    if not idle:
+        print("timed out before the pipeline was idle")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+A local HTTP stand-in for the downstream API, serving the test_api handler.
+
+Requests are turned into API Gateway proxy events, so call_api's client can
+be pointed at it with ``API_URL``::
+
+    with ApiServer() as api:
+        print(api.url)
+
+``Simulator(template, api=True)`` runs one for its call_api.
+"""
+
+import base64
+import importlib
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+lambda_root = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "lambda",
+)
+
+
+def load_handler():
+
+    path = os.path.join(lambda_root, "test_api")
+    if path not in sys.path:
+        sys.path.append(path)
+
+    return importlib.import_module("test_api").lambda_handler
+
+
+def read_chunked(rfile):
+    """Chunks of a request body sent with Transfer-Encoding: chunked.
+
+    Raises ValueError if the body ends before its last chunk.
+    """
+
+    while True:
+        size = int(rfile.readline().split(b";")[0].strip(), 16)
+        if not size:
+            break
+        yield rfile.read(size)
+        rfile.readline()
+
+    # trailers, up to a blank line
+    while rfile.readline().strip():
+        pass
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    # keep connections open between requests, as API Gateway does
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self.proxy("GET")
+
+    def do_POST(self):
+        self.proxy("POST")
+
+    def proxy(self, method):
+
+        url = urlsplit(self.path)
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            try:
+                body = b"".join(read_chunked(self.rfile))
+            except ValueError:
+                # the client gave up on the request part way through
+                self.close_connection = True
+                return
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        event = {
+            "httpMethod": method,
+            "path": url.path,
+            "headers": dict(self.headers),
+            "queryStringParameters": dict(parse_qsl(url.query)) or None,
+            "body": base64.b64encode(body).decode(),
+            "isBase64Encoded": True,
+        }
+
+        with self.server.lock:
+            self.server.requests += 1
+
+        response = self.server.handler(event, None)
+        payload = response.get("body", "").encode()
+
+        self.send_response(response["statusCode"])
+        for name, value in response.get("headers", {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ApiServer:
+    """test_api on ``http://127.0.0.1:<port>/submit``, in a thread.
+
+    :param int port: port to listen on, any free one by default
+    :param handler: Lambda handler for the requests, test_api's by default
+    """
+
+    def __init__(self, port=0, handler=None):
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), RequestHandler)
+        self.server.daemon_threads = True
+        self.server.handler = handler or load_handler()
+        self.server.lock = threading.Lock()
+        self.server.connections = 0
+        self.server.requests = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/submit"
+
+    @property
+    def connections(self):
+        return self.server.connections
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -0,0 +1,581 @@
+"""
+Runs the uploader's handlers in process, routed by the EventBridge rules of a
+synthesized UploaderStack.
+
+PutEvents calls from the handlers are matched against the rules' event
+patterns and the targets are invoked on a thread pool, or sent to them when
+they are queues. S3, SQS and DynamoDB are moto's in-memory stand-ins, created
+from the template. SQS event source mappings are polled, and scheduled rules
+run when ``run_schedules()`` is called.
+"""
+
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import botocore.exceptions
+from moto import mock_aws
+
+from uploader.simulator.api_server import ApiServer
+from uploader.simulator.template import ACCOUNT, REGION, StackModel
+
+lambda_root = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "lambda",
+)
+layer_root = os.path.join(lambda_root, "layer", "python")
+if layer_root not in sys.path:
+    sys.path.append(layer_root)
+
+from uploader_runtime import clients  # noqa: E402
+from uploader_runtime.patterns import compile_pattern  # noqa: E402
+
+# attributes of AWS::SQS::Queue that map onto CreateQueue attributes
+QUEUE_ATTRIBUTES = [
+    "DelaySeconds",
+    "MessageRetentionPeriod",
+    "ReceiveMessageWaitTimeSeconds",
+    "VisibilityTimeout",
+]
+
+
+def percentile(values, fraction):
+
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class SimContext:
+    """The parts of the Lambda context object the handlers use."""
+
+    def __init__(self, function):
+
+        self.function_name = function.logical_id
+        self.invoked_function_arn = function.arn
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.monotonic() + function.timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+class EventRouter:
+    """Stands in for the EventBridge client. Each entry is delivered to the
+    targets of every rule it matches."""
+
+    class exceptions:
+        ClientError = botocore.exceptions.ClientError
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def put_events(self, Entries):
+
+        results = []
+        for entry in Entries:
+            event = {
+                "version": "0",
+                "id": str(uuid.uuid4()),
+                "detail-type": entry["DetailType"],
+                "source": entry["Source"],
+                "account": ACCOUNT,
+                "time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "region": REGION,
+                "resources": entry.get("Resources", []),
+                "detail": json.loads(entry["Detail"]),
+            }
+            self.simulator.count_call("events", "PutEvents")
+            self.simulator.deliver(event)
+            results.append({"EventId": event["id"]})
+
+        return {"FailedEntryCount": 0, "Entries": results}
+
+
+class Stage:
+    """Invocation counts and timings for one function."""
+
+    def __init__(self):
+
+        self.durations = []
+        self.statuses = Counter()
+        self.errors = 0
+
+    def summary(self):
+
+        return {
+            "invocations": len(self.durations),
+            "errors": self.errors,
+            "p50_ms": round(percentile(self.durations, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(self.durations, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(self.durations, 0.99) * 1000, 1),
+            "max_ms": round(max(self.durations, default=0) * 1000, 1),
+            "statuses": dict(self.statuses),
+        }
+
+
+class Simulator:
+    """An UploaderStack running in process.
+
+    Use as a context manager::
+
+        with Simulator(template) as sim:
+            sim.put_object("processed/a.txt", b"data")
+            sim.run_until_idle()
+            print(sim.report())
+
+    :param dict template: synthesized template, see ``template.synthesize``
+    :param int concurrency: invocations that can run at the same time
+    :param dict environment: extra environment for every handler
+    :param bool api: have call_api call test_api over HTTP, instead of
+        deciding by itself
+    """
+
+    def __init__(self, template, concurrency=8, environment=None, api=False):
+
+        self.template = template
+        self.concurrency = concurrency
+        self.environment = {
+            # handle_retries would otherwise long poll an empty queue
+            "RECEIVE_WAIT_SECONDS": "0",
+            # retry failed objects without waiting. received retry messages
+            # still stay in flight for the queue's visibility timeout.
+            "RETRY_BACKOFF_BASE_SECONDS": "0",
+            **(environment or {}),
+        }
+
+        self.model = None
+        self.functions = {}
+        self.rules = []
+        self.schedules = []
+        self.mappings = []
+        self.handlers = {}
+        self.stages = defaultdict(Stage)
+        self.api_calls = Counter()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.idle = threading.Condition(self.lock)
+        self.mock = None
+        self.executor = None
+        self.saved_environ = None
+        self.api_server = ApiServer() if api else None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+
+        self.saved_environ = os.environ.copy()
+        os.environ.update(
+            {
+                "AWS_DEFAULT_REGION": REGION,
+                "AWS_ACCESS_KEY_ID": "testing",
+                "AWS_SECRET_ACCESS_KEY": "testing",
+            }
+        )
+
+        self.mock = mock_aws()
+        self.mock.start()
+        clients.reset()
+
+        # count the handlers' AWS calls. the simulator's own calls go
+        # through a separate session.
+        boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register("before-call", self.on_call)
+        self.session = boto3.session.Session()
+        self.s3 = self.session.client("s3")
+        self.sqs = self.session.client("sqs")
+
+        self.model = StackModel(self.template)
+        self.create_resources()
+
+        self.functions = self.model.functions()
+        self.rules = [
+            (rule, compile_pattern(rule.pattern))
+            for rule in self.model.rules()
+            if rule.pattern
+        ]
+        self.schedules = [rule for rule in self.model.rules() if rule.schedule]
+        self.mappings = self.model.event_source_mappings()
+        if self.api_server:
+            self.api_server.start()
+            self.environment["API_URL"] = self.api_server.url
+        self.configure_environment()
+
+        clients.install("events", EventRouter(self))
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def stop(self):
+
+        self.executor.shutdown(wait=True)
+        if self.api_server:
+            self.api_server.stop()
+        clients.reset()
+        boto3.DEFAULT_SESSION = None
+        self.mock.stop()
+        os.environ.clear()
+        os.environ.update(self.saved_environ)
+
+    def create_resources(self):
+
+        for logical_id in self.model.of_type("AWS::S3::Bucket"):
+            self.s3.create_bucket(Bucket=self.model.name(logical_id))
+
+        queues = self.model.of_type("AWS::SQS::Queue")
+        for logical_id, resource in queues.items():
+            properties = resource.get("Properties", {})
+            attributes = {
+                name: str(properties[name])
+                for name in QUEUE_ATTRIBUTES
+                if name in properties
+            }
+            response = self.sqs.create_queue(
+                QueueName=self.model.name(logical_id), Attributes=attributes
+            )
+            self.model.queue_urls[logical_id] = response["QueueUrl"]
+
+        # dead letter queues have to exist first
+        for logical_id, resource in queues.items():
+            redrive_policy = resource.get("Properties", {}).get("RedrivePolicy")
+            if redrive_policy:
+                self.sqs.set_queue_attributes(
+                    QueueUrl=self.model.queue_urls[logical_id],
+                    Attributes={
+                        "RedrivePolicy": json.dumps(self.model.resolve(redrive_policy))
+                    },
+                )
+
+        dynamodb = self.session.client("dynamodb")
+        for logical_id, resource in self.model.of_type("AWS::DynamoDB::Table").items():
+            properties = resource["Properties"]
+            dynamodb.create_table(
+                TableName=self.model.name(logical_id),
+                KeySchema=properties["KeySchema"],
+                AttributeDefinitions=properties["AttributeDefinitions"],
+                BillingMode=properties.get("BillingMode", "PAY_PER_REQUEST"),
+            )
+
+    def configure_environment(self):
+        """Handlers share one process, so their environments are merged."""
+
+        merged = {}
+        for function in self.functions.values():
+            for name, value in function.environment.items():
+                if merged.get(name, value) != value:
+                    raise ValueError(
+                        f"{function.logical_id} sets {name} to {value},"
+                        f" another function sets it to {merged[name]}"
+                    )
+                merged[name] = value
+
+        os.environ.update({name: str(value) for name, value in merged.items()})
+        os.environ.update(self.environment)
+
+    def on_call(self, model, **kwargs):
+        self.count_call(model.service_model.service_name, model.name)
+
+    def count_call(self, service_name, operation_name):
+
+        with self.lock:
+            self.api_calls[f"{service_name}.{operation_name}"] += 1
+
+    def handler(self, function):
+        """The lambda_handler of ``function``, imported on first use like
+        a cold start."""
+
+        with self.lock:
+            if function.module not in self.handlers:
+                path = os.path.join(lambda_root, function.module)
+                if path not in sys.path:
+                    sys.path.append(path)
+                # handlers read their settings at import time, so drop
+                # anything imported before the environment was set up
+                for name in os.listdir(path):
+                    sys.modules.pop(os.path.splitext(name)[0], None)
+                module = importlib.import_module(function.module)
+                self.handlers[function.module] = module.lambda_handler
+
+        return self.handlers[function.module]
+
+    def invoke(self, logical_id, event):
+        """Run a function and record how long it took."""
+
+        function = self.functions[logical_id]
+        stage = self.stages[function.module]
+        handler = self.handler(function)
+
+        start = time.perf_counter()
+        try:
+            result = handler(event, SimContext(function))
+        except Exception:
+            with self.lock:
+                stage.errors += 1
+                stage.durations.append(time.perf_counter() - start)
+            traceback.print_exc()
+            raise
+
+        with self.lock:
+            stage.durations.append(time.perf_counter() - start)
+            if isinstance(result, dict) and "status" in result:
+                stage.statuses[result["status"]] += 1
+
+        return result
+
+    def submit(self, logical_id, event):
+        """Invoke a function asynchronously, as EventBridge does."""
+
+        with self.lock:
+            self.running += 1
+
+        def run():
+            try:
+                self.invoke(logical_id, event)
+            except Exception:
+                # already counted. EventBridge would retry, the simulator
+                # doesn't.
+                pass
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.idle.notify_all()
+
+        self.executor.submit(run)
+
+    def deliver(self, event):
+        """Send ``event`` to the targets of every rule it matches."""
+
+        for rule, predicate in self.rules:
+            if predicate(event):
+                for target in rule.targets:
+                    if target in self.functions:
+                        self.submit(target, event)
+                    elif target in self.model.queue_urls:
+                        self.sqs.send_message(
+                            QueueUrl=self.model.queue_urls[target],
+                            MessageBody=json.dumps(event),
+                        )
+
+    def bucket(self, name):
+        """Local name of the bucket with logical id starting with ``name``,
+        e.g. "Inbound"."""
+
+        for logical_id in self.model.of_type("AWS::S3::Bucket"):
+            if logical_id.startswith(name):
+                return self.model.name(logical_id)
+
+        raise KeyError(name)
+
+    def put_object(self, key, body=b"", bucket="Inbound", age_seconds=0):
+        """Write an object and send the "Object Created" event for it.
+
+        ``age_seconds`` backdates the event, e.g. to let a "fail" object
+        through call_api.
+        """
+
+        bucket_name = self.bucket(bucket)
+        response = self.s3.put_object(Bucket=bucket_name, Key=key, Body=body)
+
+        event_time = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+        self.deliver(
+            {
+                "version": "0",
+                "id": str(uuid.uuid4()),
+                "detail-type": "Object Created",
+                "source": "aws.s3",
+                "account": ACCOUNT,
+                "time": event_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "region": REGION,
+                "resources": [f"arn:aws:s3:::{bucket_name}"],
+                "detail": {
+                    "version": "0",
+                    "bucket": {"name": bucket_name},
+                    "object": {
+                        "key": key,
+                        "size": len(body),
+                        "etag": response["ETag"].strip('"'),
+                        "sequencer": f"{time.time_ns():X}",
+                    },
+                    "request-id": str(uuid.uuid4()),
+                    "requester": ACCOUNT,
+                    "reason": "PutObject",
+                },
+            }
+        )
+
+    def poll_event_sources(self):
+        """Deliver one batch from each event source mapping.
+
+        :returns: number of messages delivered
+        """
+
+        delivered = 0
+
+        for mapping in self.mappings:
+            queue_url = self.model.queue_urls[mapping.queue]
+            messages = self.sqs.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=min(mapping.batch_size, 10),
+                AttributeNames=["All"],
+            ).get("Messages", [])
+            if not messages:
+                continue
+
+            delivered += len(messages)
+            records = [
+                {
+                    "messageId": message["MessageId"],
+                    "receiptHandle": message["ReceiptHandle"],
+                    "body": message["Body"],
+                    "attributes": message.get("Attributes", {}),
+                    "messageAttributes": {},
+                    "md5OfBody": message["MD5OfBody"],
+                    "eventSource": "aws:sqs",
+                    "eventSourceARN": self.model.arn(mapping.queue),
+                    "awsRegion": REGION,
+                }
+                for message in messages
+            ]
+
+            try:
+                result = self.invoke(mapping.function, {"Records": records})
+            except Exception:
+                # the whole batch becomes visible again
+                continue
+
+            failed = set()
+            if mapping.report_batch_item_failures and isinstance(result, dict):
+                failed = {
+                    failure["itemIdentifier"]
+                    for failure in result.get("batchItemFailures", [])
+                }
+            for message in messages:
+                if message["MessageId"] not in failed:
+                    self.sqs.delete_message(
+                        QueueUrl=queue_url, ReceiptHandle=message["ReceiptHandle"]
+                    )
+
+        return delivered
+
+    def pending_messages(self):
+        """Messages waiting in event source queues, including delayed ones."""
+
+        pending = 0
+        for mapping in self.mappings:
+            attributes = self.sqs.get_queue_attributes(
+                QueueUrl=self.model.queue_urls[mapping.queue],
+                AttributeNames=[
+                    "ApproximateNumberOfMessages",
+                    "ApproximateNumberOfMessagesDelayed",
+                ],
+            )["Attributes"]
+            pending += sum(int(value) for value in attributes.values())
+
+        return pending
+
+    def run_schedules(self):
+        """Run the targets of the scheduled rules once."""
+
+        for rule in self.schedules:
+            for target in rule.targets:
+                if target in self.functions:
+                    self.submit(
+                        target,
+                        {
+                            "version": "0",
+                            "id": str(uuid.uuid4()),
+                            "detail-type": "Scheduled Event",
+                            "source": "aws.events",
+                            "account": ACCOUNT,
+                            "time": datetime.now(timezone.utc).strftime(
+                                "%Y-%m-%dT%H:%M:%SZ"
+                            ),
+                            "region": REGION,
+                            "resources": [self.model.arn(rule.logical_id)],
+                            "detail": {},
+                        },
+                    )
+
+    def run_until_idle(self, timeout=60, poll_interval=0.05):
+        """Wait until no function is running and the event source queues are
+        empty. Messages in flight are not waited for.
+
+        :returns: False if ``timeout`` seconds passed first
+        """
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                self.idle.wait_for(
+                    lambda: self.running == 0,
+                    timeout=max(0, deadline - time.monotonic()),
+                )
+            if self.poll_event_sources():
+                continue
+            with self.lock:
+                if self.running:
+                    continue
+            if not self.pending_messages():
+                return True
+            time.sleep(poll_interval)
+
+        return False
+
+    def report(self):
+        """Per-stage invocation counts and timings."""
+
+        with self.lock:
+            return {name: stage.summary() for name, stage in self.stages.items()}
+
+    def calls(self):
+        """AWS calls made by the handlers, by ``service.Operation``."""
+
+        with self.lock:
+            return dict(self.api_calls)
+
+
+def format_report(report):
+
+    lines = [
+        f"{'stage':<22}{'calls':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}"
+        f"{'p99 ms':>9}{'max ms':>9}  statuses"
+    ]
+    for name, stage in sorted(report.items()):
+        statuses = ", ".join(f"{k}={v}" for k, v in sorted(stage["statuses"].items()))
+        lines.append(
+            f"{name:<22}{stage['invocations']:>7}{stage['errors']:>8}"
+            f"{stage['p50_ms']:>9}{stage['p95_ms']:>9}{stage['p99_ms']:>9}"
+            f"{stage['max_ms']:>9}"
+            f"  {statuses}"
+        )
+
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Hide the handlers' output."""
+
+    if not enabled:
+        yield
+        return
+
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        yield
@@ -0,0 +1,218 @@
+"""
+Reads the resources the simulator needs out of a synthesized UploaderStack
+template: the Lambda handlers, the EventBridge rules that route between them,
+and the buckets, queues and tables they use.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+
+ACCOUNT = "123456789012"
+REGION = "us-east-1"
+
+project_root = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+
+@dataclass
+class Function:
+    logical_id: str
+    module: str
+    arn: str
+    environment: dict
+    timeout: int
+
+
+@dataclass
+class Rule:
+    logical_id: str
+    pattern: dict = None
+    schedule: str = None
+    # logical ids of the target functions and queues
+    targets: list = field(default_factory=list)
+
+
+@dataclass
+class EventSourceMapping:
+    queue: str
+    function: str
+    batch_size: int
+    report_batch_item_failures: bool
+
+
+class StackModel:
+    """The parts of a CloudFormation template that the simulator runs.
+
+    References between resources (``Ref`` and ``Fn::GetAtt``) are resolved
+    to local names: buckets and tables are named after their logical ids,
+    functions get a fake ARN and queues get the URL of the local queue,
+    which has to be supplied by ``queue_urls``.
+    """
+
+    def __init__(self, template, queue_urls=None):
+
+        self.resources = template["Resources"]
+        self.queue_urls = queue_urls or {}
+
+    def of_type(self, resource_type):
+
+        return {
+            logical_id: resource
+            for logical_id, resource in self.resources.items()
+            if resource["Type"] == resource_type
+        }
+
+    def name(self, logical_id):
+        return logical_id.lower()
+
+    def arn(self, logical_id):
+
+        resource_type = self.resources[logical_id]["Type"]
+        if resource_type == "AWS::S3::Bucket":
+            return f"arn:aws:s3:::{self.name(logical_id)}"
+        if resource_type == "AWS::Lambda::Function":
+            return f"arn:aws:lambda:{REGION}:{ACCOUNT}:function:{logical_id}"
+        if resource_type == "AWS::SQS::Queue":
+            return f"arn:aws:sqs:{REGION}:{ACCOUNT}:{self.name(logical_id)}"
+        if resource_type == "AWS::DynamoDB::Table":
+            return f"arn:aws:dynamodb:{REGION}:{ACCOUNT}:table/{self.name(logical_id)}"
+
+        return f"arn:aws:local:{REGION}:{ACCOUNT}:{logical_id}"
+
+    def ref(self, logical_id):
+
+        if self.resources[logical_id]["Type"] == "AWS::SQS::Queue":
+            return self.queue_urls.get(logical_id, self.name(logical_id))
+        if self.resources[logical_id]["Type"] == "AWS::Lambda::Function":
+            return logical_id
+
+        return self.name(logical_id)
+
+    def resolve(self, value):
+        """Replace ``Ref`` and ``Fn::GetAtt`` with local values."""
+
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        if set(value) == {"Ref"} and value["Ref"] in self.resources:
+            return self.ref(value["Ref"])
+        if set(value) == {"Fn::GetAtt"}:
+            logical_id, attribute = value["Fn::GetAtt"]
+            if attribute == "Arn":
+                return self.arn(logical_id)
+            if attribute == "QueueName":
+                return self.name(logical_id)
+            return self.ref(logical_id)
+
+        return {key: self.resolve(item) for key, item in value.items()}
+
+    def target_id(self, arn):
+        """Logical id of the resource with ``arn``."""
+
+        arn = self.resolve(arn)
+        for logical_id in self.resources:
+            if self.arn(logical_id) == arn:
+                return logical_id
+
+        return None
+
+    def functions(self):
+        """Handlers that live under lambda/, by logical id."""
+
+        functions = {}
+        for logical_id, resource in self.of_type("AWS::Lambda::Function").items():
+            properties = resource["Properties"]
+            module, _, handler = properties.get("Handler", "").partition(".")
+            if handler != "lambda_handler":
+                # CDK's own custom resource handlers
+                continue
+            variables = properties.get("Environment", {}).get("Variables", {})
+            functions[logical_id] = Function(
+                logical_id=logical_id,
+                module=module,
+                arn=self.arn(logical_id),
+                environment=self.resolve(variables),
+                timeout=properties.get("Timeout", 3),
+            )
+
+        return functions
+
+    def rules(self):
+
+        rules = []
+        for logical_id, resource in self.of_type("AWS::Events::Rule").items():
+            properties = resource["Properties"]
+            if properties.get("State", "ENABLED") != "ENABLED":
+                continue
+            rules.append(
+                Rule(
+                    logical_id=logical_id,
+                    pattern=self.resolve(properties.get("EventPattern")),
+                    schedule=properties.get("ScheduleExpression"),
+                    targets=[
+                        self.target_id(target["Arn"])
+                        for target in properties.get("Targets", [])
+                    ],
+                )
+            )
+
+        return rules
+
+    def event_source_mappings(self):
+
+        mappings = []
+        for resource in self.of_type("AWS::Lambda::EventSourceMapping").values():
+            properties = resource["Properties"]
+            mappings.append(
+                EventSourceMapping(
+                    queue=self.target_id(properties["EventSourceArn"]),
+                    function=properties["FunctionName"]["Ref"],
+                    batch_size=properties.get("BatchSize", 10),
+                    report_batch_item_failures="ReportBatchItemFailures"
+                    in properties.get("FunctionResponseTypes", []),
+                )
+            )
+
+        return mappings
+
+
+def load_template(path):
+    """Load a template written by ``cdk synth``, e.g.
+    cdk.out/UploaderStack.template.json"""
+
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def project_context():
+    """The context settings in cdk.json."""
+
+    path = os.path.join(project_root, "cdk.json")
+    with open(path) as fp:
+        context = json.load(fp).get("context", {})
+
+    # lookups need an AWS account, and encryption makes no difference locally
+    context.pop("KmsKeyAlias", None)
+
+    return context
+
+
+def synthesize(context=None, stack_name="UploaderStack"):
+    """Synthesize UploaderStack in process and return its template.
+
+    ``context`` overrides the settings in cdk.json, like ``cdk synth -c``.
+    Like cdk synth, this has to run from the project directory.
+    """
+
+    import aws_cdk as cdk
+
+    from uploader.uploader_stack import UploaderStack
+
+    app = cdk.App(context={**project_context(), **(context or {})})
+    UploaderStack(app, stack_name)
+
+    return app.synth().get_stack_by_name(stack_name).template
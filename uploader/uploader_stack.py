@@ -1,6 +1,8 @@
 import os
+import json
 from aws_cdk import (
     Duration,
+    Size,
     Stack,
     Tags,
     CfnOutput,
@@ -10,9 +12,11 @@ from aws_cdk import (
     aws_sqs as sqs,
     aws_s3 as s3,
     aws_kms as kms,
+    aws_dynamodb as dynamodb,
     aws_lambda as _lambda,
     aws_events as events,
     aws_events_targets as targets,
+    aws_lambda_event_sources as event_sources,
     aws_apigateway as apigw,
 )
 
@@ -57,6 +61,30 @@ class UploaderStack(Stack):
         if debug_param_value and debug_param_value.lower() == "true":
             debug_env["DEBUG"] = "true"
 
+        # defer imports that only some invocations need (uploader_runtime.lazy)
+        runtime_env = {}
+        lazy_param_value = self.node.try_get_context("LazyImports")
+        if lazy_param_value and lazy_param_value.lower() == "true":
+            runtime_env["LAZY_IMPORTS"] = "true"
+
+        # CloudWatch namespace for the metrics the handlers log (EMF)
+        metrics_namespace = self.node.try_get_context("MetricsNamespace")
+        if metrics_namespace:
+            runtime_env["METRICS_NAMESPACE"] = metrics_namespace
+
+        # log a profile of each invocation's AWS calls (uploader_runtime.profiler)
+        profile_param_value = self.node.try_get_context("ProfileAwsCalls")
+        if profile_param_value and profile_param_value.lower() == "true":
+            runtime_env["PROFILE_AWS_CALLS"] = "true"
+
+        # structured logging (uploader_runtime.log)
+        log_level = self.node.try_get_context("LogLevel")
+        if log_level:
+            runtime_env["LOG_LEVEL"] = log_level
+        log_sample_rate = self.node.try_get_context("LogSampleRate")
+        if log_sample_rate:
+            runtime_env["LOG_SAMPLE_RATE"] = str(log_sample_rate)
+
         # if a KMS key name is provided, enable bucket encryption
         kms_key_alias = self.node.try_get_context("KmsKeyAlias")
         if kms_key_alias:
@@ -83,6 +111,12 @@ class UploaderStack(Stack):
             "Outbound",
             auto_delete_objects=True,
             removal_policy=RemovalPolicy.DESTROY,
+            # backstop for multipart copies that call_api never finished
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    abort_incomplete_multipart_upload_after=Duration.days(1)
+                )
+            ],
             **kms_params
         )
 
@@ -98,6 +132,68 @@ class UploaderStack(Stack):
 
         managed_policies = [basic_lambda_policy]
 
+        # keep build output out of the assets (and out of the asset hashes)
+        asset_exclude = ["__pycache__", "*.pyc"]
+
+        # code shared by the handlers: client cache, logging, event building
+        # and batching. the per-function assets only hold the handler.
+        runtime_layer = _lambda.LayerVersion(
+            self,
+            "RuntimeLayer",
+            code=_lambda.Code.from_asset(
+                os.path.join(lambda_root, "layer"), exclude=asset_exclude
+            ),
+            compatible_runtimes=[runtime],
+        )
+
+        def handler_function(construct_id, name, role, environment=None):
+            """Function for the handler in lambda/<name>/<name>.py"""
+
+            return _lambda.Function(
+                self,
+                construct_id,
+                runtime=runtime,
+                code=_lambda.Code.from_asset(
+                    os.path.join(lambda_root, name), exclude=asset_exclude
+                ),
+                handler=f"{name}.lambda_handler",
+                layers=[runtime_layer],
+                environment={**debug_env, **runtime_env, **(environment or {})},
+                timeout=Duration.seconds(60),
+                role=role,
+                log_retention=log_retention,
+            )
+
+        def buffered_target(queue_id, function, mode_context, batch_size, window):
+            """Rule target for ``function``. In "single" mode (the default)
+            the rule invokes it for every event. In "batch" mode the events
+            are buffered in a queue, and an SQS event source mapping hands
+            them to the function ``batch_size`` at a time, waiting up to
+            ``window`` seconds to fill a batch."""
+
+            mode = self.node.try_get_context(mode_context) or "single"
+            if mode == "single":
+                return targets.LambdaFunction(function)
+            if mode != "batch":
+                raise ValueError(f"unknown {mode_context} {mode}")
+
+            queue = sqs.Queue(
+                self,
+                queue_id,
+                retention_period=Duration.days(1),
+                visibility_timeout=Duration.seconds(60),
+            )
+            function.add_event_source(
+                event_sources.SqsEventSource(
+                    queue,
+                    batch_size=batch_size,
+                    max_batching_window=Duration.seconds(window),
+                    report_batch_item_failures=True,
+                )
+            )
+
+            return targets.SqsQueue(queue)
+
         allow_read_inbound_bucket_read = iam.PolicyStatement(
             actions=["s3:GetObject", "s3:GetObjectTagging"],
             effect=iam.Effect.ALLOW,
@@ -127,26 +223,106 @@ class UploaderStack(Stack):
             },
         )
 
-        new_object_received_lambda = _lambda.Function(
-            self,
+        # with a coalescing window, new objects wait in a delay queue and
+        # only the newest version of each key is sent on to the API
+        coalesce_window = int(self.node.try_get_context("CoalesceWindowSeconds") or 0)
+        if not 0 <= coalesce_window <= 900:
+            # SQS DelaySeconds limit
+            raise ValueError("CoalesceWindowSeconds must be between 0 and 900")
+
+        coalesce_env = {}
+        if coalesce_window:
+            latest_version_table = dynamodb.Table(
+                self,
+                "LatestVersionTable",
+                partition_key=dynamodb.Attribute(
+                    name="ObjectId", type=dynamodb.AttributeType.STRING
+                ),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                time_to_live_attribute="ExpiresAt",
+                removal_policy=RemovalPolicy.DESTROY,
+            )
+            coalesce_queue = sqs.Queue(
+                self,
+                "CoalesceQueue",
+                retention_period=Duration.days(1),
+                visibility_timeout=Duration.seconds(60),
+            )
+            coalesce_env = {
+                "COALESCE_QUEUE_URL": coalesce_queue.queue_url,
+                "COALESCE_WINDOW_SECONDS": str(coalesce_window),
+                "LATEST_VERSION_TABLE": latest_version_table.table_name,
+            }
+
+        # event patterns can't filter on the end of a key, so suffixes are
+        # checked by new_object_received before it does any work
+        filter_env = {}
+        key_suffixes = self.node.try_get_context("KeySuffixes")
+        if key_suffixes:
+            filter_pattern = {
+                "detail": {
+                    "object": {
+                        "key": [
+                            {"suffix": suffix.strip()}
+                            for suffix in key_suffixes.split(",")
+                        ]
+                    }
+                }
+            }
+            filter_env["FILTER_PATTERN"] = json.dumps(filter_pattern)
+
+        new_object_received_lambda = handler_function(
             "NewObjectReceived",
-            runtime=runtime,
-            code=_lambda.Code.from_asset(
-                os.path.join(lambda_root, "new_object_received")
-            ),
-            handler="new_object_received.lambda_handler",
-            environment={**debug_env},
-            timeout=Duration.seconds(60),
-            role=service_role,
-            log_retention=log_retention,
+            "new_object_received",
+            service_role,
+            environment={**coalesce_env, **filter_env},
         )
 
+        ready_for_api_sources = [new_object_received_lambda.function_arn]
+
+        if coalesce_window:
+            latest_version_table.grant_write_data(new_object_received_lambda)
+            coalesce_queue.grant_send_messages(new_object_received_lambda)
+
+            service_role = iam.Role(
+                self,
+                "CoalesceRole",
+                assumed_by=lambda_principal,
+                managed_policies=managed_policies,
+                inline_policies={
+                    "inlineCoalesceRole": iam.PolicyDocument(
+                        assign_sids=True,
+                        statements=[
+                            iam.PolicyStatement(
+                                actions=["events:PutEvents"],
+                                effect=iam.Effect.ALLOW,
+                                resources=[event_bus.event_bus_arn],
+                            ),
+                        ],
+                    )
+                },
+            )
+
+            coalesce_lambda = handler_function(
+                "Coalesce",
+                "coalesce",
+                service_role,
+                environment={"LATEST_VERSION_TABLE": latest_version_table.table_name},
+            )
+            latest_version_table.grant_read_data(coalesce_lambda)
+            coalesce_lambda.add_event_source(
+                event_sources.SqsEventSource(
+                    coalesce_queue, batch_size=10, report_batch_item_failures=True
+                )
+            )
+            ready_for_api_sources.append(coalesce_lambda.function_arn)
+
         # rule for receiving events when PutObject happens
         # https://docs.aws.amazon.com/AmazonS3/latest/userguide/ev-events.html
         # https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-event-patterns-content-based-filtering.html
 
         prefix = "processed/"  # for testing
-        # there is no event pattern syntax for matching on suffix. would have to do this in code if necessary.
+        # there is no event pattern syntax for matching on suffix. see KeySuffixes.
 
         detail_type = "API Status"
 
@@ -204,7 +380,15 @@ class UploaderStack(Stack):
         )
 
         # add API gw
-        test_api = apigw.LambdaRestApi(self, "RestApi", handler=test_api_lambda)
+        test_api = apigw.LambdaRestApi(
+            self,
+            "RestApi",
+            handler=test_api_lambda,
+            # also has API Gateway decompress gzipped requests
+            min_compression_size=Size.kibibytes(1),
+            # object content sent by call_api, passed on base64 encoded
+            binary_media_types=["application/octet-stream"],
+        )
 
         items = test_api.root.add_resource("submit")
         items.add_method("POST", apigw.LambdaIntegration(test_api_lambda))
@@ -254,7 +438,13 @@ class UploaderStack(Stack):
                     statements=[
                         allow_read_inbound_bucket_read,
                         iam.PolicyStatement(
-                            actions=["s3:PutObject", "s3:PutObjectTagging"],
+                            actions=[
+                                "s3:PutObject",
+                                "s3:PutObjectTagging",
+                                "s3:AbortMultipartUpload",
+                                "s3:ListMultipartUploadParts",
+                                "s3:ListBucketMultipartUploads",
+                            ],
                             effect=iam.Effect.ALLOW,
                             resources=[
                                 outbound_bucket.bucket_arn,
@@ -271,26 +461,93 @@ class UploaderStack(Stack):
             },
         )
 
-        call_api_lambda = _lambda.Function(
-            self,
+        # sizes for the server-side copy. objects above the threshold are
+        # copied in parts, several at a time.
+        copy_env = {
+            "COPY_MULTIPART_THRESHOLD_MB": str(
+                self.node.try_get_context("CopyMultipartThresholdMB") or 128
+            ),
+            "COPY_PART_SIZE_MB": str(self.node.try_get_context("CopyPartSizeMB") or 64),
+            "COPY_MAX_CONCURRENCY": str(
+                self.node.try_get_context("CopyMaxConcurrency") or 8
+            ),
+        }
+
+        # record which objects call_api has handled, so duplicate
+        # ready_for_api events don't call the API or copy again
+        idempotency_env = {}
+        enable_idempotency = self.node.try_get_context("EnableIdempotency")
+        if enable_idempotency and enable_idempotency.lower() == "true":
+            idempotency_table = dynamodb.Table(
+                self,
+                "IdempotencyTable",
+                partition_key=dynamodb.Attribute(
+                    name="IdempotencyKey", type=dynamodb.AttributeType.STRING
+                ),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                time_to_live_attribute="ExpiresAt",
+                removal_policy=RemovalPolicy.DESTROY,
+            )
+            idempotency_env = {"IDEMPOTENCY_TABLE": idempotency_table.table_name}
+
+        # where call_api sends objects. "test" is the test API above. without
+        # it, call_api decides by filename and copies to the outbound bucket.
+        api_env = {}
+        api_url = self.node.try_get_context("ApiUrl")
+        if api_url:
+            if api_url == "test":
+                api_url = test_api.url_for_path(items.path)
+            api_env = {
+                "API_URL": api_url,
+                "API_CONNECT_TIMEOUT_SECONDS": str(
+                    self.node.try_get_context("ApiConnectTimeoutSeconds") or 3
+                ),
+                "API_READ_TIMEOUT_SECONDS": str(
+                    self.node.try_get_context("ApiReadTimeoutSeconds") or 20
+                ),
+            }
+            # stream the objects themselves, not just their details
+            send_content = self.node.try_get_context("ApiSendContent")
+            if send_content and send_content.lower() == "true":
+                api_env["API_SEND_CONTENT"] = "true"
+
+        call_api_lambda = handler_function(
             "CallApi",
-            runtime=runtime,
-            code=_lambda.Code.from_asset(os.path.join(lambda_root, "call_api")),
-            handler="call_api.lambda_handler",
-            environment={**debug_env, "OUTBOUND_BUCKET": outbound_bucket.bucket_name},
-            timeout=Duration.seconds(60),
-            role=service_role,
-            log_retention=log_retention,
+            "call_api",
+            service_role,
+            environment={
+                **copy_env,
+                **idempotency_env,
+                **api_env,
+                "OUTBOUND_BUCKET": outbound_bucket.bucket_name,
+            },
         )
+        if idempotency_env:
+            idempotency_table.grant_read_write_data(call_api_lambda)
 
         # create a Q for retrying failed calls
+        # objects that failed RetryMaxAttempts times are moved here by
+        # send_to_retry_queue and handle_retries. the redrive policy is a
+        # backstop for messages that keep being received without an attempt.
+        retry_max_attempts = int(self.node.try_get_context("RetryMaxAttempts") or 10)
+        retry_dead_letter_queue = sqs.Queue(
+            self,
+            "RetryDeadLetterQueue",
+            retention_period=Duration.days(14),
+        )
         retry_queue = sqs.Queue(
             self,
             "RetryQueue",
             retention_period=Duration.days(2),
             visibility_timeout=Duration.seconds(60),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=retry_max_attempts, queue=retry_dead_letter_queue
+            ),
         )
 
+        # call_api keeps retried objects' messages invisible while it works
+        retry_queue.grant(call_api_lambda, "sqs:ChangeMessageVisibility")
+
         service_role = iam.Role(
             self,
             "DeleteMessageRole",
@@ -310,16 +567,20 @@ class UploaderStack(Stack):
             },
         )
 
-        delete_message_lambda = _lambda.Function(
-            self,
-            "DeleteMessage",
-            runtime=runtime,
-            code=_lambda.Code.from_asset(os.path.join(lambda_root, "delete_message")),
-            handler="delete_message.lambda_handler",
-            environment={**debug_env},
-            timeout=Duration.seconds(60),
-            role=service_role,
-            log_retention=log_retention,
+        delete_message_lambda = handler_function(
+            "DeleteMessage", "delete_message", service_role
+        )
+
+        delete_batch_size = int(self.node.try_get_context("DeleteBatchSize") or 100)
+        delete_batching_window = int(
+            self.node.try_get_context("DeleteBatchingWindowSeconds") or 5
+        )
+        delete_message_target = buffered_target(
+            "DeleteMessageQueue",
+            delete_message_lambda,
+            "DeleteMessageMode",
+            delete_batch_size,
+            delete_batching_window,
         )
 
         delete_message_rule = events.Rule(
@@ -330,11 +591,12 @@ class UploaderStack(Stack):
                 source=[call_api_lambda.function_arn],
                 detail={
                     "Bucket": [inbound_bucket.bucket_name],
-                    "status": ["succeeded"],
+                    # duplicates of objects that are already done
+                    "status": ["succeeded", "duplicate"],
                     "message": {"queue_url": [{"exists": True}]},
                 },
             ),
-            targets=[targets.LambdaFunction(delete_message_lambda)],
+            targets=[delete_message_target],
         )
 
         service_role = iam.Role(
@@ -347,7 +609,8 @@ class UploaderStack(Stack):
                     assign_sids=True,
                     statements=[
                         iam.PolicyStatement(
-                            actions=["s3:DeleteObject"],
+                            # versions, in a versioned bucket
+                            actions=["s3:DeleteObject", "s3:DeleteObjectVersion"],
                             effect=iam.Effect.ALLOW,
                             resources=[
                                 inbound_bucket.bucket_arn,
@@ -359,16 +622,16 @@ class UploaderStack(Stack):
             },
         )
 
-        delete_object_lambda = _lambda.Function(
-            self,
-            "DeleteObject",
-            runtime=runtime,
-            code=_lambda.Code.from_asset(os.path.join(lambda_root, "delete_object")),
-            handler="delete_object.lambda_handler",
-            environment={**debug_env},
-            timeout=Duration.seconds(60),
-            role=service_role,
-            log_retention=log_retention,
+        delete_object_lambda = handler_function(
+            "DeleteObject", "delete_object", service_role
+        )
+
+        delete_object_target = buffered_target(
+            "DeleteObjectQueue",
+            delete_object_lambda,
+            "DeleteObjectMode",
+            delete_batch_size,
+            delete_batching_window,
         )
 
         delete_object_rule = events.Rule(
@@ -379,10 +642,11 @@ class UploaderStack(Stack):
                 source=[call_api_lambda.function_arn],
                 detail={
                     "Bucket": [inbound_bucket.bucket_name],
-                    "status": ["succeeded"],
+                    # including uploads of content that was already sent
+                    "status": ["succeeded", "duplicate"],
                 },
             ),
-            targets=[targets.LambdaFunction(delete_object_lambda)],
+            targets=[delete_object_target],
         )
 
         # role and function for the "failed" case
@@ -398,25 +662,42 @@ class UploaderStack(Stack):
                         iam.PolicyStatement(
                             actions=["sqs:SendMessage"],
                             effect=iam.Effect.ALLOW,
-                            resources=[retry_queue.queue_arn],
+                            resources=[
+                                retry_queue.queue_arn,
+                                retry_dead_letter_queue.queue_arn,
+                            ],
                         )
                     ],
                 )
             },
         )
 
-        send_to_retry_queue_lambda = _lambda.Function(
-            self,
-            "SendToRetryQueue",
-            runtime=runtime,
-            code=_lambda.Code.from_asset(
-                os.path.join(lambda_root, "send_to_retry_queue")
+        # exponential backoff between attempts (uploader_runtime.retries)
+        retry_env = {
+            "QUEUE_URL": retry_queue.queue_url,
+            "RETRY_BACKOFF_BASE_SECONDS": str(
+                self.node.try_get_context("RetryBackoffBaseSeconds") or 60
             ),
-            handler="send_to_retry_queue.lambda_handler",
-            environment={**debug_env, "QUEUE_URL": retry_queue.queue_url},
-            timeout=Duration.seconds(60),
-            role=service_role,
-            log_retention=log_retention,
+            "RETRY_BACKOFF_MAX_SECONDS": str(
+                self.node.try_get_context("RetryBackoffMaxSeconds") or 900
+            ),
+            "RETRY_MAX_ATTEMPTS": str(retry_max_attempts),
+            "RETRY_DLQ_URL": retry_dead_letter_queue.queue_url,
+        }
+
+        send_to_retry_queue_lambda = handler_function(
+            "SendToRetryQueue",
+            "send_to_retry_queue",
+            service_role,
+            environment=retry_env,
+        )
+
+        failed_target = buffered_target(
+            "ApiFailedQueue",
+            send_to_retry_queue_lambda,
+            "SendToRetryQueueMode",
+            int(self.node.try_get_context("RetrySendBatchSize") or 100),
+            int(self.node.try_get_context("RetrySendBatchingWindowSeconds") or 5),
         )
 
         failed_rule = events.Rule(
@@ -433,7 +714,7 @@ class UploaderStack(Stack):
                     "message": {"queue_url": [{"exists": False}]},
                 },
             ),
-            targets=[targets.LambdaFunction(send_to_retry_queue_lambda)],
+            targets=[failed_target],
         )
 
         # handle retries
@@ -447,10 +728,21 @@ class UploaderStack(Stack):
                     assign_sids=True,
                     statements=[
                         iam.PolicyStatement(
-                            actions=["sqs:ReceiveMessage"],
+                            actions=[
+                                "sqs:ReceiveMessage",
+                                # backoff before the next attempt
+                                "sqs:ChangeMessageVisibility",
+                                # moving messages to the dead-letter queue
+                                "sqs:DeleteMessage",
+                            ],
                             effect=iam.Effect.ALLOW,
                             resources=[retry_queue.queue_arn],
                         ),
+                        iam.PolicyStatement(
+                            actions=["sqs:SendMessage"],
+                            effect=iam.Effect.ALLOW,
+                            resources=[retry_dead_letter_queue.queue_arn],
+                        ),
                         iam.PolicyStatement(
                             actions=["events:PutEvents"],
                             effect=iam.Effect.ALLOW,
@@ -461,16 +753,11 @@ class UploaderStack(Stack):
             },
         )
 
-        handle_retries_lambda = _lambda.Function(
-            self,
+        handle_retries_lambda = handler_function(
             "HandleRetries",
-            runtime=runtime,
-            code=_lambda.Code.from_asset(os.path.join(lambda_root, "handle_retries")),
-            handler="handle_retries.lambda_handler",
-            environment={**debug_env, "QUEUE_URL": retry_queue.queue_url},
-            timeout=Duration.seconds(60),
-            role=service_role,
-            log_retention=log_retention,
+            "handle_retries",
+            service_role,
+            environment=retry_env,
         )
 
         ready_for_api_rule = events.Rule(
@@ -479,8 +766,10 @@ class UploaderStack(Stack):
             event_pattern=events.EventPattern(
                 detail_type=[detail_type],
                 source=[
-                    new_object_received_lambda.function_arn,
+                    *ready_for_api_sources,
                     handle_retries_lambda.function_arn,
+                    # resumed multipart copies
+                    call_api_lambda.function_arn,
                 ],
                 detail={
                     "Bucket": [inbound_bucket.bucket_name],
@@ -490,14 +779,36 @@ class UploaderStack(Stack):
             targets=[targets.LambdaFunction(call_api_lambda)],
         )
 
-        # rule to run handle_retries once per minute
-        handle_retries_rule = events.Rule(
-            self,
-            "HandleRetriesRule",
-            enabled=True,
-            schedule=events.Schedule.rate(Duration.minutes(1)),
-            targets=[targets.LambdaFunction(handle_retries_lambda)],
-        )
+        # "schedule" drains the Q once per minute. "event_source" has Lambda
+        # poll the Q and invoke handle_retries with batches of messages.
+        retry_mode = self.node.try_get_context("RetryMode") or "schedule"
+
+        if retry_mode == "event_source":
+            batch_size = int(self.node.try_get_context("RetryBatchSize") or 10)
+            batching_window = int(
+                self.node.try_get_context("RetryBatchingWindowSeconds") or 0
+            )
+            handle_retries_lambda.add_event_source(
+                event_sources.SqsEventSource(
+                    retry_queue,
+                    batch_size=batch_size,
+                    max_batching_window=Duration.seconds(batching_window),
+                    report_batch_item_failures=True,
+                )
+            )
+
+        elif retry_mode == "schedule":
+            # rule to run handle_retries once per minute
+            handle_retries_rule = events.Rule(
+                self,
+                "HandleRetriesRule",
+                enabled=True,
+                schedule=events.Schedule.rate(Duration.minutes(1)),
+                targets=[targets.LambdaFunction(handle_retries_lambda)],
+            )
+
+        else:
+            raise ValueError(f"unknown RetryMode {retry_mode}")
 
         # addToResourcePolicy()?
         inbound_bucket.grant_read(call_api_lambda.role)
@@ -508,3 +819,6 @@ class UploaderStack(Stack):
 
         CfnOutput(self, "InboundBucket", value=inbound_bucket.bucket_name)
         CfnOutput(self, "OutboundBucket", value=outbound_bucket.bucket_name)
+        CfnOutput(
+            self, "RetryDeadLetterQueueUrl", value=retry_dead_letter_queue.queue_url
+        )